@@ -1,6 +1,9 @@
 import requests
 import re
 import json
+import threading
+import time
+from api.circuitbreaker import CircuitBreaker
 from getenv import env
 
 
@@ -8,13 +11,57 @@ class BILLException(Exception):
     pass
 
 
+class BILLMetrics:
+    '''
+    Per-process latency metrics of the calls to BILL, per operation (add, del or get).
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}
+
+    def record(self, operation, seconds, error=None):
+        with self.lock:
+            m = self.operations.setdefault(operation, {'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0, 'last_error': None})
+            ms = seconds * 1000
+            m['calls'] += 1
+            m['total_ms'] += ms
+            m['max_ms'] = max(m['max_ms'], ms)
+            m['last_ms'] = ms
+            if error:
+                m['errors'] += 1
+                m['last_error'] = error
+
+    def get(self):
+        with self.lock:
+            return {
+                operation: {**m, 'mean_ms': m['total_ms'] / m['calls']}
+                for operation, m in self.operations.items()
+            }
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+
+
+bill_metrics = BILLMetrics()
+bill_breaker = CircuitBreaker('BILL')
+
+# A shared session keeps the connections to BILL open between calls, instead of doing a new TCP and TLS handshake every time
+session = requests.Session()
+
+
 class BILLAccountManager:
     ERROR_ACCOUNT_DOES_NOT_EXIST = "BILL account does not exist"
+    # The idempotent get calls are retried this many times after a connection error, a timeout or a server error, waiting RETRY_BACKOFF * 2^n seconds before retry n
+    RETRIES = 2
+    RETRY_BACKOFF = 0.2
 
     def __init__(self):
         self.api_url = env("BILL_API_URL")
         self.user = env("BILL_API_USER")
         self.password = env("BILL_API_PW")
+        self.timeout = (env("BILL_CONNECT_TIMEOUT", 3), env("BILL_READ_TIMEOUT", 10))
 
     def admin_url(self, bill_code):
         if not self.api_url:
@@ -22,13 +69,37 @@ class BILLAccountManager:
         return f'{"/".join(self.api_url.split("/")[:-2])}/admin/userdata?id={bill_code}'
 
     def __request(self, path):
-        try:
-            r = requests.post(self.api_url + path, auth=(self.user, self.password))
-        except:
-            raise BILLException("Could not connect to BILL server")
-
-        if r.status_code != 200:
-            raise BILLException(f"BILL returned status code {r.status_code}")
+        # Fail fast if BILL has been unreachable too many times in a row, see CircuitBreaker
+        if not bill_breaker.allow():
+            raise BILLException(bill_breaker.get_error_message())
+
+        operation = path.split('?')[0]
+        retries = self.RETRIES if operation == 'get' else 0
+        for retry in range(retries + 1):
+            if retry:
+                time.sleep(self.RETRY_BACKOFF * 2 ** (retry - 1))
+            start = time.perf_counter()
+            try:
+                r = session.post(self.api_url + path, auth=(self.user, self.password), timeout=self.timeout)
+                error = f"BILL returned status code {r.status_code}" if r.status_code != 200 else None
+            except requests.Timeout:
+                r, error = None, "BILL server did not respond in time"
+            except requests.RequestException as e:
+                r, error = None, f"Could not connect to BILL server ({e.__class__.__name__})"
+            bill_metrics.record(operation, time.perf_counter() - start, error)
+
+            # Client errors will not go away by retrying
+            if not error or (r is not None and r.status_code < 500):
+                break
+
+        # Only connection errors, timeouts and server errors mean that BILL is unavailable
+        if error and (r is None or r.status_code >= 500):
+            bill_breaker.failure(error)
+        else:
+            bill_breaker.success()
+
+        if error:
+            raise BILLException(error)
 
         # Not a number, return as text
         try:
@@ -0,0 +1,92 @@
+import threading
+import time
+from getenv import env
+
+
+class CircuitBreaker:
+    '''
+    Stops calling an external service for a while after it has failed too many times in a row, so that a service that is down does not make every request wait for a timeout.
+
+    - Closed: calls are allowed, and failure_threshold failures in a row open the circuit
+    - Open: calls fail fast for reset_timeout seconds, after which the circuit is half-open
+    - Half-open: one call is allowed through as a probe, and its success closes the circuit while a failure opens it again
+
+    The callers check allow() before calling the service, and report the outcome with success() or failure(). Only failures of the service itself (for example connection errors and timeouts) should be reported as failures, not errors caused by the request.
+
+    The state is per process, like the connections.
+    '''
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold if failure_threshold is not None else env(f'{name}_BREAKER_FAILURES', 5)
+        self.reset_timeout = reset_timeout if reset_timeout is not None else env(f'{name}_BREAKER_RESET_TIMEOUT', 30)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = None
+        self.probe_started = None
+        self.last_error = None
+        self.rejected = 0
+
+    def allow(self):
+        '''
+        Returns True if the service can be called. In the half-open state only one caller at a time gets to probe the service, but a probe that has not reported back in reset_timeout seconds is given up on.
+        '''
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self.opened >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.probe_started = None
+            if self.state == self.HALF_OPEN and (self.probe_started is None or now - self.probe_started >= self.reset_timeout):
+                self.probe_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened = None
+            self.probe_started = None
+
+    def failure(self, error=None):
+        with self.lock:
+            self.failures += 1
+            self.last_error = str(error) if error else None
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened = time.monotonic()
+                self.probe_started = None
+
+    def retry_in(self):
+        '''
+        Returns the amount of seconds until the next probe is allowed, or 0 if the circuit is not open.
+        '''
+        with self.lock:
+            if self.state != self.OPEN:
+                return 0
+            return max(0, self.reset_timeout - (time.monotonic() - self.opened))
+
+    def get_status(self):
+        retry_in = self.retry_in()
+        with self.lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout': self.reset_timeout,
+                'retry_in': round(retry_in, 1),
+                'rejected': self.rejected,
+                'last_error': self.last_error,
+            }
+
+    def get_error_message(self):
+        return f'{self.name} server is unavailable, trying again in {self.retry_in():.0f} seconds'
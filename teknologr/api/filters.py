@@ -69,6 +69,9 @@ class BaseFilter(django_filters.rest_framework.FilterSet):
     def filter_count(self, queryset, value, field_name):
         name = f'n_{field_name}'
         queryset = queryset.annotate(**{name: Count(field_name, distinct=True)})
+        return self.filter_range(queryset, value, name)
+
+    def filter_range(self, queryset, value, name):
         min = value.start
         max = value.stop
         if min is not None:
@@ -237,7 +240,7 @@ class DecorationFilter(BaseFilter):
     )
 
     def filter_n_ownerships(self, queryset, name, value):
-        return self.filter_count(queryset, value, 'ownerships')
+        return self.filter_range(queryset, value, 'n_ownerships')
 
 class DecorationOwnershipFilter(BaseFilter):
     decoration__id = django_filters.NumberFilter(label='Betygelsens id')
@@ -261,7 +264,7 @@ class FunctionaryTypeFilter(BaseFilter):
     # XXX: What about filtering on unique functionaries?
 
     def filter_n_functionaries_total(self, queryset, name, value):
-        return self.filter_count(queryset, value, 'functionaries')
+        return self.filter_range(queryset, value, 'n_functionaries_total')
 
 class FunctionaryFilter(BaseFilter):
     functionarytype__id = django_filters.NumberFilter(label='Postens id')
@@ -286,7 +289,7 @@ class GroupTypeFilter(BaseFilter):
     # XXX: What about filtering on amount of members (total and unique)?
 
     def filter_n_groups(self, queryset, name, value):
-        return self.filter_count(queryset, value, 'groups')
+        return self.filter_range(queryset, value, 'n_groups')
 
 class GroupFilter(BaseFilter):
     begin_date = django_filters.DateFromToRangeFilter(label='Startdatumet är mellan')
@@ -302,7 +305,7 @@ class GroupFilter(BaseFilter):
     )
 
     def filter_n_members(self, queryset, name, value):
-        return self.filter_count(queryset, value, 'memberships')
+        return self.filter_range(queryset, value, 'n_members')
 
 class GroupMembershipFilter(BaseFilter):
     group__id = django_filters.NumberFilter(label='Undergruppens id')
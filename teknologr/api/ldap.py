@@ -1,7 +1,11 @@
 import ldap
 import ldap.modlist
+from api.circuitbreaker import CircuitBreaker
+from django.core.cache import cache
 from getenv import env
 
+import os
+import threading
 import time
 
 '''All methods here can throw ldap.LDAPError'''
@@ -16,22 +20,150 @@ def LDAPError_to_string(e):
         s += f' ({info})'
     return s
 
-class LDAPAccountManager:
-    def __init__(self):
+class LDAPConnectionPool:
+    '''
+    A process-wide pool of bound LDAP connections, since connecting and binding over TLS takes much longer than the actual operations.
+
+    - At most max_size connections are in use or idle at the same time, acquire() waits for a free one for wait_timeout seconds
+    - Connections that have been idle for longer than idle_timeout seconds are closed instead of reused
+    - Connections that have been idle for longer than check_after seconds are checked to be alive before they are reused
+    - The connections reconnect and bind again automatically if the server has closed them (see ReconnectLDAPObject)
+    '''
+
+    def __init__(self, max_size=None, idle_timeout=None, wait_timeout=None, check_after=10):
+        self.max_size = max_size if max_size is not None else env('LDAP_POOL_MAX_SIZE', 5)
+        self.idle_timeout = idle_timeout if idle_timeout is not None else env('LDAP_POOL_IDLE_TIMEOUT', 300)
+        self.wait_timeout = wait_timeout if wait_timeout is not None else env('LDAP_POOL_WAIT_TIMEOUT', 10)
+        self.check_after = check_after
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # A list of (connection, time when released) pairs, the most recently released last
+        self.idle = []
+        self.free = threading.BoundedSemaphore(self.max_size)
+        self.pid = os.getpid()
+
+    def connect(self):
         # Don't require certificates
         ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
         # Attempts no connection, simply initializes the object.
-        self.ldap = ldap.initialize(env("LDAP_SERVER_URI", "ldaps://localhost:45671"))
-
-    def __enter__(self):
-        self.ldap.simple_bind_s(
+        connection = ldap.ldapobject.ReconnectLDAPObject(env("LDAP_SERVER_URI", "ldaps://localhost:45671"), retry_max=2, retry_delay=0.5)
+        connection.set_option(ldap.OPT_NETWORK_TIMEOUT, 10)
+        connection.simple_bind_s(
             env("LDAP_ADMIN_BIND_DN", "admin"),
             env("LDAP_ADMIN_PW", "hunter2")
         )
+        return connection
+
+    def close(self, connection):
+        try:
+            connection.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    def is_alive(self, connection):
+        try:
+            connection.whoami_s()
+            return True
+        except ldap.LDAPError:
+            return False
+
+    def acquire(self):
+        with self.lock:
+            # The connections can not be shared with forked processes
+            if self.pid != os.getpid():
+                self.reset()
+            free = self.free
+
+        if not free.acquire(timeout=self.wait_timeout):
+            raise ldap.TIMEOUT({'desc': 'No free connection in the LDAP connection pool'})
+
+        try:
+            while True:
+                with self.lock:
+                    if not self.idle:
+                        break
+                    connection, released = self.idle.pop()
+                idle_time = time.monotonic() - released
+                if idle_time > self.idle_timeout:
+                    self.close(connection)
+                elif idle_time <= self.check_after or self.is_alive(connection):
+                    return connection
+                else:
+                    self.close(connection)
+            return self.connect()
+        except BaseException:
+            free.release()
+            raise
+
+    def release(self, connection, discard=False):
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            if not discard:
+                self.idle.append((connection, time.monotonic()))
+            self.free.release()
+        if discard:
+            self.close(connection)
+
+    def clear(self):
+        '''
+        Close all idle connections.
+        '''
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection, _ in idle:
+            self.close(connection)
+
+
+ldap_pool = LDAPConnectionPool()
+ldap_breaker = CircuitBreaker('LDAP')
+
+
+class LDAPAccountManager:
+    '''
+    The LDAP connection is taken from the process-wide pool when it is first needed, and returned to it when leaving the context.
+
+    If the server could not be reached too many times in a row, no connection is attempted for a while and ldap.SERVER_DOWN is raised right away instead, see CircuitBreaker.
+    '''
+
+    # How many times reserving a uidNumber is attempted, see get_next_uidnumber()
+    UIDNUMBER_ATTEMPTS = 100
+    # The user and group details are cached for this many seconds, see get_cached()
+    CACHE_TIMEOUT = env('LDAP_CACHE_TIMEOUT', 60)
+
+    def __init__(self, pool=None, breaker=None):
+        self.pool = pool or ldap_pool
+        self.breaker = breaker or ldap_breaker
+        self.connection = None
+
+    def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.ldap.unbind_s()
+        if self.connection is not None:
+            # The connection can not be trusted anymore if the server could not be reached
+            unreachable = isinstance(exc_value, (ldap.SERVER_DOWN, ldap.TIMEOUT))
+            self.pool.release(self.connection, discard=unreachable)
+            self.connection = None
+            if unreachable:
+                self.breaker.failure(LDAPError_to_string(exc_value))
+            else:
+                self.breaker.success()
+
+    @property
+    def ldap(self):
+        # The connection is acquired only when needed, so that nothing is done if everything is found in the cache
+        if self.connection is None:
+            if not self.breaker.allow():
+                raise ldap.SERVER_DOWN({'desc': self.breaker.get_error_message()})
+            try:
+                self.connection = self.pool.acquire()
+            except (ldap.SERVER_DOWN, ldap.TIMEOUT) as e:
+                self.breaker.failure(LDAPError_to_string(e))
+                raise
+        return self.connection
 
     def add_account(self, member, username, password):
         # Adds new account for the given member with the given username and password
@@ -79,12 +211,46 @@ class LDAPAccountManager:
         # Add user to Members group
         group_dn = env("LDAP_MEMBER_GROUP_DN")
         self.ldap.modify_s(group_dn, [(ldap.MOD_ADD, 'memberUid', username.encode('utf-8'))])
+        self.invalidate_cache(username, group_dn)
 
     def get_next_uidnumber(self):
-        # Returns the next free uidnumber greater than 1000
+        '''
+        Reserve the next uidNumber from the counter entry LDAP_UIDNUMBER_COUNTER_DN, so that the whole directory does not need to be searched. The counter is incremented with a compare-and-swap, i.e. by deleting the old value and adding the new one in the same modify operation, which fails if someone else changed it first. In that case the next value is tried.
+
+        Numbers that are already in use (for example by accounts created by hand) are skipped. Without a counter entry the first free uidNumber is searched for, see find_free_uidnumber().
+        '''
+        counter_dn = env("LDAP_UIDNUMBER_COUNTER_DN")
+        if not counter_dn:
+            return self.find_free_uidnumber()
+
+        for _ in range(self.UIDNUMBER_ATTEMPTS):
+            output = self.ldap.search_s(counter_dn, ldap.SCOPE_BASE, attrlist=['uidNumber'])
+            uidnumber = int(output[0][1]['uidNumber'][0])
+            try:
+                self.ldap.modify_s(counter_dn, [
+                    (ldap.MOD_DELETE, 'uidNumber', str(uidnumber).encode('utf-8')),
+                    (ldap.MOD_ADD, 'uidNumber', str(uidnumber + 1).encode('utf-8')),
+                ])
+            except ldap.LDAPError as e:
+                # Result code 16 = noSuchAttribute, i.e. the counter was changed by someone else
+                if e.args[0].get('result') != 16:
+                    raise e
+                continue
+            if not self.uidnumber_in_use(uidnumber):
+                return uidnumber
+
+        raise ldap.LDAPError({'desc': f'Could not reserve a uidNumber in {self.UIDNUMBER_ATTEMPTS} attempts'})
+
+    def uidnumber_in_use(self, uidnumber):
+        return bool(self.ldap.search_s(env("LDAP_USER_DN"), ldap.SCOPE_ONELEVEL, f'(uidNumber={uidnumber})', ['uid']))
+
+    def get_uidnumbers(self):
         output = self.ldap.search_s(env("LDAP_USER_DN"), ldap.SCOPE_ONELEVEL, attrlist=['uidNumber'])
-        uidnumbers = [int(user[1]['uidNumber'][0]) for user in output]
-        uidnumbers.sort()
+        return sorted([int(user[1]['uidNumber'][0]) for user in output])
+
+    def find_free_uidnumber(self):
+        # Returns the next free uidnumber greater than 1000
+        uidnumbers = self.get_uidnumbers()
 
         # Find first free uid over 1000.
         last = 1000
@@ -94,6 +260,26 @@ class LDAPAccountManager:
             last = uid
         return last + 1
 
+    def reset_uidnumber_counter(self):
+        '''
+        Create or reset the counter entry LDAP_UIDNUMBER_COUNTER_DN (see get_next_uidnumber()) to the number after the largest uidNumber in use. Returns the new value.
+        '''
+        counter_dn = env("LDAP_UIDNUMBER_COUNTER_DN")
+        uidnumber = max([1000] + self.get_uidnumbers()) + 1
+        value = str(uidnumber).encode('utf-8')
+        try:
+            self.ldap.modify_s(counter_dn, [(ldap.MOD_REPLACE, 'uidNumber', value)])
+        except ldap.LDAPError as e:
+            # Result code 32 = noSuchObject
+            if e.args[0].get('result') != 32:
+                raise e
+            self.ldap.add_s(counter_dn, ldap.modlist.addModlist({
+                'objectClass': [b'top', b'sambaUnixIdPool'],
+                'uidNumber': [value],
+                'gidNumber': [b'1000'],
+            }))
+        return uidnumber
+
     def check_account(self, username):
         '''
         Check if a certain LDAP account exists.
@@ -122,6 +308,7 @@ class LDAPAccountManager:
         if self.check_account(username):
             dn = env("LDAP_USER_DN_TEMPLATE") % {'user': username}
             self.ldap.delete_s(dn)
+        self.invalidate_cache(username, group_dn)
 
     def change_password(self, username, password):
         # Changes both the user password and the samba password
@@ -132,6 +319,7 @@ class LDAPAccountManager:
             (ldap.MOD_REPLACE, 'sambaNTPassword', nt_pw.encode('utf-8'))
         ]
         self.ldap.modify_s(dn, mod_attrs)
+        self.invalidate_cache(username)
 
     def change_email(self, username, email):
         # Changes the email address for the given user
@@ -140,6 +328,7 @@ class LDAPAccountManager:
             (ldap.MOD_REPLACE, 'mail', email.encode('utf-8')),
         ]
         self.ldap.modify_s(dn, mod_attrs)
+        self.invalidate_cache(username)
 
     def get_samba_password(self, password):
         # The password needs to be stored in a different format for samba
@@ -172,7 +361,30 @@ class LDAPAccountManager:
             attrlist=['uid'])
         return sorted([self.__get_key(user[1], 'uid') for user in result])
 
-    def get_user_details(self, username):
+    def get_cached(self, key, get, refresh=False):
+        '''
+        Read-through cache for the details fetched from LDAP, since fetching them takes a few round trips. The cached details are removed when they are changed through this class (see invalidate_cache()), but changes made elsewhere are seen only after CACHE_TIMEOUT seconds or with refresh=True.
+        '''
+        key = f'ldap:{key}'
+        if not refresh:
+            missing = object()
+            value = cache.get(key, missing)
+            if value is not missing:
+                return value
+        value = get()
+        cache.set(key, value, self.CACHE_TIMEOUT)
+        return value
+
+    def invalidate_cache(self, username, group_dn=None):
+        keys = [f'ldap:user:{username}']
+        if group_dn:
+            keys.append(f'ldap:group:{ldap.dn.explode_dn(group_dn, notypes=True)[0]}')
+        cache.delete_many(keys)
+
+    def get_user_details(self, username, refresh=False):
+        return self.get_cached(f'user:{username}', lambda: self.fetch_user_details(username), refresh)
+
+    def fetch_user_details(self, username):
         result = self.ldap.search_s(
             env('LDAP_USER_DN'),
             ldap.SCOPE_ONELEVEL,
@@ -207,7 +419,10 @@ class LDAPAccountManager:
             ['cn'])
         return sorted([self.__get_key(group[1], 'cn') for group in result])
 
-    def get_group_details(self, group_name):
+    def get_group_details(self, group_name, refresh=False):
+        return self.get_cached(f'group:{group_name}', lambda: self.fetch_group_details(group_name), refresh)
+
+    def fetch_group_details(self, group_name):
         result = self.ldap.search_s(
             env('LDAP_GROUP_DN'),
             ldap.SCOPE_ONELEVEL,
@@ -1,5 +1,18 @@
-from django.core.mail import send_mail
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
 from getenv import env
+from members.models import OutgoingMail
+
+
+def has_valid_email(member):
+    '''
+    Check the e-mail address of the member before sending anything to it. The e-mails are sent later, so an invalid address would otherwise only show up as a dead e-mail on the member page.
+    '''
+    try:
+        validate_email(member.email)
+        return True
+    except ValidationError:
+        return False
 
 
 def mailNewPassword(member, password, sender=env('EMAIL_LDAP_SENDER')):
@@ -22,12 +35,8 @@ def mailNewPassword(member, password, sender=env('EMAIL_LDAP_SENDER')):
 
     receiver = member.email
 
-    return send_mail(
-        subject,
-        message,
-        sender,
-        [receiver],
-        fail_silently=False)
+    # Sent by the send_queued_mail command
+    return OutgoingMail.objects.queue(subject, message, sender, [receiver])
 
 
 def mailNewAccount(member, password, sender=env('EMAIL_LDAP_SENDER')):
@@ -51,9 +60,5 @@ def mailNewAccount(member, password, sender=env('EMAIL_LDAP_SENDER')):
 
     receiver = member.email
 
-    return send_mail(
-        subject,
-        message,
-        sender,
-        [receiver],
-        fail_silently=False)
+    # Sent by the send_queued_mail command
+    return OutgoingMail.objects.queue(subject, message, sender, [receiver])
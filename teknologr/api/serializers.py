@@ -1,5 +1,8 @@
+from collections import OrderedDict
 from django_countries import Countries
+from operator import attrgetter
 from rest_framework import serializers
+from rest_framework.relations import PKOnlyObject
 from members.models import *
 from registration.models import Applicant
 
@@ -13,21 +16,91 @@ class SerializableCountryField(serializers.ChoiceField):
 class BaseSerializer(serializers.ModelSerializer):
     '''
     Base class for all our serializers that automatically removes staff-only fields for normal users. It also captures the 'detail' keyword that signifies that the serializer is used for a detail API view instead, for which inherited classes add more details to the representation.
+
+    The 'fields' and 'omit' keywords are lists of the fields to include and to leave out, if given. Inherited classes check includes() before adding anything to the representation, and the viewsets use is_included() to only fetch what the included fields need.
+
+    The representation of the fields is compiled once per class, see get_compiled_fields().
     '''
 
     STAFF_ONLY = []
+    # The fields that are only included in the detail view
+    DETAIL_ONLY = []
 
-    def __init__(self, *args, detail=False, is_staff=False, **kwargs):
+    def __init__(self, *args, detail=False, is_staff=False, fields=None, omit=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.detail = detail
         self.is_staff = is_staff
+        self.requested_fields = fields
+        self.omitted_fields = omit
+        self.compiled_fields = None
 
-        # Remove staff only fields for normal users
+    def get_fields(self):
+        # Remove staff only fields for normal users, and the fields that were not requested
         # NOTE: This assumes that this serializer instanace is only used for one request
-        if not self.is_staff:
-            for field in self.STAFF_ONLY + ['created', 'modified']:
-                if field in self.fields:
-                    self.fields.pop(field)
+        fields = super().get_fields()
+        for field in list(fields):
+            if not self.includes(field):
+                fields.pop(field)
+        return fields
+
+    @classmethod
+    def get_compiled_fields(cls):
+        '''
+        Returns a list of (field name, function) pairs for all the readable fields of the serializer, where the function returns the representation of the field for an instance.
+
+        ModelSerializer.to_representation() builds the fields for every serializer instance, and then looks up the attribute of every field of every instance in a generic way. The fields of these serializers are all simple model fields or attributes though, so it is enough to figure out once per class how to get each of them. The functions give the same result as DRF does, which is verified by the tests.
+        '''
+        compiled = cls.__dict__.get('_compiled_fields')
+        if compiled is None:
+            serializer = cls(detail=True, is_staff=True)
+            compiled = [(name, cls.compile_field(field)) for name, field in serializer.fields.items() if not field.write_only]
+            cls._compiled_fields = compiled
+        return compiled
+
+    @classmethod
+    def compile_field(cls, field):
+        source = getattr(cls.Meta.model, field.source, None) if len(field.source_attrs) == 1 else None
+        if source is None or callable(source):
+            # Anything else than a field or a property of the model, like annotations and methods, is looked up by DRF
+            def get(instance):
+                attribute = field.get_attribute(instance)
+                value = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+                return None if value is None else field.to_representation(attribute)
+            return get
+
+        if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+            # The same as the PKOnlyObject optimization of DRF, without creating the object
+            return attrgetter(cls.Meta.model._meta.get_field(field.source).attname)
+
+        attribute = attrgetter(field.source)
+        to_representation = field.to_representation
+
+        def get(instance):
+            value = attribute(instance)
+            return None if value is None else to_representation(value)
+        return get
+
+    def to_representation(self, instance):
+        if self.compiled_fields is None:
+            self.compiled_fields = [(name, get) for name, get in self.get_compiled_fields() if self.includes(name)]
+        try:
+            return OrderedDict([(name, get(instance)) for name, get in self.compiled_fields])
+        except serializers.SkipField:
+            # A field is missing from the instance, which DRF knows how to handle
+            return super().to_representation(instance)
+
+    @classmethod
+    def is_included(cls, field, detail=False, is_staff=False, fields=None, omit=None):
+        if not is_staff and field in cls.STAFF_ONLY + ['created', 'modified']:
+            return False
+        if not detail and field in cls.DETAIL_ONLY:
+            return False
+        if fields is not None and field not in fields:
+            return False
+        return not omit or field not in omit
+
+    def includes(self, field):
+        return self.is_included(field, self.detail, self.is_staff, self.requested_fields, self.omitted_fields)
 
     def get_minimal_id_name(self, instance):
         return {'id': instance.id, 'name': instance.name}
@@ -39,7 +112,8 @@ class BaseSerializer(serializers.ModelSerializer):
 # Members
 
 class MemberSerializer(BaseSerializer):
-    STAFF_ONLY = Member.STAFF_ONLY_FIELDS
+    STAFF_ONLY = Member.STAFF_ONLY_FIELDS + ['membertypes']
+    DETAIL_ONLY = ['decorations', 'functionaries', 'groups', 'membertypes']
 
     country = SerializableCountryField(allow_blank=True, choices=Countries(), required=False)
     n_decorations = serializers.IntegerField(read_only=True)
@@ -48,7 +122,7 @@ class MemberSerializer(BaseSerializer):
 
     class Meta:
         model = Member
-        fields = '__all__'
+        exclude = Member.SORT_KEY_FIELDS + Member.MEMBERSHIP_FIELDS + ['address_key']
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
@@ -56,35 +130,35 @@ class MemberSerializer(BaseSerializer):
         hide = not self.is_staff and not instance.showContactInformation()
         if hide:
             for field in Member.HIDABLE_FIELDS:
-                data.pop(field)
+                data.pop(field, None)
 
-        # Add the actual related objects if detail view
-        # XXX: Do we need to prefetch all related objects here? It's now done earlier, by the caller...
-        if self.detail:
+        # Add the actual related objects if detail view (prefetched by the viewset)
+        if self.includes('decorations'):
             data['decorations'] = [{
                 'decoration': {'id': do.decoration.id, 'name': do.decoration.name},
                 'acquired': do.acquired,
             } for do in instance.decoration_ownerships.all()]
+        if self.includes('functionaries'):
             data['functionaries'] = [{
                 'functionarytype': {'id': f.functionarytype.id, 'name': f.functionarytype.name},
                 'begin_date': f.begin_date,
                 'end_date': f.end_date,
             } for f in instance.functionaries.all()]
+        if self.includes('groups'):
             data['groups'] = [{
                 'grouptype': {'id': gm.group.grouptype.id, 'name': gm.group.grouptype.name},
                 'begin_date': gm.group.begin_date,
                 'end_date': gm.group.end_date,
             } for gm in instance.group_memberships.all()]
-
-            if self.is_staff:
-                data['membertypes'] = [{
-                    'type': mt.type,
-                    'begin_date': mt.begin_date,
-                    'end_date': mt.end_date,
-                } for mt in instance.member_types.all()]
+        if self.includes('membertypes'):
+            data['membertypes'] = [{
+                'type': mt.type,
+                'begin_date': mt.begin_date,
+                'end_date': mt.end_date,
+            } for mt in instance.member_types.all()]
 
         # Modify certain fields if necessary
-        if hide:
+        if hide and 'given_names' in data:
             data['given_names'] = instance.get_given_names_with_initials()
 
         return data
@@ -97,15 +171,17 @@ class GroupTypeSerializer(BaseSerializer):
     n_members_total = serializers.IntegerField(read_only=True)
     n_members_unique = serializers.IntegerField(read_only=True)
 
+    DETAIL_ONLY = ['groups']
+
     class Meta:
         model = GroupType
-        fields = '__all__'
+        exclude = ['n_groups_non_empty']
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
 
         # Add the actual related objects if detail view
-        if self.detail:
+        if self.includes('groups'):
             data['groups'] = [{
                 'id': g.id,
                 'begin_date': g.begin_date,
@@ -117,6 +193,7 @@ class GroupTypeSerializer(BaseSerializer):
 
 class GroupSerializer(BaseSerializer):
     n_members = serializers.IntegerField(read_only=True)
+    DETAIL_ONLY = ['members']
 
     class Meta:
         model = Group
@@ -128,14 +205,15 @@ class GroupSerializer(BaseSerializer):
         # XXX: Should it be n_members/members or n_memberships/memberships (or some other combination)? It feels silly having a list of memberships that looks like [{id, member}, ..], so skipping over the actual GroupMembership objects here. Could of course add a field called membership_id, but I don't see that being needed...
 
         # Add the actual related objects if detail view
-        if self.detail:
+        if self.includes('members'):
             data['members'] = [{
                 'id': gm.member.id,
                 'name': gm.member.public_full_name,
             } for gm in instance.memberships.select_related('member')]
 
         # Always show the grouptype as a subobject
-        data['grouptype'] = self.get_minimal_id_name(instance.grouptype)
+        if self.includes('grouptype'):
+            data['grouptype'] = self.get_minimal_id_name(instance.grouptype)
 
         return data
 
@@ -146,15 +224,17 @@ class GroupMembershipSerializer(BaseSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        group = instance.group
 
-        data['member'] = self.get_minimal_member(instance.member)
-        data['group'] = {
-            'id': group.id,
-            'begin_date': group.begin_date,
-            'end_date': group.end_date,
-            'grouptype': self.get_minimal_id_name(group.grouptype)
-        }
+        if self.includes('member'):
+            data['member'] = self.get_minimal_member(instance.member)
+        if self.includes('group'):
+            group = instance.group
+            data['group'] = {
+                'id': group.id,
+                'begin_date': group.begin_date,
+                'end_date': group.end_date,
+                'grouptype': self.get_minimal_id_name(group.grouptype)
+            }
 
         return data
 
@@ -164,6 +244,7 @@ class GroupMembershipSerializer(BaseSerializer):
 class FunctionaryTypeSerializer(BaseSerializer):
     n_functionaries_total = serializers.IntegerField(read_only=True)
     n_functionaries_unique = serializers.IntegerField(read_only=True)
+    DETAIL_ONLY = ['functionaries']
 
     class Meta:
         model = FunctionaryType
@@ -173,7 +254,7 @@ class FunctionaryTypeSerializer(BaseSerializer):
         data = super().to_representation(instance)
 
         # Add the actual related objects if detail view
-        if self.detail:
+        if self.includes('functionaries'):
             data['functionaries'] = [{
                 'id': f.id,
                 'begin_date': f.begin_date,
@@ -190,8 +271,10 @@ class FunctionarySerializer(BaseSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        data['functionarytype'] = self.get_minimal_id_name(instance.functionarytype)
-        data['member'] = self.get_minimal_member(instance.member)
+        if self.includes('functionarytype'):
+            data['functionarytype'] = self.get_minimal_id_name(instance.functionarytype)
+        if self.includes('member'):
+            data['member'] = self.get_minimal_member(instance.member)
         return data
 
 
@@ -199,6 +282,7 @@ class FunctionarySerializer(BaseSerializer):
 
 class DecorationSerializer(BaseSerializer):
     n_ownerships = serializers.IntegerField(read_only=True)
+    DETAIL_ONLY = ['ownerships']
 
     class Meta:
         model = Decoration
@@ -208,7 +292,7 @@ class DecorationSerializer(BaseSerializer):
         data = super().to_representation(instance)
 
         # Add the actual related objects if detail view
-        if self.detail:
+        if self.includes('ownerships'):
             data['ownerships'] = [{
                 'id': do.id,
                 'acquired': do.acquired,
@@ -224,8 +308,10 @@ class DecorationOwnershipSerializer(BaseSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        data['decoration'] = self.get_minimal_id_name(instance.decoration)
-        data['member'] = self.get_minimal_member(instance.member)
+        if self.includes('decoration'):
+            data['decoration'] = self.get_minimal_id_name(instance.decoration)
+        if self.includes('member'):
+            data['member'] = self.get_minimal_member(instance.member)
         return data
 
 
@@ -238,7 +324,8 @@ class MemberTypeSerializer(BaseSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        data['member'] = self.get_minimal_member(instance.member)
+        if self.includes('member'):
+            data['member'] = self.get_minimal_member(instance.member)
         return data
 
 
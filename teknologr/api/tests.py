@@ -346,6 +346,24 @@ class MembersAPITest(BaseAPITest, GetAllMethodTests, PostMethodTests):
         self.check_response(results[1], MEMBER_PUBLIC)
         self.check_response(results[2], MEMBER_PERSONAL)
 
+    def test_get_all_not_modified(self):
+        self.login_user()
+        etag = self.get_all()['ETag']
+        response = self.client.get(self.api_path, HTTP_IF_NONE_MATCH=etag)
+        self.check_status_code(response, status.HTTP_304_NOT_MODIFIED)
+
+        # The ETag depends on the user being staff, since staff see more fields
+        self.login_superuser()
+        response = self.client.get(self.api_path, HTTP_IF_NONE_MATCH=etag)
+        self.check_status_code(response, status.HTTP_200_OK)
+
+        # A change in a related table changes the ETag too
+        etag = response['ETag']
+        self.d.name = 'My renamed decoration'
+        self.d.save()
+        response = self.client.get(self.api_path, HTTP_IF_NONE_MATCH=etag)
+        self.check_status_code(response, status.HTTP_200_OK)
+
 class MemberHiddenAPITest(BaseAPITest, GetOneMethodTests):
     def setUp(self):
         super().setUp()
@@ -709,4 +727,4 @@ class RootAPIPageTests(BaseAPITest):
         self.login_superuser()
         response = self.get_all()
         self.check_status_code(response, status.HTTP_200_OK)
-        self.assertEqual(16, len(response.json()))
+        self.assertEqual(17, len(response.json()))
@@ -0,0 +1,93 @@
+import os
+from unittest.mock import patch
+from django.test import SimpleTestCase
+from api.bill import BILLAccountManager, BILLException, bill_breaker, bill_metrics
+from api.testservers import BILLStandInServer
+
+
+@patch.object(BILLAccountManager, 'RETRY_BACKOFF', 0)
+class BILLAccountManagerTest(SimpleTestCase):
+    def setUp(self):
+        self.server = BILLStandInServer().__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        env = patch.dict(os.environ, {'BILL_API_URL': self.server.api_url, 'BILL_READ_TIMEOUT': '0.5'})
+        env.start()
+        self.addCleanup(env.stop)
+        bill_metrics.reset()
+        bill_breaker.reset()
+        self.addCleanup(bill_breaker.reset)
+        self.bm = BILLAccountManager()
+
+    def test_accounts(self):
+        code = self.bm.create_bill_account('svakar')
+        self.assertEqual({'acc': code, 'id': 'svakar', 'type': 'user', 'balance': 0}, self.bm.get_account_by_code(code))
+        self.assertEqual(code, self.bm.get_account_by_username('svakar')['acc'])
+        self.bm.delete_bill_account(code)
+        self.assertIsNone(self.bm.get_account_by_code(code))
+        self.assertIsNone(self.bm.get_account_by_username('svakar'))
+
+    def test_admin_url(self):
+        self.assertTrue(self.bm.admin_url(1001).endswith('/bill/admin/userdata?id=1001'))
+
+    def test_retry_get(self):
+        self.server.fail(times=2)
+        self.assertIsNone(self.bm.get_account_by_code(1001))
+        self.assertEqual(3, self.server.requests)
+
+    def test_retry_limit(self):
+        self.server.fail(times=3)
+        with self.assertRaisesMessage(BILLException, 'BILL returned status code 500'):
+            self.bm.get_account_by_code(1001)
+
+    def test_no_retry_client_error(self):
+        self.server.fail(status=403)
+        with self.assertRaisesMessage(BILLException, 'BILL returned status code 403'):
+            self.bm.get_account_by_code(1001)
+        self.assertEqual(1, self.server.requests)
+
+    def test_no_retry_add(self):
+        self.server.fail()
+        with self.assertRaises(BILLException):
+            self.bm.create_bill_account('svakar')
+        self.assertEqual(1, self.server.requests)
+        self.assertEqual({}, self.server.accounts)
+
+    def test_timeout(self):
+        self.server.fail(times=3, delay=1)
+        with self.assertRaisesMessage(BILLException, 'BILL server did not respond in time'):
+            self.bm.get_account_by_code(1001)
+
+    def test_connection_error(self):
+        self.server.__exit__(None, None, None)
+        with self.assertRaisesMessage(BILLException, 'Could not connect to BILL server'):
+            self.bm.create_bill_account('svakar')
+
+    def test_metrics(self):
+        self.server.fail()
+        self.bm.get_account_by_code(1001)
+        code = self.bm.create_bill_account('svakar')
+        metrics = bill_metrics.get()
+        self.assertEqual(2, metrics['get']['calls'])
+        self.assertEqual(1, metrics['get']['errors'])
+        self.assertEqual('BILL returned status code 500', metrics['get']['last_error'])
+        self.assertEqual(1, metrics['add']['calls'])
+        self.assertEqual(0, metrics['add']['errors'])
+        self.assertGreater(metrics['add']['mean_ms'], 0)
+
+    @patch.object(bill_breaker, 'failure_threshold', 2)
+    def test_circuit_breaker(self):
+        self.server.fail(times=6)
+        for _ in range(2):
+            with self.assertRaisesMessage(BILLException, 'BILL returned status code 500'):
+                self.bm.get_account_by_code(1001)
+        # Fails fast without calling BILL
+        with self.assertRaisesMessage(BILLException, 'BILL server is unavailable'):
+            self.bm.get_account_by_code(1001)
+        self.assertEqual(6, self.server.requests)
+
+    @patch.object(bill_breaker, 'failure_threshold', 1)
+    def test_circuit_breaker_ignores_client_errors(self):
+        self.server.fail(status=403)
+        with self.assertRaises(BILLException):
+            self.bm.get_account_by_code(1001)
+        self.assertIsNone(self.bm.get_account_by_code(1001))
@@ -0,0 +1,74 @@
+from unittest.mock import patch
+from django.test import SimpleTestCase
+from rest_framework import status
+from api.circuitbreaker import CircuitBreaker
+from api.tests import BaseAPITest
+
+
+@patch('api.circuitbreaker.time.monotonic')
+class CircuitBreakerTest(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker('TEST', failure_threshold=2, reset_timeout=30)
+
+    def test_opens_after_failures_in_a_row(self, monotonic):
+        monotonic.return_value = 0
+        self.breaker.failure('down')
+        self.breaker.success()
+        self.breaker.failure('down')
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure('down')
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual('open', self.breaker.get_status()['state'])
+        self.assertEqual('down', self.breaker.get_status()['last_error'])
+
+    def test_half_open_probe(self, monotonic):
+        monotonic.return_value = 0
+        self.breaker.failure()
+        self.breaker.failure()
+        monotonic.return_value = 29
+        self.assertFalse(self.breaker.allow())
+        monotonic.return_value = 30
+        # Only one probe at a time
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual('half-open', self.breaker.get_status()['state'])
+        self.breaker.success()
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe(self, monotonic):
+        monotonic.return_value = 0
+        self.breaker.failure()
+        self.breaker.failure()
+        monotonic.return_value = 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(30, self.breaker.get_status()['retry_in'])
+
+    def test_lost_probe(self, monotonic):
+        monotonic.return_value = 0
+        self.breaker.failure()
+        self.breaker.failure()
+        monotonic.return_value = 30
+        self.assertTrue(self.breaker.allow())
+        monotonic.return_value = 60
+        self.assertTrue(self.breaker.allow())
+
+
+class ExternalStatusTest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        self.api_path = '/api/accounts/status/'
+
+    def test_get_for_users(self):
+        self.login_user()
+        response = self.get_all()
+        self.check_status_code(response, status.HTTP_403_FORBIDDEN)
+
+    def test_get_for_superusers(self):
+        self.login_superuser()
+        response = self.get_all()
+        self.check_status_code(response, status.HTTP_200_OK)
+        self.assertEqual('closed', response.data['ldap']['state'])
+        self.assertIn('operations', response.data['bill'])
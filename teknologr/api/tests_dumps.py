@@ -3,7 +3,9 @@ from members.models import *
 from registration.models import *
 from rest_framework import status
 from rest_framework.test import APITestCase
-from datetime import datetime
+from datetime import date, datetime
+from api.utils import get_active_roster, get_next_roster_change, iterate_in_chunks
+import json
 
 today = datetime.today().strftime('%Y-%m-%d')
 
@@ -49,8 +51,13 @@ class BaseClass(APITestCase):
 
 
 class DumpsTestCases():
-    def get(self):
-        return self.client.get(self.path)
+    def get(self, **kwargs):
+        return self.client.get(self.path, **kwargs)
+
+    def get_content(self, response):
+        if response.streaming:
+            return b''.join(response.streaming_content)
+        return response.content
 
     def test_get_for_anonymous_users(self):
         response = self.get()
@@ -65,7 +72,14 @@ class DumpsTestCases():
         self.login_superuser()
         response = self.get()
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(self.response, response.json())
+        self.assertEqual(self.response, json.loads(self.get_content(response)))
+
+    def test_get_csv_for_superuser(self):
+        self.login_superuser()
+        response = self.get(HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = self.get_content(response).decode('utf-8').splitlines()
+        self.assertTrue(rows[0].startswith(sorted(self.response if isinstance(self.response, dict) else self.response[0])[0]))
 
 class HTK_Full(BaseClass, DumpsTestCases):
     path = f'/api/dump-htk/'
@@ -101,6 +115,34 @@ class Modulen(BaseClass, DumpsTestCases):
         'country': 'Finland',
     }]
 
+class ModulenAddresses(BaseClass):
+    def add_member(self, street_address, **kwargs):
+        m = Member.objects.create(**{'street_address': street_address, 'city': 'Kouvola', 'country': 'FI', 'subscribed_to_modulen': True, **kwargs})
+        MemberType.objects.create(member=m, type='OM', begin_date='1999-01-01')
+        return m
+
+    def get_addresses(self):
+        self.login_superuser()
+        response = self.client.get('/api/dump-modulen/')
+        return sorted(r['street_address'] for r in json.loads(b''.join(response.streaming_content)))
+
+    def test_one_per_address(self):
+        self.add_member('ok 22')
+        self.add_member('OK 22.')
+        self.add_member('OK23')
+        self.assertEqual(['OK22', 'OK23', 'ok 22'], self.get_addresses())
+
+    def test_without_address(self):
+        self.add_member('')
+        self.add_member('')
+        self.assertEqual(['', '', 'OK22'], self.get_addresses())
+
+    def test_not_subscribed_or_invalid(self):
+        self.add_member('OK23', subscribed_to_modulen=False)
+        Member.objects.create(street_address='OK24', subscribed_to_modulen=True)
+        self.assertEqual(['OK22'], self.get_addresses())
+
+
 class Active(BaseClass, DumpsTestCases):
     path = f'/api/dump-active/'
     response = [{
@@ -139,3 +181,60 @@ class Studentbladet(BaseClass, DumpsTestCases):
         'city': 'Kouvola',
         'country': 'FI',
     }]
+
+
+class IterateInChunksTest(BaseClass):
+    def setUp(self):
+        super().setUp()
+        for i in range(6):
+            Member.objects.create(given_names=f'Svakar {i}', surname='von Teknolog', city=f'Kouvola {i % 2}')
+
+    def test_chunks(self):
+        members = list(Member.objects.order_by('pk'))
+        # 7 members in chunks of 2
+        with self.assertNumQueries(4):
+            self.assertEqual(members, list(iterate_in_chunks(Member.objects.all(), chunk_size=2)))
+
+    def test_composite_keys(self):
+        members = Member.objects.order_by('city', 'pk')
+        self.assertEqual(list(members), list(iterate_in_chunks(members, ('city', 'pk'), chunk_size=3)))
+
+
+class ActiveRosterTest(BaseClass):
+    def test_cached(self):
+        roster = get_active_roster()
+        with self.assertNumQueries(1):
+            self.assertEqual(roster, get_active_roster())
+
+    def test_invalidated_by_changes(self):
+        get_active_roster()
+        FunctionaryType.objects.update(name='Funktionär')
+        # Updating in bulk does not send any signals
+        self.assertEqual('Funkkis', get_active_roster()[0]['position'])
+        FunctionaryType.objects.get().save()
+        self.assertEqual('Funktionär', get_active_roster()[0]['position'])
+
+        m = Member.objects.get()
+        m.surname = 'af Teknolog'
+        m.save()
+        self.assertEqual('Sverker Svakar af Teknolog', get_active_roster()[0]['member'])
+
+    def test_next_change(self):
+        today = date(2020, 6, 15)
+        Functionary.objects.all().delete()
+        self.assertIsNone(get_next_roster_change(today))
+
+        ft = FunctionaryType.objects.get()
+        gt = GroupType.objects.create(name='Styrelsen')
+        m = Member.objects.get()
+        # A functionary is active until the end of the end date
+        Functionary.objects.create(member=m, functionarytype=ft, begin_date=date(2020, 1, 1), end_date=date(2020, 12, 31))
+        self.assertEqual(date(2021, 1, 1), get_next_roster_change(today))
+        # A group is active after the begin date
+        Group.objects.create(grouptype=gt, begin_date=date(2020, 6, 15), end_date=date(2020, 12, 31))
+        self.assertEqual(date(2020, 6, 16), get_next_roster_change(today))
+        Functionary.objects.create(member=m, functionarytype=ft, begin_date=date(2020, 6, 16), end_date=date(2020, 12, 31))
+        self.assertEqual(date(2020, 6, 16), get_next_roster_change(today))
+        # Past intervals do not matter
+        Group.objects.create(grouptype=gt, begin_date=date(2019, 1, 1), end_date=date(2020, 6, 15))
+        self.assertEqual(date(2020, 6, 16), get_next_roster_change(today))
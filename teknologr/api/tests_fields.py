@@ -0,0 +1,67 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from api.tests import BaseAPITest
+
+
+class SparseFieldsTest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        self.login_superuser()
+
+    def get(self, path):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path)
+        self.check_status_code(response, status.HTTP_200_OK)
+        self.queries = [q['sql'] for q in context.captured_queries]
+        return response.json()
+
+    def count_queries(self, table):
+        return len([q for q in self.queries if f'"{table}"' in q])
+
+    def test_list_fields(self):
+        data = self.get('/api/members/?fields=id,surname')
+        self.assertEqual([{'id': m.id, 'surname': m.surname} for m in self.ms], data['results'])
+        # Only the page (and the count) is queried
+        self.assertEqual(0, self.count_queries('members_decorationownership'))
+        self.assertEqual(0, self.count_queries('members_functionary'))
+        self.assertEqual(0, self.count_queries('members_groupmembership'))
+
+        data = self.get('/api/members/?fields=id,n_groups')
+        self.assertEqual([{'id': m.id, 'n_groups': n} for m, n in zip(self.ms, [2, 1, 1])], data['results'])
+        self.assertEqual(0, self.count_queries('members_decorationownership'))
+
+    def test_list_omit(self):
+        data = self.get('/api/members/?omit=n_decorations,n_functionaries,comment')
+        self.assertEqual(3, len(data['results']))
+        for result in data['results']:
+            self.assertNotIn('comment', result)
+            self.assertNotIn('n_decorations', result)
+            self.assertIn('n_groups', result)
+        self.assertEqual(0, self.count_queries('members_decorationownership'))
+        self.assertEqual(0, self.count_queries('members_functionary'))
+
+    def test_detail_fields(self):
+        data = self.get(f'/api/members/{self.m1.id}/?fields=id,decorations')
+        self.assertEqual(['id', 'decorations'], list(data))
+        self.assertEqual(self.d.id, data['decorations'][0]['decoration']['id'])
+        self.assertEqual(1, self.count_queries('members_decorationownership'))
+        self.assertEqual(0, self.count_queries('members_groupmembership'))
+        self.assertEqual(0, self.count_queries('members_membertype'))
+
+    def test_detail_only_fields_in_list(self):
+        data = self.get('/api/members/?fields=id,decorations')
+        self.assertEqual([{'id': m.id} for m in self.ms], data['results'])
+        self.assertEqual(0, self.count_queries('members_decorationownership'))
+
+    def test_staff_only_fields(self):
+        self.login_user()
+        data = self.get(f'/api/members/{self.m1.id}/?fields=id,membertypes,comment')
+        self.assertEqual({'id': self.m1.id}, data)
+        self.assertEqual(0, self.count_queries('members_membertype'))
+
+    def test_related_fields(self):
+        data = self.get('/api/groupmemberships/?fields=id,member')
+        self.assertEqual({'id', 'member'}, set(data['results'][0]))
+        self.assertEqual(0, self.count_queries('members_group'))
+        self.assertEqual(0, self.count_queries('members_grouptype'))
@@ -0,0 +1,229 @@
+import ldap
+import os
+from unittest.mock import Mock, patch
+from django.test import SimpleTestCase, TestCase
+from api.ldap import LDAPAccountManager, LDAPConnectionPool, ldap_breaker
+from api.tests import BaseAPITest
+from members.models import Member, OutgoingMail
+
+
+class FakeConnection:
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+
+
+class FakeConnectionPool(LDAPConnectionPool):
+    '''
+    Tests the pooling itself, without connecting to any server.
+    '''
+
+    def __init__(self, **kwargs):
+        super().__init__(**{'max_size': 2, 'idle_timeout': 60, 'wait_timeout': 0, **kwargs})
+        self.connections = []
+
+    def connect(self):
+        self.connections.append(FakeConnection())
+        return self.connections[-1]
+
+    def close(self, connection):
+        connection.closed = True
+
+    def is_alive(self, connection):
+        return connection.alive
+
+
+class LDAPConnectionPoolTest(SimpleTestCase):
+    def setUp(self):
+        self.pool = FakeConnectionPool()
+        ldap_breaker.reset()
+        self.addCleanup(ldap_breaker.reset)
+
+    def use(self):
+        with LDAPAccountManager(self.pool) as lm:
+            return lm.ldap
+
+    def age(self, seconds):
+        self.pool.idle = [(c, released - seconds) for c, released in self.pool.idle]
+
+    def test_reuse(self):
+        self.assertIs(self.use(), self.use())
+        self.assertEqual(1, len(self.pool.connections))
+
+    def test_max_size(self):
+        c1 = self.pool.acquire()
+        c2 = self.pool.acquire()
+        self.assertIsNot(c1, c2)
+        with self.assertRaises(ldap.TIMEOUT):
+            self.pool.acquire()
+        self.pool.release(c1)
+        self.assertIs(c1, self.pool.acquire())
+
+    def test_idle_timeout(self):
+        c1 = self.use()
+        self.age(61)
+        c2 = self.use()
+        self.assertIsNot(c1, c2)
+        self.assertTrue(c1.closed)
+
+    def test_liveness_check(self):
+        c1 = self.use()
+        c1.alive = False
+        # Not checked if just used
+        self.assertIs(c1, self.use())
+        self.age(self.pool.check_after + 1)
+        c2 = self.use()
+        self.assertIsNot(c1, c2)
+        self.assertTrue(c1.closed)
+
+    def test_discard_after_server_down(self):
+        with self.assertRaises(ldap.SERVER_DOWN):
+            with LDAPAccountManager(self.pool) as lm:
+                c1 = lm.ldap
+                raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+        self.assertTrue(c1.closed)
+        self.assertIsNot(c1, self.use())
+
+    def test_keep_after_other_errors(self):
+        with self.assertRaises(ldap.NO_SUCH_OBJECT):
+            with LDAPAccountManager(self.pool) as lm:
+                c1 = lm.ldap
+                raise ldap.NO_SUCH_OBJECT({'desc': 'No such object'})
+        self.assertIs(c1, self.use())
+
+    @patch.object(ldap_breaker, 'failure_threshold', 2)
+    def test_circuit_breaker(self):
+        def connect():
+            raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+        self.pool.connect = connect
+        for _ in range(2):
+            with self.assertRaisesRegex(ldap.SERVER_DOWN, "Can't contact"):
+                self.use()
+        # Fails fast without connecting
+        self.pool.connect = Mock()
+        with self.assertRaisesRegex(ldap.SERVER_DOWN, 'LDAP server is unavailable'):
+            self.use()
+        self.pool.connect.assert_not_called()
+
+    def test_clear(self):
+        c1 = self.use()
+        self.pool.clear()
+        self.assertTrue(c1.closed)
+        self.assertIsNot(c1, self.use())
+
+
+class FakeDirectory:
+    '''
+    Implements just enough of an LDAP connection for reserving uidNumbers.
+    '''
+
+    def __init__(self, counter, uidnumbers):
+        self.counter = counter
+        self.uidnumbers = uidnumbers
+        self.searches = 0
+        # Called before every modification, to simulate someone else doing something at the same time
+        self.before_modify = lambda: None
+
+    def search_s(self, base, scope, filterstr=None, attrlist=None):
+        self.searches += 1
+        if base == 'cn=counter':
+            return [(base, {'uidNumber': [str(self.counter).encode()]})]
+        return [(f'uid=u{n}', {'uidNumber': [str(n).encode()]}) for n in self.uidnumbers if filterstr in [None, f'(uidNumber={n})']]
+
+    def modify_s(self, dn, modlist):
+        self.before_modify()
+        (_, _, old), (_, _, new) = modlist
+        if int(old) != self.counter:
+            raise ldap.NO_SUCH_ATTRIBUTE({'desc': 'No such attribute', 'result': 16})
+        self.counter = int(new)
+
+
+@patch.dict(os.environ, {'LDAP_USER_DN': 'ou=People', 'LDAP_UIDNUMBER_COUNTER_DN': 'cn=counter'})
+class UIDNumberTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = FakeDirectory(1005, [1001, 1002, 1004, 1006])
+        self.lm = LDAPAccountManager()
+        self.lm.connection = self.directory
+
+    def test_reserve(self):
+        self.assertEqual(1005, self.lm.get_next_uidnumber())
+        self.assertEqual(1007, self.lm.get_next_uidnumber())
+        self.assertEqual(1008, self.directory.counter)
+
+    def test_concurrent_reserve(self):
+        def reserve_by_someone_else():
+            self.directory.before_modify = lambda: None
+            self.directory.counter += 1
+        self.directory.before_modify = reserve_by_someone_else
+        self.assertEqual(1007, self.lm.get_next_uidnumber())
+
+    def test_constant_searches(self):
+        self.directory.uidnumbers = list(range(2000, 3000))
+        self.lm.get_next_uidnumber()
+        self.assertEqual(2, self.directory.searches)
+
+    def test_without_counter(self):
+        with patch.dict(os.environ, {'LDAP_UIDNUMBER_COUNTER_DN': ''}):
+            self.assertEqual(1003, self.lm.get_next_uidnumber())
+
+
+class CountingAccountManager(LDAPAccountManager):
+    def __init__(self, pool):
+        super().__init__(pool)
+        self.fetches = 0
+
+    def fetch_user_details(self, username):
+        self.fetches += 1
+        return {'username': username, 'fetch': self.fetches}
+
+
+@patch.dict(os.environ, {'LDAP_USER_DN_TEMPLATE': 'uid=%(user)s'})
+class UserDetailsCacheTest(TestCase):
+    def setUp(self):
+        self.pool = FakeConnectionPool()
+        self.lm = CountingAccountManager(self.pool)
+
+    def test_cached(self):
+        with self.lm:
+            self.assertEqual(1, self.lm.get_user_details('svakar')['fetch'])
+        with self.lm:
+            self.assertEqual(1, self.lm.get_user_details('svakar')['fetch'])
+            self.assertEqual(2, self.lm.get_user_details('svatta')['fetch'])
+        # Fetching is faked here, so no connection should be needed at all
+        self.assertEqual([], self.pool.connections)
+
+    def test_refresh(self):
+        with self.lm:
+            self.lm.get_user_details('svakar')
+            self.assertEqual(2, self.lm.get_user_details('svakar', refresh=True)['fetch'])
+            self.assertEqual(2, self.lm.get_user_details('svakar')['fetch'])
+
+    def test_invalidated_by_changes(self):
+        self.pool.connect = lambda: Mock()
+        with self.lm:
+            self.lm.get_user_details('svakar')
+            self.lm.change_email('svakar', 'svakar@example.com')
+            self.assertEqual(2, self.lm.get_user_details('svakar')['fetch'])
+
+
+class PasswordMailTest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        self.login_superuser()
+        # Saving the Member would sync the e-mail address to LDAP
+        Member.objects.filter(id=self.m1.id).update(username='svakar', email='svakar@teknolog')
+
+    @patch('api.views.LDAPAccountManager')
+    def test_invalid_email(self, manager):
+        response = self.client.post(f'/api/accounts/ldap/change_pw/{self.m1.id}/', {'password': 'hemligt', 'mail_to_user': 'send'})
+        self.assertEqual(400, response.status_code)
+        self.assertIn('svakar@teknolog', response.content.decode())
+        # The password is not changed if it can not be sent
+        manager.assert_not_called()
+        self.assertFalse(OutgoingMail.objects.exists())
+
+    @patch('api.views.LDAPAccountManager')
+    def test_without_mail(self, manager):
+        response = self.client.post(f'/api/accounts/ldap/change_pw/{self.m1.id}/', {'password': 'hemligt'})
+        self.assertEqual(200, response.status_code)
+        manager.return_value.__enter__.return_value.change_password.assert_called_once_with('svakar', 'hemligt')
@@ -107,3 +107,51 @@ class UsernamesByMTTests(BaseClass, TestCases):
 
     def get(self, type):
         return self.client.get(f'/api/membersByMemberType/{type}/usernames')
+
+
+class ConditionalTests(BaseClass):
+    def get(self, **headers):
+        return self.client.get('/api/membersByMemberType/OM/', **headers)
+
+    def test_not_modified(self):
+        self.login_superuser()
+        response = self.get()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        # Only the table versions are queried, after the session and the user
+        with self.assertNumQueries(3):
+            response = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_modified(self):
+        self.login_superuser()
+        etag = self.get()['ETag']
+
+        self.m2.username = 'vonteks3'
+        self.m2.save()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), ['123456', '654321'])
+        self.assertNotEqual(etag, response['ETag'])
+
+        etag = response['ETag']
+        MemberType.objects.create(member=self.m3, type='OM', begin_date='2010-01-01')
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), ['123456', '654321', None])
+
+    def test_etag_depends_on_the_url(self):
+        self.login_superuser()
+        etag = self.get()['ETag']
+        response = self.client.get('/api/membersByMemberType/JS/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_bulk_update(self):
+        self.login_superuser()
+        etag = self.get()['ETag']
+        Member.objects.filter(id=self.m2.id).update(student_id='111111')
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), ['123456', '111111'])
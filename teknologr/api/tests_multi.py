@@ -0,0 +1,115 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from members.models import *
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+class BaseClass(APITestCase):
+    def setUp(self):
+        self.superuser = User.objects.create_superuser(username='superuser', password='teknolog')
+        self.client.login(username='superuser', password='teknolog')
+
+        self.m1 = Member.objects.create(given_names='Sverker Svakar', surname='von Teknolog')
+        self.m2 = Member.objects.create(given_names='Svatta', surname='von Teknolog')
+
+    def post(self, members, **data):
+        return self.client.post(self.api_path, {**data, 'member': f'|{"|".join(members)}|'})
+
+class MultiGroupMembershipsTest(BaseClass):
+    api_path = '/api/multi-groupmemberships/'
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.gt = GroupType.objects.create(name='Grupp')
+            self.g = Group.objects.create(grouptype=self.gt, begin_date='2020-01-01', end_date='2020-12-31')
+            GroupMembership.objects.create(group=self.g, member=self.m1)
+
+    def test_create(self):
+        # The statistics are updated when the transaction is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post([str(self.m1.id), str(self.m2.id), '$Ny Medlem', str(self.m2.id), '9999'], group=self.g.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        new_member = Member.objects.get(surname='Medlem')
+        self.assertEqual('Ny', new_member.given_names)
+        self.assertEqual({
+            'created': [self.m2.id, new_member.id],
+            'skipped': [self.m1.id],
+            'new_members': [new_member.id],
+            'not_found': ['9999'],
+        }, response.json())
+        self.assertEqual(3, self.g.memberships.count())
+
+        # The denormalized data is updated even though no signals are sent
+        self.g.refresh_from_db()
+        self.gt.refresh_from_db()
+        self.assertEqual(3, self.g.n_members)
+        self.assertEqual(3, self.gt.n_members_unique)
+        self.assertEqual(3, YearStatistics.objects.get(year=2020).group_memberships_total)
+
+    def test_constant_queries(self):
+        members = [str(Member.objects.create(given_names='A', surname=f'B{i}').id) for i in range(20)]
+        with CaptureQueriesContext(connection) as one:
+            self.post(members[:1], group=self.g.id)
+        with CaptureQueriesContext(connection) as many:
+            self.post(members[1:], group=self.g.id)
+        self.assertEqual(len(one), len(many))
+        self.assertEqual(21, self.g.memberships.count())
+
+    def test_group_not_found(self):
+        response = self.post([str(self.m2.id)], group=9999)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class MultiFunctionariesTest(BaseClass):
+    api_path = '/api/multi-functionaries/'
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ft = FunctionaryType.objects.create(name='Post')
+            Functionary.objects.create(functionarytype=self.ft, member=self.m1, begin_date='2020-01-01', end_date='2020-12-31')
+
+    def test_create(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post([str(self.m1.id), str(self.m2.id)], functionarytype=self.ft.id, begin_date='2020-01-01', end_date='2021-12-31')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([self.m1.id, self.m2.id], response.json()['created'])
+        self.assertEqual(3, self.ft.functionaries.count())
+        self.ft.refresh_from_db()
+        self.assertEqual(3, self.ft.n_functionaries_total)
+        self.assertEqual(2, YearStatistics.objects.get(year=2021).functionaries_total)
+
+    def test_skip_existing(self):
+        response = self.post([str(self.m1.id), str(self.m2.id)], functionarytype=self.ft.id, begin_date='2020-01-01', end_date='2020-12-31')
+        self.assertEqual([self.m2.id], response.json()['created'])
+        self.assertEqual([self.m1.id], response.json()['skipped'])
+
+    def test_invalid_date_applies_nothing(self):
+        with self.assertRaises(Exception):
+            self.post(['$Ny Medlem', str(self.m2.id)], functionarytype=self.ft.id, begin_date='2020-01-01', end_date='xxx')
+        self.assertFalse(Member.objects.filter(surname='Medlem').exists())
+        self.assertEqual(1, self.ft.functionaries.count())
+
+class MultiDecorationOwnershipsTest(BaseClass):
+    api_path = '/api/multi-decorationownerships/'
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.d = Decoration.objects.create(name='Betygelse')
+            DecorationOwnership.objects.create(decoration=self.d, member=self.m1, acquired='2020-01-01')
+
+    def test_create(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post([str(self.m1.id), str(self.m2.id)], decoration=self.d.id, acquired='2020-01-01')
+        self.assertEqual({
+            'created': [self.m2.id],
+            'skipped': [self.m1.id],
+            'new_members': [],
+            'not_found': [],
+        }, response.json())
+        self.d.refresh_from_db()
+        self.assertEqual(2, self.d.n_ownerships)
+        self.assertEqual(2, YearStatistics.objects.get(year=2020).decoration_ownerships)
@@ -0,0 +1,90 @@
+from django.core.cache import cache
+from members.models import *
+from rest_framework import status
+from api.tests import BaseAPITest
+
+
+class CursorPaginationTest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.login_superuser()
+
+    def crawl(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.check_status_code(response, status.HTTP_200_OK)
+            data = response.json()
+            ids += [obj['id'] for obj in data['results']]
+            url = data['next']
+        return ids, data
+
+    def test_crawl(self):
+        ids, data = self.crawl('/api/members/?cursor=&limit=2')
+        self.assertEqual([m.id for m in self.ms], ids)
+        self.assertIsNone(data['count'])
+        self.assertIsNotNone(data['previous'])
+
+    def test_crawl_with_ties(self):
+        # All members have the same surname, so the id decides
+        ids, _ = self.crawl('/api/members/?cursor=&limit=1&ordering=-surname')
+        self.assertEqual([m.id for m in self.ms], ids)
+
+        ids, _ = self.crawl('/api/members/?cursor=&limit=1&ordering=-preferred_name,-id')
+        self.assertEqual([self.m3.id, self.m2.id, self.m1.id], ids)
+
+    def test_crawl_related(self):
+        ids, _ = self.crawl('/api/groupmemberships/?cursor=&limit=3&ordering=-group__begin_date')
+        expected = GroupMembership.objects.order_by('-group__begin_date', 'id').values_list('id', flat=True)
+        self.assertEqual(list(expected), ids)
+
+    def test_previous(self):
+        data = self.client.get('/api/members/?cursor=&limit=1').json()
+        self.assertIsNone(data['previous'])
+        data = self.client.get(data['next']).json()
+        data = self.client.get(data['next']).json()
+        self.assertEqual(self.m3.id, data['results'][0]['id'])
+        self.assertIsNone(data['next'])
+
+        data = self.client.get(data['previous']).json()
+        self.assertEqual(self.m2.id, data['results'][0]['id'])
+        self.assertIsNotNone(data['next'])
+        data = self.client.get(data['previous']).json()
+        self.assertEqual(self.m1.id, data['results'][0]['id'])
+        self.assertIsNone(data['previous'])
+
+    def test_stable_while_adding(self):
+        data = self.client.get('/api/members/?cursor=&limit=2&ordering=surname').json()
+        Member.objects.create(given_names='Aaron', surname='Aalto')
+        data = self.client.get(data['next']).json()
+        self.assertEqual([self.m3.id], [obj['id'] for obj in data['results']])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/members/?cursor=invalid')
+        self.check_status_code(response, status.HTTP_404_NOT_FOUND)
+
+        # A cursor is only valid for the ordering it was created with
+        url = self.client.get('/api/members/?cursor=&limit=1&ordering=surname').json()['next']
+        response = self.client.get(url.replace('ordering=surname', 'ordering=id'))
+        self.check_status_code(response, status.HTTP_404_NOT_FOUND)
+
+    def test_count(self):
+        data = self.client.get('/api/members/?cursor=&limit=1&count=1').json()
+        self.assertEqual(3, data['count'])
+
+
+class CachedCountTest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.login_superuser()
+
+    def test_count(self):
+        self.assertEqual(3, self.client.get('/api/members/?limit=1').json()['count'])
+        # Another page uses the cached count
+        self.assertEqual(3, self.client.get('/api/members/?limit=1&offset=1').json()['count'])
+        self.assertEqual(1, self.client.get('/api/members/?limit=1&offset=1&dead=true').json()['count'])
+
+        Member.objects.create(given_names='Aaron', surname='Aalto')
+        self.assertEqual(4, self.client.get('/api/members/?limit=1&offset=2').json()['count'])
@@ -0,0 +1,72 @@
+from members.tests_queries import QueryBudgetTestCase
+
+
+class APIQueryBudgetTest(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login_superuser()
+
+    def check_viewset(self, path, obj):
+        self.assertQueryBudget(f'/api/{path}/')
+        self.assertQueryBudget(f'/api/{path}/?limit=1000')
+        self.assertQueryBudget(f'/api/{path}/?cursor=&limit=1000')
+        self.assertQueryBudget(f'/api/{path}/{obj.id}/')
+
+    def test_members(self):
+        self.check_viewset('members', self.member)
+        self.assertQueryBudget('/api/members/?fields=id,surname')
+        self.assertQueryBudget('/api/members/?search=von')
+
+    def post_multi(self, path, **data):
+        # Some of the Members already have the object and one of them is new, the amount of queries should not depend on any of it
+        members = '|'.join(str(m.id) for m in self.members[:50])
+        self.assertQueryBudget(f'/api/{path}/', method='post', data={**data, 'member': f'|{members}|$Ny Medlem|'})
+
+    def test_multi_group_memberships_save(self):
+        self.post_multi('multi-groupmemberships', group=self.group.id)
+
+    def test_multi_functionaries_save(self):
+        self.post_multi('multi-functionaries', functionarytype=self.functionary.functionarytype_id, begin_date='2020-01-01', end_date='2020-12-31')
+
+    def test_multi_decoration_ownerships_save(self):
+        self.post_multi('multi-decorationownerships', decoration=self.decoration_ownership.decoration_id, acquired='2020-05-01')
+
+    def test_members_for_users(self):
+        self.login_user()
+        self.check_viewset('members', self.member)
+
+    def test_groups(self):
+        self.check_viewset('grouptypes', self.group.grouptype)
+        self.check_viewset('groups', self.group)
+        self.check_viewset('groupmemberships', self.group.memberships.first())
+
+    def test_functionaries(self):
+        self.check_viewset('functionarytypes', self.functionary.functionarytype)
+        self.check_viewset('functionaries', self.functionary)
+
+    def test_decorations(self):
+        self.check_viewset('decorations', self.decoration_ownership.decoration)
+        self.check_viewset('decorationownerships', self.decoration_ownership)
+
+    def test_member_types(self):
+        self.check_viewset('membertypes', self.member_type)
+
+    def test_applicants(self):
+        self.check_viewset('applicants', self.applicant)
+
+    def test_dumps(self):
+        self.assertQueryBudget('/api/dump-htk/')
+        self.assertQueryBudget(f'/api/dump-htk/{self.member.id}/')
+        self.assertQueryBudget('/api/dump-modulen/')
+        self.assertQueryBudget('/api/dump-active/')
+        self.assertQueryBudget('/api/dump-arsk/')
+        self.assertQueryBudget('/api/dump-regemails/')
+        self.assertQueryBudget('/api/dump-studentbladet/')
+        self.assertQueryBudget('/api/dump-htk/?format=csv')
+
+    def test_member_types_for_member(self):
+        self.assertQueryBudget(f'/api/memberTypesForMember/username/{self.member.username}/')
+
+    def test_members_by_member_type(self):
+        self.assertQueryBudget('/api/membersByMemberType/OM/')
+        self.assertQueryBudget('/api/membersByMemberType/OM/usernames')
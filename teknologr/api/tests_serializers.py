@@ -0,0 +1,58 @@
+from unittest.mock import patch
+from rest_framework import serializers
+from api.serializers import *
+from api.tests import BaseAPITest
+
+
+class CompiledSerializerTest(BaseAPITest):
+    '''
+    The compiled representations need to be identical to what DRF would give.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        # A member with as many empty fields as possible
+        Member.objects.create(given_names='Tom', surname='Tomma')
+
+    def check(self, serializer_class, queryset):
+        objs = list(queryset)
+        for is_staff in [False, True]:
+            for detail in [False, True]:
+                for fields, omit in [(None, None), (['id', 'country', 'surname', 'member', 'n_members'], None), (None, ['id', 'comment'])]:
+                    kwargs = {'is_staff': is_staff, 'detail': detail, 'fields': fields, 'omit': omit}
+                    compiled = serializer_class(objs, many=True, **kwargs).data
+                    with patch.object(BaseSerializer, 'to_representation', serializers.ModelSerializer.to_representation):
+                        expected = serializer_class(objs, many=True, **kwargs).data
+                    self.assertEqual(expected, compiled, kwargs)
+                    self.assertEqual([list(o) for o in expected], [list(o) for o in compiled], kwargs)
+
+    def test_members(self):
+        self.check(MemberSerializer, Member.objects.all_with_related())
+
+    def test_groups(self):
+        self.check(GroupTypeSerializer, GroupType.objects.all())
+        self.check(GroupSerializer, Group.objects.select_related('grouptype'))
+        self.check(GroupMembershipSerializer, GroupMembership.objects.all_with_related())
+
+    def test_functionaries(self):
+        self.check(FunctionaryTypeSerializer, FunctionaryType.objects.all())
+        self.check(FunctionarySerializer, Functionary.objects.all_with_related())
+
+    def test_decorations(self):
+        self.check(DecorationSerializer, Decoration.objects.all())
+        self.check(DecorationOwnershipSerializer, DecorationOwnership.objects.all_with_related())
+
+    def test_member_types(self):
+        self.check(MemberTypeSerializer, MemberType.objects.all_with_related())
+
+    def test_applicants(self):
+        self.check(ApplicantSerializer, Applicant.objects.all())
+
+    def test_missing_attribute(self):
+        # Falls back to DRF, which skips the read only field
+        class Serializer(GroupSerializer):
+            n_missing = serializers.IntegerField(read_only=True)
+
+        data = Serializer(self.g, is_staff=True).data
+        self.assertNotIn('n_missing', data)
+        self.assertEqual(self.g.id, data['id'])
@@ -0,0 +1,256 @@
+import json
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+'''
+Minimal stand-ins for the external services, for benchmarking and testing the integrations without access to the real ones.
+'''
+
+
+def ber_encode(tag, content):
+    length = len(content)
+    if length < 0x80:
+        return bytes([tag, length]) + content
+    n = (length.bit_length() + 7) // 8
+    return bytes([tag, 0x80 | n]) + length.to_bytes(n, 'big') + content
+
+
+def ber_integer(value, tag=0x02):
+    return ber_encode(tag, value.to_bytes(max(1, (value.bit_length() + 8) // 8), 'big', signed=True))
+
+
+def ber_string(value, tag=0x04):
+    return ber_encode(tag, value if isinstance(value, bytes) else value.encode('utf-8'))
+
+
+def ber_decode(data, offset=0):
+    '''
+    Returns the tag and content of the element at the offset, and the offset of the next element. Returns None if the data ends before the element does.
+    '''
+    if len(data) < offset + 2:
+        return None
+    tag, length = data[offset], data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        n = length & 0x7f
+        if len(data) < offset + n:
+            return None
+        length = int.from_bytes(data[offset:offset + n], 'big')
+        offset += n
+    if len(data) < offset + length:
+        return None
+    return tag, data[offset:offset + length], offset + length
+
+
+class LDAPStandInServer:
+    '''
+    A minimal LDAPv3 server without TLS, that accepts every simple bind and answers every search with the same entries. Every other operation succeeds without doing anything.
+
+    The latency is added to every response, and the bind latency to every bind in addition to that, to simulate a remote server and the TLS handshake.
+
+    Usage:
+        with LDAPStandInServer(entries) as server:
+            connection = ldap.initialize(server.uri)
+    '''
+
+    # The response to each request, see RFC 4511
+    BIND, UNBIND, SEARCH, SEARCH_ENTRY, SEARCH_DONE, ABANDON, EXTENDED = 0x60, 0x42, 0x63, 0x64, 0x65, 0x50, 0x77
+    RESPONSE_TAGS = {BIND: 0x61, 0x66: 0x67, 0x68: 0x69, 0x4a: 0x6b, 0x6c: 0x6d, 0x6e: 0x6f, EXTENDED: 0x78}
+
+    def __init__(self, entries=None, latency=0, bind_latency=0):
+        # A list of (dn, {attribute: [value, ...]}) pairs
+        self.entries = entries or []
+        self.latency = latency
+        self.bind_latency = bind_latency
+        self.binds = 0
+        self.connections = set()
+        self.lock = threading.Lock()
+
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                server.handle(self.request)
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def uri(self):
+        host, port = self.server.server_address
+        return f'ldap://{host}:{port}'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+        self.disconnect_all()
+
+    def disconnect_all(self):
+        '''
+        Close all client connections, like a server restart would.
+        '''
+        with self.lock:
+            connections, self.connections = self.connections, set()
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def handle(self, connection):
+        with self.lock:
+            self.connections.add(connection)
+        data = b''
+        try:
+            while True:
+                element = ber_decode(data)
+                if element is None:
+                    chunk = connection.recv(65536)
+                    if not chunk:
+                        return
+                    data += chunk
+                    continue
+                _, message, offset = element
+                data = data[offset:]
+
+                _, message_id, offset = ber_decode(message)
+                tag, _, _ = ber_decode(message, offset)
+                if tag == self.UNBIND:
+                    return
+                for response in self.get_responses(tag):
+                    connection.sendall(ber_encode(0x30, ber_integer(int.from_bytes(message_id, 'big', signed=True)) + response))
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                self.connections.discard(connection)
+            connection.close()
+
+    def get_responses(self, tag):
+        if tag == self.ABANDON:
+            return []
+        time.sleep(self.latency)
+        success = ber_integer(0, tag=0x0a) + ber_string('') + ber_string('')
+
+        if tag == self.SEARCH:
+            responses = [
+                ber_encode(self.SEARCH_ENTRY, ber_string(dn) + ber_encode(0x30, b''.join(
+                    ber_encode(0x30, ber_string(name) + ber_encode(0x31, b''.join(ber_string(v) for v in values)))
+                    for name, values in attributes.items()
+                )))
+                for dn, attributes in self.entries
+            ]
+            return responses + [ber_encode(self.SEARCH_DONE, success)]
+
+        if tag == self.BIND:
+            with self.lock:
+                self.binds += 1
+            time.sleep(self.bind_latency)
+        if tag == self.EXTENDED:
+            # The response value of the "Who am I?" operation
+            success += ber_string('', tag=0x8b)
+        return [ber_encode(self.RESPONSE_TAGS[tag], success)]
+
+
+class BILLStandInServer:
+    '''
+    A minimal BILL server with the same API as the real one (see api/bill.py), that keeps the accounts in memory.
+
+    The latency is added to every response. Failures can be injected with fail(), where the next responses either have the given status code or take the given amount of seconds.
+
+    Usage:
+        with BILLStandInServer() as server:
+            os.environ['BILL_API_URL'] = server.api_url
+    '''
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.accounts = {}
+        self.next_code = 1000
+        self.requests = 0
+        self.failures = []
+        self.lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # The headers and the body are written separately, which would otherwise be delayed on kept-alive connections
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                status, body, delay = server.respond(self.path)
+                time.sleep(delay)
+                body = body.encode('utf-8')
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'text/plain')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def api_url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}/bill/api/'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fail(self, times=1, status=500, delay=0):
+        with self.lock:
+            self.failures += [(status, delay)] * times
+
+    def respond(self, path):
+        '''
+        Returns the status code, the body and the delay of the response.
+        '''
+        with self.lock:
+            self.requests += 1
+            if self.failures:
+                status, delay = self.failures.pop(0)
+                return status, '', self.latency + delay
+
+            url = urlsplit(path)
+            operation = url.path.split('/')[-1]
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            if 'acc' in params:
+                account = self.accounts.get(int(params['acc'])) if params['acc'].isdigit() else None
+            else:
+                account = next((a for a in self.accounts.values() if a['id'] == params.get('id')), None)
+
+            if operation == 'add':
+                if account:
+                    body = '-2'
+                else:
+                    self.next_code += 1
+                    self.accounts[self.next_code] = {'acc': self.next_code, 'id': params.get('id'), 'type': 'user', 'balance': 0}
+                    body = str(self.next_code)
+            elif operation == 'del':
+                body = '0' if account and self.accounts.pop(account['acc']) else '-3'
+            elif operation == 'get':
+                body = json.dumps(account) if account else '-3'
+            else:
+                return 404, '', self.latency
+            return 200, body, self.latency
@@ -71,6 +71,7 @@ urlpatterns = [
     url(r'^accounts/ldap/(\d+)/$', LDAPAccountView.as_view(), name='ldap_account'),
     url(r'^accounts/ldap/change_pw/(\d+)/$', change_ldap_password),
     url(r'^accounts/bill/(\d+)/$', BILLAccountView.as_view(), name='bill'),
+    url(r'^accounts/status/$', external_status, name='external_status'),
     url(r'^applicants/make-member/(\d+)/$', ApplicantMembershipView.as_view()),
     url(r'^dump-htk/(?:(\d+)/)?$', dump_htk, name='dump_htk'),
     url(r'^dump-modulen/$', dump_modulen, name='dump_modulen'),
@@ -1,11 +1,29 @@
 # -*- coding: utf-8 -*-
 
-from django.db.models import Q
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.db.models import F, Q, Min
+from django.http import StreamingHttpResponse
+from django.views.decorators.http import condition
+from functools import reduce
+from getenv import env
+from operator import and_, or_
+from rest_framework.exceptions import NotFound
 from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.pagination import LimitOffsetPagination
-from members.models import Member
-from datetime import datetime
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework_csv.renderers import CSVStreamingRenderer
+from members.models import Member, MemberType, GroupType, Group, GroupMembership, FunctionaryType, Functionary, Decoration, DecorationOwnership, ModelVersion
+from registration.models import Applicant
+from datetime import datetime, timedelta
 from rest_framework.response import Response
+import base64
+import hashlib
+import json
 
 
 def create_dump_response(content, name, filetype):
@@ -16,6 +34,156 @@ def create_dump_response(content, name, filetype):
         headers={'Content-Disposition': f'attachment; {dumpname}'}
     )
 
+def iterate_in_chunks(queryset, keys=('pk', ), chunk_size=500):
+    '''
+    Iterate over a queryset in chunks of chunk_size objects, ordered by the given keys. Each chunk is fetched with its own query (including the prefetches of the queryset), continuing after the keys of the last object of the previous chunk, so that only one chunk is in memory at a time and no chunk needs an OFFSET.
+
+    The keys need to be non-null and together unique among the objects in the queryset.
+    '''
+    queryset = queryset.order_by(*keys)
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last = [getattr(chunk[-1], key) for key in keys]
+        # (a, b) > (x, y) is the same as a > x OR (a = x AND b > y)
+        after = reduce(or_, [
+            Q(**dict(zip(keys[:i], last[:i])), **{f'{keys[i]}__gt': last[i]})
+            for i in range(len(keys))
+        ])
+        chunk = list(queryset.filter(after)[:chunk_size])
+
+
+def create_streaming_dump_response(request, rows, fields):
+    '''
+    Stream the rows (dicts with the given fields) as a JSON array or a CSV file depending on the requested format, so that the whole dump never needs to be in memory and the first rows are sent right away. Lists are joined with newlines in the CSV file.
+
+    The browsable API can not be streamed, so it gets a normal Response.
+    '''
+    format = request.accepted_renderer.format
+    if format == 'api':
+        return Response(list(rows), status=200)
+
+    if format == 'csv':
+        rows = ({key: '\n'.join(value) if isinstance(value, list) else value for key, value in row.items()} for row in rows)
+        # Sorted like the non-streaming CSVRenderer does
+        content = CSVStreamingRenderer().render(rows, renderer_context={'header': sorted(fields)})
+        return StreamingHttpResponse(content, status=200, content_type=request.accepted_renderer.media_type)
+
+    return StreamingHttpResponse(stream_json_array(rows), status=200, content_type='application/json')
+
+
+def stream_json_array(rows, rows_per_write=100):
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    yield '['
+    buffer = []
+    for i, row in enumerate(rows):
+        buffer.append(encoder.encode(row))
+        if len(buffer) == rows_per_write:
+            yield (',' if i >= rows_per_write else '') + ','.join(buffer)
+            buffer = []
+    if buffer:
+        yield (',' if i >= rows_per_write else '') + ','.join(buffer)
+    yield ']'
+
+
+ACTIVE_ROSTER_CACHE_KEY = 'api:active_roster'
+
+
+def get_active_roster():
+    '''
+    Get the current functionaries and the members of the current groups, for dump_active. The roster is cached until the next date it could change on by itself (see get_next_roster_change()), or until any of the objects shown on it are changed (see signals.py).
+    '''
+    roster = cache.get(ACTIVE_ROSTER_CACHE_KEY)
+    if roster is not None:
+        return roster
+
+    now = datetime.today()
+    today = now.date()
+    functionaries = Functionary.objects.all_with_related().filter(begin_date__lte=today, end_date__gte=today).order_by('pk')
+    memberships = GroupMembership.objects.all_with_related().filter(group__begin_date__lt=today, group__end_date__gt=today).order_by('group_id', 'pk')
+    roster = [{
+        'position': f.functionarytype.name,
+        'member': f.member.full_name,
+    } for f in functionaries] + [{
+        'position': str(m.group.grouptype),
+        'member': m.member.full_name,
+    } for m in memberships]
+
+    change = get_next_roster_change(today)
+    timeout = (datetime.combine(change, datetime.min.time()) - now).total_seconds() if change else None
+    cache.set(ACTIVE_ROSTER_CACHE_KEY, roster, timeout)
+    return roster
+
+
+def get_next_roster_change(today):
+    '''
+    Get the first date after today when a functionary or a group starts or stops being active, or None if there is no such date. Functionaries are active from their begin date until their end date, but groups only after their begin date and before their end date.
+    '''
+    f = Functionary.objects.aggregate(
+        begin=Min('begin_date', filter=Q(begin_date__gt=today)),
+        end=Min('end_date', filter=Q(end_date__gte=today)),
+    )
+    g = Group.objects.aggregate(
+        begin=Min('begin_date', filter=Q(begin_date__gte=today)),
+        end=Min('end_date', filter=Q(end_date__gt=today)),
+    )
+    day = timedelta(days=1)
+    changes = [
+        f['begin'],
+        f['end'] and f['end'] + day,
+        g['begin'] and g['begin'] + day,
+        g['end'],
+    ]
+    changes = [d for d in changes if d]
+    return min(changes) if changes else None
+
+
+def invalidate_active_roster():
+    cache.delete(ACTIVE_ROSTER_CACHE_KEY)
+    # A concurrent request could cache the old roster again before the current transaction is committed
+    transaction.on_commit(lambda: cache.delete(ACTIVE_ROSTER_CACHE_KEY))
+
+
+# The models whose tables have a version that is bumped on every change, see conditional()
+VERSIONED_MODELS = [
+    Member,
+    MemberType,
+    GroupType,
+    Group,
+    GroupMembership,
+    FunctionaryType,
+    Functionary,
+    Decoration,
+    DecorationOwnership,
+    Applicant,
+]
+
+
+def conditional(*models):
+    '''
+    Decorator for GET views whose content only depends on the tables of the given models. The ETag and Last-Modified headers are based on the versions of those tables (see ModelVersionManager.bump_tables()), so a client that already has the current content gets a 304 response after a single query, without the view touching the tables at all.
+
+    The ETag also depends on the URL, the requested format and whether the user is staff, since those change the content.
+    '''
+    def get_versions(request):
+        if not hasattr(request, '_table_versions'):
+            request._table_versions = ModelVersion.objects.get_table_versions(models)
+        return request._table_versions
+
+    def get_etag(request, *args, **kwargs):
+        versions = get_versions(request)
+        parts = [request.get_full_path(), request.META.get('HTTP_ACCEPT', ''), str(request.user.is_staff)]
+        parts += [f'{name}:{versions[name][0]}' for name in sorted(versions)]
+        return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    def get_last_modified(request, *args, **kwargs):
+        return max([modified for _, modified in get_versions(request).values()], default=None)
+
+    return condition(etag_func=get_etag, last_modified_func=get_last_modified)
+
+
 def assert_public_member_fields(fields):
     assert len(set(fields).intersection(set(Member.STAFF_ONLY_FIELDS + Member.HIDABLE_FIELDS))) == 0, 'Only 100% public Member fields allowed'
 
@@ -35,8 +203,177 @@ class BrowsableAPIRendererWithoutForms(BrowsableAPIRenderer):
         return ''
 
 
+COUNT_CACHE_TIMEOUT = env('API_COUNT_CACHE_TIMEOUT', 60 * 60)
+
+
+def get_cached_count(queryset, versions=None):
+    '''
+    Count the objects in the queryset, or get the count from the cache. The cache key includes the query and the versions of all the API tables (see conditional()), so a cached count is never used after something has changed. The versions are fetched unless given.
+    '''
+    if versions is None:
+        versions = ModelVersion.objects.get_table_versions(VERSIONED_MODELS)
+    try:
+        sql, params = queryset.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    key = hashlib.sha1(repr((sql, params, sorted(versions.items()))).encode('utf-8')).hexdigest()
+    key = f'api:count:{queryset.model._meta.db_table}:{key}'
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, COUNT_CACHE_TIMEOUT)
+    return count
+
+
 class Pagination(LimitOffsetPagination):
+    '''
+    Limit-offset pagination by default, and keyset pagination if the cursor query parameter is given (empty for the first page). The counts are cached, see get_cached_count().
+
+    Deep offsets are slow since the database needs to skip over all the rows before the offset, and the pages shift if something is added or removed while crawling. In cursor mode a page continues after the ordering values of the last object on the previous page instead, with the id as a tie-breaker, so every page is as fast as the first one. The count is left out in cursor mode unless the count query parameter is given.
+    '''
+
     default_limit = 100
     limit_query_param = 'limit'
     offset_query_param = 'offset'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
     max_limit = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.limit = self.get_limit(request)
+        self.count = self.get_count(queryset) if request.query_params.get(self.count_query_param) else None
+        self.keys = self.get_keys(queryset)
+        values, reverse = self.decode_cursor(request.query_params[self.cursor_query_param])
+
+        ordering = [self.order_by(key, reverse) for key in self.keys]
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self.get_keyset_filter(values, reverse))
+
+        page = list(queryset[:self.limit + 1])
+        has_more = len(page) > self.limit
+        page = page[:self.limit]
+        if reverse:
+            page.reverse()
+            self.has_next, self.has_previous = values is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+
+        self.first = [self.get_value(page[0], key) for key, _ in self.keys] if page else None
+        self.last = [self.get_value(page[-1], key) for key, _ in self.keys] if page else None
+        return page
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_cursor_link(self.last, False) if self.has_next else None),
+            ('previous', self.get_cursor_link(self.first, True) if self.has_previous else None),
+            ('results', data),
+        ]))
+
+    def get_count(self, queryset):
+        # The list views fetch the versions of all the API tables already, see BaseModelViewSet
+        return get_cached_count(queryset, getattr(self.request, '_table_versions', None))
+
+    def get_keys(self, queryset):
+        '''
+        Returns the ordering of the queryset (set by OrderingFilter or the model) as a list of (field, descending) pairs, ending with the primary key to make the ordering unique.
+        '''
+        keys = []
+        for field in queryset.query.order_by or queryset.model._meta.ordering:
+            if not isinstance(field, str):
+                continue
+            descending = field.startswith('-')
+            field = field.lstrip('-')
+            if field in ('pk', 'id'):
+                return keys + [('pk', descending)]
+            if field not in [key for key, _ in keys]:
+                keys.append((field, descending))
+        return keys + [('pk', False)]
+
+    @staticmethod
+    def order_by(key, reverse):
+        field, descending = key
+        # The nulls are always last, so that they can be found in get_keyset_filter()
+        if descending != reverse:
+            return F(field).desc(nulls_last=not reverse, nulls_first=reverse)
+        return F(field).asc(nulls_last=not reverse, nulls_first=reverse)
+
+    def get_keyset_filter(self, values, reverse):
+        '''
+        Returns a filter for the objects after (or before if reverse is True) the given values of the keys, in the order of the keys. (a, b) > (x, y) is the same as a > x OR (a = x AND b > y), and the nulls are after everything else.
+        '''
+        def beyond(field, descending, value):
+            if reverse:
+                return Q(**{f'{field}__isnull': False}) if value is None else Q(**{f'{field}__{"gt" if descending else "lt"}': value})
+            return Q(pk__in=[]) if value is None else Q(**{f'{field}__{"lt" if descending else "gt"}': value}) | Q(**{f'{field}__isnull': True})
+
+        def equal(field, value):
+            return Q(**{f'{field}__isnull': True}) if value is None else Q(**{field: value})
+
+        return reduce(or_, [
+            reduce(and_, [equal(field, value) for (field, _), value in zip(self.keys[:i], values[:i])], beyond(*self.keys[i], values[i]))
+            for i in range(len(self.keys))
+        ])
+
+    @staticmethod
+    def get_value(obj, key):
+        if key == 'pk':
+            return obj.pk
+        for attribute in key.split('__'):
+            obj = getattr(obj, attribute) if obj is not None else None
+        return obj
+
+    def encode_cursor(self, values, reverse):
+        cursor = {'keys': [field if not descending else f'-{field}' for field, descending in self.keys], 'values': values, 'reverse': reverse}
+        return base64.urlsafe_b64encode(json.dumps(cursor, cls=DjangoJSONEncoder).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        '''
+        Returns the values and the direction of the cursor, or None and False for the first page.
+        '''
+        if not cursor:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            keys, values, reverse = cursor['keys'], cursor['values'], bool(cursor['reverse'])
+        except (ValueError, TypeError, KeyError):
+            raise NotFound('Invalid cursor')
+        # The cursor is only valid for the ordering it was created with
+        if keys != [field if not descending else f'-{field}' for field, descending in self.keys] or len(values) != len(keys):
+            raise NotFound('Invalid cursor')
+        return values, reverse
+
+    def get_cursor_link(self, values, reverse):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.offset_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(values, reverse))
+
+    def get_paginated_response_schema(self, schema):
+        schema = super().get_paginated_response_schema(schema)
+        schema['properties']['count']['nullable'] = True
+        return schema
+
+
+# A bounded thread pool for calling external services (LDAP and BILL) concurrently, see run_external()
+external_executor = ThreadPoolExecutor(max_workers=env('EXTERNAL_WORKERS', 8), thread_name_prefix='external')
+
+
+def run_external(function, *args, **kwargs):
+    '''
+    Run the function in the external_executor. Returns a Future.
+    '''
+    def run():
+        try:
+            return function(*args, **kwargs)
+        finally:
+            # The threads get their own database connections (used by the cache), which would otherwise never be closed
+            connections.close_all()
+    return external_executor.submit(run)
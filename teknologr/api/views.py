@@ -1,8 +1,9 @@
 from django.shortcuts import get_object_or_404
-from django.db import connection
-from django.db.models import Q
+from django.db import connection, transaction
+from django.db.models import Model, Q, Min, Prefetch
 from django.db.utils import IntegrityError
 from django.http import HttpResponse
+from django.utils.decorators import method_decorator
 from django_filters import rest_framework as filters
 from rest_framework import viewsets, permissions
 from rest_framework.views import APIView
@@ -10,17 +11,19 @@ from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
 from ldap import LDAPError
-from collections import defaultdict
 from datetime import datetime
 from api.serializers import *
 from api.filters import *
-from api.ldap import LDAPAccountManager, LDAPError_to_string
-from api.bill import BILLAccountManager, BILLException
-from api.utils import assert_public_member_fields
-from api.mailutils import mailNewPassword, mailNewAccount
+from api.ldap import LDAPAccountManager, LDAPError_to_string, ldap_breaker, ldap_pool
+from api.bill import BILLAccountManager, BILLException, bill_breaker, bill_metrics
+from api.utils import assert_public_member_fields, conditional, create_streaming_dump_response, get_active_roster, iterate_in_chunks, VERSIONED_MODELS
+from api.mailutils import has_valid_email, mailNewPassword, mailNewAccount
 from members.models import GroupMembership, Member, Group
+from members.utils import get_count_subquery
+from members.signals import tracked_bulk_created
 from members.programmes import DEGREE_PROGRAMME_CHOICES
 from registration.models import Applicant
+from teknologr.querycount import query_budget
 
 
 # ViewSets define the view behavior.
@@ -39,15 +42,53 @@ class IsStaffOrReadOnly(permissions.BasePermission):
         return request.method in permissions.SAFE_METHODS
 
 class BaseModelViewSet(viewsets.ModelViewSet):
+    '''
+    The fields of the responses can be chosen with the 'fields' and 'omit' query parameters (comma separated lists of field names). The queryset should only select what all fields need, and the extra queries needed by some of the fields are declared in field_queries, as a dict of field names to dicts of QuerySet method names to their arguments. Only the queries of the included fields are run.
+    '''
+
     # Use custom permissions
     permission_classes = (IsStaffOrReadOnly, )
+    field_queries = {}
+    # See teknologr/querycount.py
+    query_budgets = {'list': 11, 'retrieve': 3}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        serializer_class = self.get_serializer_class()
+        detail = self.action == 'retrieve'
+        fields, omit = self.get_requested_fields()
+        for field, queries in self.field_queries.items():
+            if not serializer_class.is_included(field, detail, self.show_staff_fields(), fields, omit):
+                continue
+            for method, args in queries.items():
+                queryset = getattr(queryset, method)(**args) if isinstance(args, dict) else getattr(queryset, method)(*args)
+        return queryset
 
     def get_serializer(self, *args, **kwargs):
         serializer_class = self.get_serializer_class()
         kwargs['detail'] = self.action == 'retrieve'
-        kwargs['is_staff'] = self.request.user.is_staff
+        kwargs['is_staff'] = self.show_staff_fields()
+        kwargs['fields'], kwargs['omit'] = self.get_requested_fields()
         return serializer_class(*args, **kwargs)
 
+    def show_staff_fields(self):
+        return self.request.user.is_staff
+
+    def get_requested_fields(self):
+        '''
+        Returns the lists of fields to include (None for all) and to omit. Only used for reading, since the serializers need all their fields for writing.
+        '''
+        if self.request.method not in permissions.SAFE_METHODS:
+            return None, None
+        fields = self.request.query_params.get('fields')
+        omit = self.request.query_params.get('omit')
+        return (fields.split(',') if fields else None), (omit.split(',') if omit else None)
+
+    # The serializers include related objects, so the lists depend on all the tables
+    @method_decorator(conditional(*VERSIONED_MODELS))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
 class MemberSearchFilter(SearchFilter):
     '''
@@ -68,8 +109,19 @@ class MemberSearchFilter(SearchFilter):
         return fields
 
 class MemberViewSet(BaseModelViewSet):
-    queryset = Member.objects.all_with_related()
+    queryset = Member.objects.all()
     serializer_class = MemberSerializer
+    query_budgets = {**BaseModelViewSet.query_budgets, 'retrieve': 7}
+    # See Member.objects.all_with_related()
+    field_queries = {
+        'n_decorations': {'annotate': {'count_decoration_ownerships': get_count_subquery(DecorationOwnership.objects.all(), 'member')}},
+        'n_functionaries': {'annotate': {'count_functionaries': get_count_subquery(Functionary.objects.all(), 'member')}},
+        'n_groups': {'annotate': {'count_group_memberships': get_count_subquery(GroupMembership.objects.all(), 'member')}},
+        'decorations': {'prefetch_related': [Prefetch('decoration_ownerships', queryset=DecorationOwnership.objects.select_related('decoration'))]},
+        'functionaries': {'prefetch_related': [Prefetch('functionaries', queryset=Functionary.objects.select_related('functionarytype'))]},
+        'groups': {'prefetch_related': [Prefetch('group_memberships', queryset=GroupMembership.objects.select_related('group', 'group__grouptype'))]},
+        'membertypes': {'prefetch_related': ['member_types']},
+    }
     filter_backends = (MemberSearchFilter, filters.DjangoFilterBackend, OrderingFilter, )
     filterset_class = MemberFilter
     search_fields = ('dummy', ) # The search box does not appear if this is removed
@@ -86,14 +138,19 @@ class MemberViewSet(BaseModelViewSet):
 class GroupTypeViewSet(BaseModelViewSet):
     queryset = GroupType.objects.all()
     serializer_class = GroupTypeSerializer
+    query_budgets = {**BaseModelViewSet.query_budgets, 'retrieve': 4}
     filter_backends = (SearchFilter, filters.DjangoFilterBackend, OrderingFilter, )
     search_fields = ('name', 'comment', )
     filterset_class = GroupTypeFilter
     ordering_fields = ('id', 'name', )
 
 class GroupViewSet(BaseModelViewSet):
-    queryset = Group.objects.select_related('grouptype')
+    queryset = Group.objects.all()
     serializer_class = GroupSerializer
+    query_budgets = {**BaseModelViewSet.query_budgets, 'retrieve': 4}
+    field_queries = {
+        'grouptype': {'select_related': ['grouptype']},
+    }
     filter_backends = (filters.DjangoFilterBackend, OrderingFilter, )
     filterset_class = GroupFilter
     ordering_fields = (
@@ -105,8 +162,12 @@ class GroupViewSet(BaseModelViewSet):
     )
 
 class GroupMembershipViewSet(BaseModelViewSet):
-    queryset = GroupMembership.objects.all_with_related()
+    queryset = GroupMembership.objects.all()
     serializer_class = GroupMembershipSerializer
+    field_queries = {
+        'group': {'select_related': ['group', 'group__grouptype']},
+        'member': {'select_related': ['member']},
+    }
     filter_backends = (filters.DjangoFilterBackend, OrderingFilter, )
     filterset_class = GroupMembershipFilter
     ordering_fields = (
@@ -128,64 +189,97 @@ def getMultiSelectValues(request, key):
     return [m for m in members if m]
 
 
-def getOrCreateMemberIdFromMultiSelectValue(id_or_names):
+def getOrCreateMemberIdsFromMultiSelectValues(ids_or_names):
     """
     In multi-select Member fields each value can be:
     - the ID of an existing Member, or
     - the name of a new Member that should be created, prefixed with '$'
+
+    The new Members are created in bulk. Returns a tuple of the IDs of all found and created Members, the IDs of the created Members and the values that did not match any existing Member.
     """
-    if id_or_names[0] == '$':
-        names = id_or_names[1:].split()
-        member = Member.objects.create(given_names=' '.join(names[0:-1]), surname=names[-1])
-        return member.id
-    return int(id_or_names)
+    new_members = []
+    ids = []
+    not_found = []
+    for id_or_names in ids_or_names:
+        if id_or_names[0] == '$':
+            names = id_or_names[1:].split()
+            new_members.append(Member(given_names=' '.join(names[0:-1]), surname=names[-1]))
+        elif id_or_names.isdigit():
+            ids.append(int(id_or_names))
+        else:
+            not_found.append(id_or_names)
 
+    existing = set(Member.objects.filter(id__in=ids).values_list('id', flat=True))
+    not_found += [str(mid) for mid in ids if mid not in existing]
 
-@api_view(['POST'])
-def multi_group_memberships_save(request):
-    gid = request.data.get('group')
-    members = getMultiSelectValues(request, 'member')
+    if connection.features.can_return_rows_from_bulk_insert:
+        Member.objects.bulk_create(new_members)
+    else:
+        # Only some databases (such as PostgreSQL) return the IDs of bulk created rows
+        for member in new_members:
+            member.save()
+    new_ids = [member.id for member in new_members]
 
-    for id_or_name in members:
-        mid = getOrCreateMemberIdFromMultiSelectValue(id_or_name)
-        # get_or_create is used to ignore duplicates
-        GroupMembership.objects.get_or_create(member_id=mid, group_id=int(gid))
+    # Duplicates are removed while keeping the order
+    member_ids = list(dict.fromkeys([mid for mid in ids if mid in existing] + new_ids))
+    return member_ids, new_ids, not_found
 
-    return HttpResponse(status=200)
 
+def createMultiSelectRelations(request, model, **fields):
+    """
+    Create an object of the given model for each Member in the multi-select Member field. This is done in one transaction with a constant amount of queries, instead of a few queries per Member. Members that already have the same object are skipped.
 
-@api_view(['POST'])
-def multi_functionaries_save(request):
-    fid = request.data.get('functionarytype')
+    The parent objects (the Group, FunctionaryType or Decoration in the fields) are locked first, so that concurrent calls for the same parent are done one after the other and skip each other's objects. Objects created in other ways at the same time are not seen though. Only the models with a unique constraint (GroupMembership and Functionary) are protected against duplicates in that case, where the conflicting rows are ignored, but still reported as created.
+
+    QuerySet.bulk_create() does not send any signals, so the data that depends on the created objects is updated explicitly (see members/signals.py).
+    """
     members = getMultiSelectValues(request, 'member')
-    begin_date = request.data.get('begin_date')
-    end_date = request.data.get('end_date')
-
-    for id_or_name in members:
-        mid = getOrCreateMemberIdFromMultiSelectValue(id_or_name)
-        # get_or_create is used to ignore duplicates
-        Functionary.objects.get_or_create(
-            member_id=mid,
-            functionarytype_id=int(fid),
-            end_date=end_date,
-            begin_date=begin_date
-        )
 
-    return HttpResponse(status=200)
+    with transaction.atomic():
+        for value in fields.values():
+            if isinstance(value, Model):
+                list(type(value).objects.select_for_update().filter(pk=value.pk).values_list('pk', flat=True))
+        member_ids, new_ids, not_found = getOrCreateMemberIdsFromMultiSelectValues(members)
+        skipped = set(model.objects.filter(member_id__in=member_ids, **fields).values_list('member_id', flat=True))
+        created = [mid for mid in member_ids if mid not in skipped]
+        objs = [model(member_id=mid, **fields) for mid in created]
+        model.objects.bulk_create(objs, ignore_conflicts=bool(model._meta.unique_together))
+        tracked_bulk_created(model, objs)
+
+    return Response({
+        'created': created,
+        'skipped': [mid for mid in member_ids if mid in skipped],
+        'new_members': new_ids,
+        'not_found': not_found,
+    })
+
+
+# The multi-select saves make the same amount of queries no matter how many Members are given. Most of them update the counters, versions and statistics (see members/signals.py).
+@query_budget(52)
+@api_view(['POST'])
+def multi_group_memberships_save(request):
+    group = get_object_or_404(Group, id=request.data.get('group'))
+    return createMultiSelectRelations(request, GroupMembership, group=group)
 
 
+@query_budget(43)
 @api_view(['POST'])
-def multi_decoration_ownerships_save(request):
-    did = request.data.get('decoration')
-    members = getMultiSelectValues(request, 'member')
-    acquired = request.data.get('acquired')
+def multi_functionaries_save(request):
+    functionarytype = get_object_or_404(FunctionaryType, id=request.data.get('functionarytype'))
+    return createMultiSelectRelations(
+        request,
+        Functionary,
+        functionarytype=functionarytype,
+        begin_date=request.data.get('begin_date'),
+        end_date=request.data.get('end_date'),
+    )
 
-    for id_or_name in members:
-        mid = getOrCreateMemberIdFromMultiSelectValue(id_or_name)
-        # get_or_create is used to ignore duplicates
-        DecorationOwnership.objects.get_or_create(member_id=mid, decoration_id=int(did), acquired=acquired)
 
-    return HttpResponse(status=200)
+@query_budget(41)
+@api_view(['POST'])
+def multi_decoration_ownerships_save(request):
+    decoration = get_object_or_404(Decoration, id=request.data.get('decoration'))
+    return createMultiSelectRelations(request, DecorationOwnership, decoration=decoration, acquired=request.data.get('acquired'))
 
 
 # FunctionaryTypes and Functionaries
@@ -193,14 +287,19 @@ def multi_decoration_ownerships_save(request):
 class FunctionaryTypeViewSet(BaseModelViewSet):
     queryset = FunctionaryType.objects.all()
     serializer_class = FunctionaryTypeSerializer
+    query_budgets = {**BaseModelViewSet.query_budgets, 'retrieve': 4}
     filter_backends = (SearchFilter, filters.DjangoFilterBackend, OrderingFilter, )
     search_fields = ('name', 'comment', )
     filterset_class = FunctionaryTypeFilter
     ordering_fields = ('id', 'name', )
 
 class FunctionaryViewSet(BaseModelViewSet):
-    queryset = Functionary.objects.all_with_related()
+    queryset = Functionary.objects.all()
     serializer_class = FunctionarySerializer
+    field_queries = {
+        'functionarytype': {'select_related': ['functionarytype']},
+        'member': {'select_related': ['member']},
+    }
     filter_backends = (filters.DjangoFilterBackend, OrderingFilter, )
     filterset_class = FunctionaryFilter
     ordering_fields = (
@@ -216,14 +315,19 @@ class FunctionaryViewSet(BaseModelViewSet):
 class DecorationViewSet(BaseModelViewSet):
     queryset = Decoration.objects.all()
     serializer_class = DecorationSerializer
+    query_budgets = {**BaseModelViewSet.query_budgets, 'retrieve': 4}
     filter_backends = (SearchFilter, filters.DjangoFilterBackend, OrderingFilter, )
     search_fields = ('name', 'comment', )
     filterset_class = DecorationFilter
     ordering_fields = ('id', 'name', )
 
 class DecorationOwnershipViewSet(BaseModelViewSet):
-    queryset = DecorationOwnership.objects.all_with_related()
+    queryset = DecorationOwnership.objects.all()
     serializer_class = DecorationOwnershipSerializer
+    field_queries = {
+        'decoration': {'select_related': ['decoration']},
+        'member': {'select_related': ['member']},
+    }
     filter_backends = (filters.DjangoFilterBackend, OrderingFilter, )
     filterset_class = DecorationOwnershipFilter
     ordering_fields = (
@@ -240,7 +344,11 @@ class DecorationOwnershipViewSet(BaseModelViewSet):
 class MemberTypeViewSet(BaseModelViewSet):
     # NOTE: Default permissions (staff-only)
     permission_classes = (permissions.IsAdminUser, )
-    queryset = MemberType.objects.all_with_related()
+    queryset = MemberType.objects.all()
+    serializer_class = MemberTypeSerializer
+    field_queries = {
+        'member': {'select_related': ['member']},
+    }
     filter_backends = (filters.DjangoFilterBackend, OrderingFilter, )
     filterset_class = MemberTypeFilter
     ordering_fields = (
@@ -251,8 +359,8 @@ class MemberTypeViewSet(BaseModelViewSet):
         ('member__id', 'member.id'),
     )
 
-    def get_serializer(self, *args, **kwargs):
-        return MemberTypeSerializer(is_staff=True, *args, **kwargs)
+    def show_staff_fields(self):
+        return True
 
 
 # User accounts
@@ -260,7 +368,7 @@ class MemberTypeViewSet(BaseModelViewSet):
 class LDAPAccountView(APIView):
     def get(self, request, member_id):
         member = get_object_or_404(Member, id=member_id)
-        return get_ldap_user_details_method(member.username)
+        return get_ldap_user_details_method(member.username, 'refresh' in request.GET)
 
     def post(self, request, member_id):
         # Create LDAP account for given user
@@ -277,6 +385,9 @@ class LDAPAccountView(APIView):
         if Member.objects.filter(username=username).exists():
             return HttpResponse(f'Username "{username}" is already taken', status=400)
 
+        if mailToUser and not has_valid_email(member):
+            return HttpResponse(f'Can not send the password to the invalid e-mail address "{member.email}"', status=400)
+
         try:
             with LDAPAccountManager() as lm:
                 lm.add_account(member, username, password)
@@ -288,9 +399,7 @@ class LDAPAccountView(APIView):
         member.save()
 
         if mailToUser:
-            status = mailNewAccount(member, password)
-            if not status:
-                return HttpResponse(f'Account created, failed to send mail to {member}', status=500)
+            mailNewAccount(member, password)
 
         return HttpResponse(status=200)
 
@@ -323,10 +432,10 @@ def get_ldap_user_list(_):
     except LDAPError as e:
         return Response({'detail': LDAPError_to_string(e)}, status=500)
 
-def get_ldap_user_details_method(username):
+def get_ldap_user_details_method(username, refresh=False):
     try:
         with LDAPAccountManager() as lm:
-            user = lm.get_user_details(username)
+            user = lm.get_user_details(username, refresh)
     except LDAPError as e:
         return Response({'detail': LDAPError_to_string(e)}, status=500)
     if not user:
@@ -334,8 +443,8 @@ def get_ldap_user_details_method(username):
     return Response(user)
 
 @api_view(['GET'])
-def get_ldap_user_details(_, username):
-    return get_ldap_user_details_method(username)
+def get_ldap_user_details(request, username):
+    return get_ldap_user_details_method(username, 'refresh' in request.GET)
 
 @api_view(['GET'])
 def get_ldap_group_list(_):
@@ -346,10 +455,10 @@ def get_ldap_group_list(_):
         return Response({'detail': LDAPError_to_string(e)}, status=500)
 
 @api_view(['GET'])
-def get_ldap_group_details(_, group_name):
+def get_ldap_group_details(request, group_name):
     try:
         with LDAPAccountManager() as lm:
-            group = lm.get_group_details(group_name)
+            group = lm.get_group_details(group_name, 'refresh' in request.GET)
     except LDAPError as e:
         return Response({'detail': LDAPError_to_string(e)}, status=500)
     if not group:
@@ -363,14 +472,14 @@ def change_ldap_password(request, member_id):
     mailToUser = request.data.get('mail_to_user')
     if not password:
         return HttpResponse('Password field missing', status=400)
+    if mailToUser and not has_valid_email(member):
+        return HttpResponse(f'Can not send the password to the invalid e-mail address "{member.email}"', status=400)
 
     try:
         with LDAPAccountManager() as lm:
             lm.change_password(member.username, password)
             if mailToUser:
-                status = mailNewPassword(member, password)
-                if not status:
-                    return HttpResponse('Password changed, but failed to send mail', status=500)
+                mailNewPassword(member, password)
     except LDAPError as e:
         return HttpResponse(LDAPError_to_string(e), status=400)
 
@@ -435,12 +544,30 @@ class BILLAccountView(APIView):
         return HttpResponse(status=200)
 
 
+@api_view(['GET'])
+def external_status(_):
+    '''
+    The state of the connections to the external services in this process, see CircuitBreaker.
+    '''
+    return Response({
+        'ldap': {
+            **ldap_breaker.get_status(),
+            'idle_connections': len(ldap_pool.idle),
+        },
+        'bill': {
+            **bill_breaker.get_status(),
+            'operations': bill_metrics.get(),
+        },
+    })
+
+
 # Registration/Applicant
 
 class ApplicantViewSet(BaseModelViewSet):
     # NOTE: Default permissions (staff-only)
     permission_classes = (permissions.IsAdminUser, )
     queryset = Applicant.objects.all()
+    serializer_class = ApplicantSerializer
     filter_backends = (SearchFilter, filters.DjangoFilterBackend, OrderingFilter, )
     search_fields = (
         'surname',
@@ -463,8 +590,8 @@ class ApplicantViewSet(BaseModelViewSet):
         'created_at',
     )
 
-    def get_serializer(self, *args, **kwargs):
-        return ApplicantSerializer(is_staff=True, *args, **kwargs)
+    def show_staff_fields(self):
+        return True
 
 
 class ApplicantMembershipView(APIView):
@@ -517,9 +644,7 @@ class ApplicantMembershipView(APIView):
                     new_member.username = username
                     new_member.save()
 
-                    status = mailNewAccount(new_member, password)
-                    if not status:
-                        return HttpResponse(f'LDAP account created, failed to send mail to {new_member}', status=400)
+                    mailNewAccount(new_member, password)
 
             # LDAP account creation failed (e.g. if the account already exists)
             except LDAPError as e:
@@ -563,7 +688,9 @@ def multi_applicant_submissions(request):
 # JSON API:s
 
 # Used by BILL (?)
+@query_budget(5)
 @api_view(['GET'])
+@conditional(Member, MemberType)
 def member_types_for_member(request, mode, query):
     try:
         if mode == 'username':
@@ -592,7 +719,9 @@ def member_types_for_member(request, mode, query):
 
 
 # Used by BILL and GeneriKey
+@query_budget(4)
 @api_view(['GET'])
+@conditional(Member, MemberType)
 def members_by_member_type(request, membertype, field=None):
     member_pks = MemberType.objects.filter(type=membertype, end_date=None).values_list("member", flat=True)
     fld = "username" if field == "usernames" else "student_id"
@@ -602,6 +731,7 @@ def members_by_member_type(request, membertype, field=None):
 
 # Data for HTK
 # JSON file including all necessary information for HTK, i.e. member's activity at TF
+@query_budget(7)
 @api_view(['GET'])
 def dump_htk(request, member_id=None):
     def dumpMember(member):
@@ -657,14 +787,19 @@ def dump_htk(request, member_id=None):
     # Remember to prefetch all needed data to avoid hitting the db with n_members*5 extra fetches
     if member_id:
         member = Member.objects.get_prefetched_or_404(member_id)
-        data = dumpMember(member)
-    else:
-        data = [dumpMember(member) for member in Member.objects.all_with_related()]
-
-    return Response(data, status=200)
+        return Response(dumpMember(member), status=200)
+
+    # The related objects are prefetched for one chunk of members at a time
+    members = iterate_in_chunks(Member.objects.all_with_related())
+    return create_streaming_dump_response(
+        request,
+        (dumpMember(member) for member in members),
+        ['id', 'name', 'functionaries', 'groups', 'membertypes', 'decorations'],
+    )
 
 
 # List of addresses whom to post modulen to
+@query_budget(3)
 @api_view(['GET'])
 def dump_modulen(request):
     recipients = Member.objects.exclude(
@@ -672,17 +807,15 @@ def dump_modulen(request):
     ).exclude(
         dead=True
     ).filter(
-        subscribed_to_modulen=True
+        Member.get_valid_member_Q(),
+        subscribed_to_modulen=True,
     )
 
-    # NOTE: DISTINCT ON is a postgresql feature, this feature will not work with other databases
-    # Installing pandas to do this seemed like a waste since we currently run postgres in prod anyway // Jonas
-    if connection.vendor == 'postgresql':
-        recipients = recipients.distinct('street_address', 'city')
-
-    recipients = [x for x in recipients if x.isValidMember()]
+    # Only one recipient per address. Members without an address can not be told apart, so they are all included.
+    first_at_address = recipients.order_by().values('address_key').annotate(first_id=Min('id')).values('first_id')
+    recipients = recipients.filter(Q(address_key='') | Q(id__in=first_at_address))
 
-    content = [{
+    content = ({
         'given_names': recipient.given_names,
         'preferred_name': recipient.preferred_name,
         'surname': recipient.surname,
@@ -690,48 +823,23 @@ def dump_modulen(request):
         'postal_code': recipient.postal_code,
         'city': recipient.city,
         'country': recipient.country.name
-    } for recipient in recipients]
+    } for recipient in iterate_in_chunks(recipients))
 
-    return Response(content, status=200)
+    return create_streaming_dump_response(request, content, ['given_names', 'preferred_name', 'surname', 'street_address', 'postal_code', 'city', 'country'])
 
 
 # Lists all members that are active at the moment. These are members
 # that are either functionaries right now or in a group that has an
 # active mandate
+@query_budget(12)
 @api_view(['GET'])
 def dump_active(request):
-    now = datetime.today().date()
-    content = []
-
-    # Functionaries
-    all_functionaries = Functionary.objects.all_with_related().filter(
-        begin_date__lte=now,
-        end_date__gte=now
-    )
-    for func in all_functionaries:
-        content.append({
-            'position': func.functionarytype.name,
-            'member': func.member.full_name,
-        })
-
-    # Groups
-    groupmemberships = GroupMembership.objects.all_with_related()
-    grouped_by_group = defaultdict(list)
-    for membership in groupmemberships:
-        if membership.group.begin_date < now and membership.group.end_date > now:
-            grouped_by_group[membership.group].append(membership.member)
-    for group, members in grouped_by_group.items():
-        for m in members:
-            content.append({
-                'position': str(group.grouptype),
-                'member': m.full_name,
-            })
-
-    return Response(content, status=200)
+    return create_streaming_dump_response(request, iter(get_active_roster()), ['position', 'member'])
 
 
 # Dump for Årsfestkommittén, includes all members that should be posted invitations.
 # These include: honor-members, all TFS 5 years back + exactly 10 years back, all counsels, all current functionaries
+@query_budget(6)
 @api_view(['GET'])
 def dump_arsk(request):
     tfs_low_range = 5
@@ -748,12 +856,6 @@ def dump_arsk(request):
     styrelse_id = 2  # Styrelsen
     honor_id = 3  # Hedersmedlemmar
 
-    # All saved associations
-    by_association = defaultdict(list)
-
-    # Common query for checking if member is deceased
-    is_alive = Q(member__dead=False)
-
     # Query for current counsel membership
     counsel_members_query = Q(group__grouptype__id__in=counsel_ids, group__begin_date__year__gte=current_year)
 
@@ -763,63 +865,68 @@ def dump_arsk(request):
     is_ten_years_back_q = Q(group__begin_date__year=current_year-10)
     styrelse_members_query = Q(is_styrelse_q & Q(is_recent_q | is_ten_years_back_q))
 
-    # Apply membership queries to database and append answer
-    memberships = GroupMembership.objects.all_with_related().filter(Q(styrelse_members_query | counsel_members_query) & is_alive)
-    for membership in memberships:
-        by_association[membership.member].append(str(membership.group))
-
-    # Apply honor member queries and append answer
-    honor_decoration = DecorationOwnership.objects.all_with_related().filter(Q(decoration__id=honor_id) & is_alive)
-    for decoration in honor_decoration:
-        by_association[decoration.member].append(decoration.decoration.name)
-
-    # Apply functionary queries and append answer
-    functionaries = Functionary.objects.all_with_related().filter(Q(begin_date__year=current_year) & is_alive)
-    for functionary in functionaries:
-        by_association[functionary.member].append(functionary.functionarytype.name)
+    # The associations of each member are prefetched for one chunk of members at a time
+    memberships = GroupMembership.objects.select_related('group', 'group__grouptype').filter(styrelse_members_query | counsel_members_query)
+    honor_decorations = DecorationOwnership.objects.select_related('decoration').filter(decoration__id=honor_id)
+    functionaries = Functionary.objects.select_related('functionarytype').filter(begin_date__year=current_year)
+
+    members = Member.objects.filter(dead=False).filter(
+        Q(id__in=memberships.values('member_id')) |
+        Q(id__in=honor_decorations.values('member_id')) |
+        Q(id__in=functionaries.values('member_id'))
+    ).prefetch_related(
+        Prefetch('group_memberships', queryset=memberships, to_attr='arsk_memberships'),
+        Prefetch('decoration_ownerships', queryset=honor_decorations, to_attr='arsk_decorations'),
+        Prefetch('functionaries', queryset=functionaries, to_attr='arsk_functionaries'),
+    )
 
     # Finally format the data correctly
-    content = [{
+    content = ({
         'name': member.given_names,
         'surname': member.surname,
         'street_address': member.street_address,
         'postal_code': member.postal_code,
         'city': member.city,
         'country': member.country.name,
-        'associations': ','.join(association),
-    } for member, association in by_association.items()]
+        'associations': ','.join(
+            [str(m.group) for m in member.arsk_memberships] +
+            [d.decoration.name for d in member.arsk_decorations] +
+            [f.functionarytype.name for f in member.arsk_functionaries]
+        ),
+    } for member in iterate_in_chunks(members))
 
-    return Response(content, status=200)
+    return create_streaming_dump_response(request, content, ['name', 'surname', 'street_address', 'postal_code', 'city', 'country', 'associations'])
 
 
 # Dump for receiving all emails from member applicants
 # Used by e.g. the PhuxMästare to send out information
+@query_budget(3)
 @api_view(['GET'])
 def dump_reg_emails(request):
     applicants = Applicant.objects.all()
-    content = [{
+    content = ({
         'name': applicant.given_names,
         'surname': applicant.surname,
         'preferred_name': applicant.preferred_name,
         'email': applicant.email,
         'language': applicant.mother_tongue,
-    } for applicant in applicants]
+    } for applicant in iterate_in_chunks(applicants))
 
-    return Response(content, status=200)
+    return create_streaming_dump_response(request, content, ['name', 'surname', 'preferred_name', 'email', 'language'])
 
 
 # List of addresses whom to post Studentbladet to
+@query_budget(3)
 @api_view(['GET'])
 def dump_studentbladet(request):
-    recipients = Member.objects.exclude(dead=True).filter(allow_studentbladet=True)
-    recipients = [m for m in recipients if m.isValidMember()]
+    recipients = Member.objects.exclude(dead=True).filter(Member.get_valid_member_Q(), allow_studentbladet=True)
 
-    content = [{
+    content = ({
         'name': recipient.full_name,
         'street_address': recipient.street_address,
         'postal_code': recipient.postal_code,
         'city': recipient.city,
         'country': str(recipient.country),
-    } for recipient in recipients]
+    } for recipient in iterate_in_chunks(recipients))
 
-    return Response(content, status=200)
+    return create_streaming_dump_response(request, content, ['name', 'street_address', 'postal_code', 'city', 'country'])
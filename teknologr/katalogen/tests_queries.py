@@ -0,0 +1,45 @@
+from members.tests_queries import QueryBudgetTestCase
+
+
+class KatalogenQueryBudgetTest(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login_user()
+
+    def test_home(self):
+        self.assertQueryBudget('/')
+
+    def test_search(self):
+        self.assertQueryBudget('/search/?q=von')
+        self.assertQueryBudget('/search/?q=')
+
+    def test_startswith(self):
+        self.assertQueryBudget('/V/')
+
+    def test_profile(self):
+        self.assertQueryBudget(f'/members/{self.member.id}/')
+
+    def test_myprofile(self):
+        self.assertQueryBudget('/profile/')
+
+    def test_decorations(self):
+        self.assertQueryBudget('/decorations/')
+        self.assertQueryBudget(f'/decorations/{self.decoration_ownership.decoration_id}/')
+
+    def test_functionary_types(self):
+        self.assertQueryBudget('/functionaries/')
+        self.assertQueryBudget(f'/functionaries/{self.functionary.functionarytype_id}/')
+        self.assertQueryBudget(f'/functionaries/{self.functionary.functionarytype_id}/?combine=1')
+
+    def test_group_types(self):
+        self.assertQueryBudget('/groups/')
+        self.assertQueryBudget(f'/groups/{self.group.grouptype_id}/')
+        self.assertQueryBudget(f'/groupmemberships/{self.group.grouptype_id}/')
+
+    def test_years(self):
+        self.assertQueryBudget('/years/')
+
+    def test_year(self):
+        self.assertQueryBudget(f'/years/{self.year}/')
+        # The page is cached
+        self.assertQueryBudget(f'/years/{self.year}/')
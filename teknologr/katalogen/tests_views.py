@@ -1,6 +1,8 @@
 
 from rest_framework import status
+from members.models import *
 from api.tests import BaseAPITest
+from unittest.mock import patch
 
 class GetPageTests():
     def test_get_for_anonymous_users(self):
@@ -94,3 +96,53 @@ class Year0ViewTest(BaseAPITest, GetPageTests):
     def setUp(self):
         super().setUp()
         self.api_path = f'/years/0/'
+
+class YearCacheTest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        self.api_path = '/years/1999/'
+        self.login_user()
+
+    def get_content(self):
+        response = self.get_all()
+        self.check_status_code(response, status.HTTP_200_OK)
+        return response.content.decode()
+
+    def test_cached(self):
+        self.assertIn('My functionarytype', self.get_content())
+        # Bulk updates do not send any signals, so the cached page is not invalidated
+        FunctionaryType.objects.update(name='Renamed')
+        self.assertIn('My functionarytype', self.get_content())
+        self.assertNotIn('Renamed', self.get_content())
+
+    def test_invalidated_by_tracked_model(self):
+        self.assertIn('My functionarytype', self.get_content())
+        self.f.begin_date = self.f.end_date = '2000-01-01'
+        self.f.save()
+        Functionary.objects.exclude(id=self.f.id).delete()
+        self.assertNotIn('My functionarytype', self.get_content())
+
+    def test_invalidated_by_parent(self):
+        self.assertIn('My grouptype', self.get_content())
+        self.gt.name = 'Renamed'
+        self.gt.save()
+        self.assertIn('Renamed', self.get_content())
+
+    def test_invalidated_by_member(self):
+        self.assertIn('Björn-Anders von Teknolog', self.get_content())
+        self.m3.surname = 'Testare'
+        self.m3.save()
+        self.assertIn('Björn-Anders Testare', self.get_content())
+        Member.objects.filter(id=self.m3.id).update(surname='af Teknolog')
+        self.assertIn('Björn-Anders af Teknolog', self.get_content())
+
+    def test_not_invalidated_by_other_member_fields(self):
+        self.m3.refresh_from_db()
+        with patch('members.signals.invalidate_year_pages') as invalidate:
+            # The comment is not shown on the year pages
+            self.m3.comment = 'Foo'
+            self.m3.save()
+            self.assertFalse(invalidate.called)
+            self.m3.surname = 'Testare'
+            self.m3.save()
+            self.assertTrue(invalidate.called)
@@ -3,6 +3,8 @@ from collections import defaultdict
 from operator import attrgetter
 from functools import total_ordering
 from django.utils.formats import date_format
+from django.core.cache import cache
+from django.db import transaction
 
 @total_ordering
 class Duration:
@@ -116,3 +118,19 @@ class MultiDuration:
         for key, duration in items:
             d[key].append(duration)
         return list((key, MultiDuration(durations)) for key, durations in d.items())
+
+
+def get_year_page_cache_key(year):
+    return f'katalogen:year:{year}'
+
+
+def invalidate_year_pages(years):
+    '''
+    Remove the cached content of the year pages of the given years (see views.year()). This is done from the signals of every model that is shown on the year pages.
+    '''
+    keys = [get_year_page_cache_key(year) for year in set(years)]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    # A concurrent request could cache the old content again before the current transaction is committed
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -1,13 +1,15 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from django.db.models.functions import TruncYear
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 from members.models import *
 from members.utils import *
 from katalogen.utils import *
 from django.db.models import Q, Count
 from functools import reduce
 from operator import and_
-from collections import defaultdict
+from teknologr.querycount import query_budget
 
 
 def _get_base_context(request):
@@ -17,6 +19,7 @@ def _get_base_context(request):
     }
 
 
+@query_budget(2)
 @login_required
 def home(request):
     context = _get_base_context(request)
@@ -24,20 +27,20 @@ def home(request):
     return render(request, 'browse.html', context)
 
 
+@query_budget(4)
 @login_required
 def search(request):
     result = Member.objects.search_by_name(request.GET.get('q').split())
     if len(result) == 1:
         return redirect('katalogen:profile', result[0].id)
 
-    Member.order_by(result, 'name')
-
     return render(request, 'browse.html', {
         **_get_base_context(request),
         'persons': result,
     })
 
 
+@query_budget(6)
 @login_required
 def profile(request, member_id):
     """
@@ -46,7 +49,7 @@ def profile(request, member_id):
     URL query parameters available:
      - combine=<0/1>: Whether or not to combine the same Functionaries and GroupMemberships into a single row. The ordering will switch to lexicographical instead of reversed date as well.
     """
-    person = Member.objects.get_prefetched_or_404(member_id)
+    person = Member.objects.get_prefetched_or_404(member_id, member_types=False)
     functionaries = list(person.functionaries.all())
     group_memberships = list(person.group_memberships.all())
 
@@ -77,16 +80,14 @@ def profile(request, member_id):
     })
 
 
+@query_budget(3)
 @login_required
 def startswith(request, letter):
-    # Surname prefixes should be ignored
-
-    # All filtering could be done here on the Python side, but letting the database pre-filter the members is probably more effective
-    members = Member.objects.filter(Q(surname__istartswith=letter) | Q(surname__icontains=f' {letter}'))
-
-    # Checking the surname without prefix
-    members = [m for m in list(members) if m.get_surname_without_prefixes()[0].upper() == letter.upper()]
-    Member.order_by(members, 'name')
+    # Surname prefixes should be ignored, so using the denormalized surname without prefixes. Not using istartswith because SQLite only handles ASCII case-insensitively.
+    members = Member.objects.filter(
+        Q(surname_without_prefixes__startswith=letter.upper()) |
+        Q(surname_without_prefixes__startswith=letter.lower())
+    ).order_by('full_name_sort_key')
 
     return render(request, 'browse.html', {
         **_get_base_context(request),
@@ -94,12 +95,14 @@ def startswith(request, letter):
     })
 
 
+@query_budget(3)
 @login_required
 def myprofile(request):
     person = get_object_or_404(Member, username=request.user.username)
     return redirect('katalogen:profile', person.id)
 
 
+@query_budget(3)
 @login_required
 def decorations(request):
     # XXX: More info:
@@ -110,6 +113,7 @@ def decorations(request):
     })
 
 
+@query_budget(4)
 @login_required
 def decoration(request, decoration_id):
     decoration = Decoration.objects.get_prefetched_or_404(decoration_id)
@@ -122,6 +126,7 @@ def decoration(request, decoration_id):
     })
 
 
+@query_budget(3)
 @login_required
 def functionary_types(request):
     # XXX: More info:
@@ -132,6 +137,7 @@ def functionary_types(request):
     })
 
 
+@query_budget(4)
 @login_required
 def functionary_type(request, functionary_type_id):
     """
@@ -150,7 +156,7 @@ def functionary_type(request, functionary_type_id):
         durations = MultiDuration.combine_per_key(durations)
 
     # Sort the pairs by date and member name by default
-    durations.sort(key=lambda pair: (pair[1], pair[0].public_full_name_for_sorting), reverse=True)
+    durations.sort(key=lambda pair: (pair[1], pair[0].public_full_name_sort_key), reverse=True)
 
     return render(request, 'functionaries.html', {
         **_get_base_context(request),
@@ -160,6 +166,7 @@ def functionary_type(request, functionary_type_id):
     })
 
 
+@query_budget(3)
 @login_required
 def group_types(request):
     # XXX: More info:
@@ -170,6 +177,7 @@ def group_types(request):
     })
 
 
+@query_budget(5)
 @login_required
 def groups(request, group_type_id):
     group_type = GroupType.objects.get_prefetched_or_404(group_type_id)
@@ -183,6 +191,7 @@ def groups(request, group_type_id):
     })
 
 
+@query_budget(5)
 @login_required
 def group_memberships(request, group_type_id):
     group_type = GroupType.objects.get_prefetched_or_404(group_type_id)
@@ -193,7 +202,7 @@ def group_memberships(request, group_type_id):
     durations = MultiDuration.combine_per_key(durations)
 
     # Sort the pairs by member name by default
-    durations.sort(key=lambda pair: (pair[0].public_full_name_for_sorting))
+    durations.sort(key=lambda pair: (pair[0].public_full_name_sort_key))
 
     return render(request, 'group_memberships.html', {
         **_get_base_context(request),
@@ -202,63 +211,40 @@ def group_memberships(request, group_type_id):
     })
 
 
+@query_budget(3)
 @login_required
 def years(request):
     '''
-    This is done in 4 queries, as you would expect by reading the code:
-      1. SELECT Functionary => COUNT
-      2. SELECT GroupMembership => COUNT
-      3. SELECT DecortaionOwnership => COUNT
-      4. SELECT MemberType WHERE type IN ["OM", "ST"] => COUNT
+    This is done in 1 query, since the statistics are precalculated (see YearStatistics).
     '''
-    years = defaultdict(dict)
-
-    def add(obj, key, count_key=None):
-        date = obj['year']
-        if date is None:
-            return
-
-        y = date.year
-        years[y][key] = obj[count_key or key]
-
-    # Get all functionaries and group them by their start year, and for each year return a count for the total amount of functionaries and the amount of unique members holding the posts
-    # XXX: This does not include all valid date intervals
-    f_counts = Functionary.objects.annotate(year=TruncYear('begin_date')).values('year').annotate(functionaries_total=Count('id'), functionaries_unique=Count('member__id', distinct=True)).values('year', 'functionaries_total', 'functionaries_unique')
-    for obj in f_counts:
-        add(obj, 'functionaries_total')
-        add(obj, 'functionaries_unique')
-
-    # Get groups and group them by their start year, and for each year return a count for the total amount of groups, the total amount of members in the groups, and the amount of unique members holding in the groups
-    # XXX: This does not include all valid date intervals
-    gm_counts = GroupMembership.objects.annotate(year=TruncYear('group__begin_date')).values('year').annotate(groups=Count('group', distinct=True), group_memberships_total=Count('member'), group_memberships_unique=Count('member', distinct=True)).values('year', 'groups', 'group_memberships_total', 'group_memberships_unique')
-    for obj in gm_counts:
-        add(obj, 'groups')
-        add(obj, 'group_memberships_total')
-        add(obj, 'group_memberships_unique')
-
-    # Get all decorations and group them by the year they were aquired, and return a count for each year
-    do_counts = DecorationOwnership.objects.annotate(year=TruncYear('acquired')).values('year').annotate(decoration_ownerships=Count('id')).values('year', 'decoration_ownerships')
-    for obj in do_counts:
-        add(obj, 'decoration_ownerships')
-
-    # Get all StÄlMs and ordinary members and group them by the year they became members, and return a count for each type/year combination
-    m_counts = MemberType.objects.filter(Q(type='OM') | Q(type='ST')).annotate(year=TruncYear('begin_date')).values('year', 'type').annotate(members=Count('member')).values('year', 'type', 'members')
-    for obj in m_counts:
-        add(obj, 'members_ordinary' if obj['type'] == 'OM' else 'members_stalm', 'members')
-
     return render(request, 'years.html', {
         **_get_base_context(request),
-        'years': dict(sorted(years.items(), reverse=True)),
+        'years': {s.year: s for s in YearStatistics.objects.order_by('-year')},
     })
 
+@query_budget(17)
 @login_required
 def year(request, year):
+    '''
+    The content of a year page is rendered once and then cached until something shown on it changes (see invalidate_year_pages()), since the history of past years almost never changes. The content is the same for all users.
+    '''
     if int(year) <= 0:
-        return render(request, 'year.html', {
-            **_get_base_context(request),
-            'year': year,
-        })
+        content = render_to_string('year_content.html', {'year': year})
+    else:
+        key = get_year_page_cache_key(int(year))
+        content = cache.get(key)
+        if content is None:
+            content = render_to_string('year_content.html', _get_year_context(year))
+            cache.set(key, content, None)
 
+    return render(request, 'year.html', {
+        **_get_base_context(request),
+        'year': year,
+        'content': mark_safe(content),
+    })
+
+
+def _get_year_context(year):
     '''
     This could be enhanced, but curretnly it is done with 10 queries:
       1. SELECT Functionary WHERE correct_year => COUNT
@@ -279,8 +265,7 @@ def year(request, year):
     # Get all groups and group memberships for the year
     groups, group_memberships_total, group_memberships_unique = Group.objects.year_ordered_and_counts(year)
 
-    return render(request, 'year.html', {
-        **_get_base_context(request),
+    return {
         'year': year,
         'decoration_ownerships': DecorationOwnership.objects.year_ordered(year),
         'functionaries': functionaries,
@@ -290,4 +275,4 @@ def year(request, year):
         'group_memberships_unique': group_memberships_unique,
         'member_types_ordinary': MemberType.objects.ordinary_members_begin_year_ordered(year),
         'member_types_stalm': MemberType.objects.stalms_begin_year_ordered(year),
-    })
+    }
@@ -1,5 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def install_search_triggers(using, **kwargs):
+    from django.db import connections
+    from members import search
+    search.install_sqlite_triggers(connections[using])
 
 
 class MembersConfig(AppConfig):
     name = 'members'
+
+    def ready(self):
+        from members import signals  # noqa: F401
+        post_migrate.connect(install_search_triggers, sender=self)
@@ -1,5 +1,6 @@
 from ajax_select import register, LookupChannel
 from members.models import Member
+from members.name_index import member_name_index
 from registration.models import Applicant
 from django.db.models import Q
 
@@ -12,9 +13,7 @@ class MemberLookup(LookupChannel):
         if q == '__ALL__':
             return Member.objects.order_by('-modified')[:50]
 
-        members = Member.objects.search_by_name(q.split(), True)
-        Member.order_by(members, 'name')
-        return members[:50]
+        return member_name_index.search(q.split(), limit=50)
 
     def get_result(self, obj):
         """ result is the simple text that is the completion of what the person typed """
@@ -0,0 +1,33 @@
+import os
+import requests
+from django.core.management.base import BaseCommand
+from statistics import mean, median
+from time import perf_counter
+from unittest.mock import patch
+from api import bill
+from api.bill import BILLAccountManager
+from api.testservers import BILLStandInServer
+
+
+class Command(BaseCommand):
+    help = 'Compare the latency of BILL calls with a new connection for every call (the old way) and with the shared session (the current way, see api/bill.py). A local stand-in BILL server is used, where the latency of a remote server can be simulated.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=200, help='Amount of calls in each case')
+        parser.add_argument('--latency', type=float, default=1, help='Latency of every response in milliseconds')
+
+    def handle(self, *args, **options):
+        with BILLStandInServer(options['latency'] / 1000) as server:
+            os.environ['BILL_API_URL'] = server.api_url
+            bm = BILLAccountManager()
+            code = bm.create_bill_account('benchmark')
+
+            # requests.post() creates a new session, and thus a new connection, for every call
+            for name, session in [('New connection per call', requests), ('Shared session', bill.session)]:
+                with patch.object(bill, 'session', session):
+                    times = []
+                    for _ in range(options['calls']):
+                        start = perf_counter()
+                        bm.get_account_by_code(code)
+                        times.append(perf_counter() - start)
+                self.stdout.write(f'{name}: {median(times) * 1000:.2f} ms median, {mean(times) * 1000:.2f} ms mean per call ({len(times)} calls)')
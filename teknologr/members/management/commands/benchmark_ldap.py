@@ -0,0 +1,47 @@
+import os
+from django.core.management.base import BaseCommand
+from statistics import mean, median
+from time import perf_counter
+from api.ldap import LDAPAccountManager, LDAPConnectionPool
+from api.testservers import LDAPStandInServer
+
+
+class Command(BaseCommand):
+    help = 'Compare the latency of LDAP calls with and without pooling the connections (see LDAPConnectionPool). A local stand-in LDAP server is used, where the latency of a remote server and the TLS handshake can be simulated.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=200, help='Amount of calls in each case')
+        parser.add_argument('--latency', type=float, default=1, help='Latency of every response in milliseconds')
+        parser.add_argument('--bind-latency', type=float, default=10, help='Extra latency of every bind in milliseconds')
+
+    def handle(self, *args, **options):
+        entries = [('uid=svakar,ou=People,dc=example,dc=com', {
+            'uidNumber': [b'1001'],
+            'givenName': [b'Svakar'],
+            'sn': [b'von Teknolog'],
+            'mail': [b'svakar@example.com'],
+        })]
+
+        with LDAPStandInServer(entries, options['latency'] / 1000, options['bind_latency'] / 1000) as server:
+            os.environ['LDAP_SERVER_URI'] = server.uri
+            os.environ.setdefault('LDAP_USER_DN', 'ou=People,dc=example,dc=com')
+            os.environ.setdefault('LDAP_GROUP_DN', 'ou=Group,dc=example,dc=com')
+
+            for name, pooled in [('Without pool', False), ('With pool', True)]:
+                pool = LDAPConnectionPool()
+                binds = server.binds
+                times = []
+                for _ in range(options['calls']):
+                    start = perf_counter()
+                    with LDAPAccountManager(pool) as lm:
+                        # Bypass the cache of get_user_details(), so that every call reaches the server
+                        lm.fetch_user_details('svakar')
+                    if not pooled:
+                        # Unbind right away, like before the pool
+                        pool.clear()
+                    times.append(perf_counter() - start)
+                pool.clear()
+                self.stdout.write(
+                    f'{name}: {median(times) * 1000:.2f} ms median, {mean(times) * 1000:.2f} ms mean per call '
+                    f'({len(times)} calls, {server.binds - binds} binds)'
+                )
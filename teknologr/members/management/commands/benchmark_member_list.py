@@ -0,0 +1,61 @@
+from datetime import date
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from statistics import median
+from time import perf_counter
+from members.models import *
+
+
+class Command(BaseCommand):
+    help = 'Compare the latency of listing members with the related counts calculated using joins (the old way) and subqueries (the current way, see MemberManager.all_with_related()). The prefetches are left out since they are the same in both cases. The test data is created in a transaction that is rolled back afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=100, help='Amount of ordinary members')
+        parser.add_argument('--related', type=int, default=50, help='Amount of posts, groups and decorations of the busy member')
+        parser.add_argument('--repeat', type=int, default=20, help='Amount of times each query is run')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            busy = self.create_data(options['members'], options['related'])
+
+            joined = Member.objects.annotate(
+                count_decoration_ownerships=Count('decoration_ownerships'),
+                count_functionaries=Count('functionaries'),
+                count_group_memberships=Count('group_memberships'),
+            )
+            subqueries = Member.objects.annotate(
+                count_decoration_ownerships=get_count_subquery(DecorationOwnership.objects.all(), 'member'),
+                count_functionaries=get_count_subquery(Functionary.objects.all(), 'member'),
+                count_group_memberships=get_count_subquery(GroupMembership.objects.all(), 'member'),
+            )
+
+            for name, queryset in [('Joins', joined), ('Subqueries', subqueries)]:
+                times = []
+                for _ in range(options['repeat']):
+                    start = perf_counter()
+                    members = list(queryset.all())
+                    times.append(perf_counter() - start)
+                member = next(m for m in members if m.id == busy.id)
+                self.stdout.write(
+                    f'{name}: {median(times) * 1000:.1f} ms (median of {len(times)}) for {len(members)} members, '
+                    f'busy member counts: {member.n_decorations} decorations, {member.n_functionaries} posts, {member.n_groups} groups'
+                )
+
+            transaction.set_rollback(True)
+
+    def create_data(self, n_members, n_related):
+        for i in range(n_members):
+            Member.objects.create(given_names=f'Member {i}', surname='Benchmark')
+        busy = Member.objects.create(given_names='Busy', surname='Benchmark')
+
+        begin, end = date(2000, 1, 1), date(2000, 12, 31)
+        decorations = [Decoration.objects.create(name=f'Benchmark decoration {i}') for i in range(n_related)]
+        functionarytypes = [FunctionaryType.objects.create(name=f'Benchmark post {i}') for i in range(n_related)]
+        grouptype = GroupType.objects.create(name='Benchmark group type')
+        groups = [Group.objects.create(grouptype=grouptype, begin_date=begin, end_date=end) for _ in range(n_related)]
+
+        DecorationOwnership.objects.bulk_create([DecorationOwnership(member=busy, decoration=d, acquired=begin) for d in decorations])
+        Functionary.objects.bulk_create([Functionary(member=busy, functionarytype=ft, begin_date=begin, end_date=end) for ft in functionarytypes])
+        GroupMembership.objects.bulk_create([GroupMembership(member=busy, group=g) for g in groups])
+        return busy
@@ -0,0 +1,352 @@
+import random
+import unicodedata
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import date
+from functools import partial
+from itertools import chain
+from time import perf_counter
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from api.utils import VERSIONED_MODELS
+from members import search
+from members.models import *
+from members.name_index import member_name_index
+from members.programmes import DEGREE_PROGRAMME_CHOICES
+from members.signals import invalidate_active_roster
+from registration.models import Applicant
+
+
+GIVEN_NAMES = [
+    'Anders', 'Björn', 'Carl', 'Erik', 'Fredrik', 'Gustav', 'Henrik', 'Holger', 'Johan', 'Karl', 'Lars', 'Mikael', 'Nils', 'Olof', 'Sverker', 'Ture',
+    'Aino', 'Anna', 'Ebba', 'Elsa', 'Ingrid', 'Karin', 'Linnea', 'Maria', 'Märta', 'Sigrid', 'Sofia', 'Stina', 'Ulrika', 'Wilhelmina',
+    'Antti', 'Eino', 'Juha', 'Kalle', 'Matti', 'Mikko', 'Pekka', 'Väinö', 'Aila', 'Helmi', 'Kaisa', 'Liisa', 'Riikka', 'Sanni', 'Tuuli',
+]
+SURNAMES = [
+    'von Bonsdorff', 'von Wright', 'von Knorring', 'von Frenckell', 'von Teknolog', 'af Forselles', 'af Hällström', 'af Schultén', 'af Heurlin', 'de la Chapelle',
+    'Andersson', 'Blomqvist', 'Ekholm', 'Eriksson', 'Grönroos', 'Holmström', 'Karlsson', 'Lindqvist', 'Lindroos', 'Nyström', 'Sjöberg', 'Westerlund',
+    'Wikström', 'Åberg', 'Öhman', 'Hämäläinen', 'Heikkilä', 'Järvinen', 'Korhonen', 'Koskinen', 'Laine', 'Mäkinen', 'Nieminen', 'Virtanen',
+]
+STREETS = [
+    ('Otsvängen', '02150', 'Esbo'), ('Jämeråsvägen', '02150', 'Esbo'), ('Tekniksvägen', '02150', 'Esbo'), ('Bågvägen', '02150', 'Esbo'),
+    ('Hagalundsvägen', '02100', 'Esbo'), ('Mannerheimvägen', '00100', 'Helsingfors'), ('Runebergsgatan', '00100', 'Helsingfors'),
+    ('Tölögatan', '00260', 'Helsingfors'), ('Andra linjen', '00530', 'Helsingfors'), ('Hämeenkatu', '33100', 'Tammerfors'), ('Aurakatu', '20100', 'Åbo'),
+]
+GROUP_TYPES = [
+    'Styrelsen', 'Kontinuitetsrådet', 'Phuxutskottet', 'Festutskottet', 'Idrottsutskottet', 'Kulturutskottet', 'Informationsutskottet', 'Studieutskottet',
+    'Internationella utskottet', 'Näringslivsutskottet', 'Valberedningen', 'Revisorer', 'Redaktionen för Modulen', 'Teknologkören', 'Spexet', 'Jubileumskommittén',
+]
+FUNCTIONARY_TYPES = [
+    'Ordförande', 'Vice ordförande', 'Sekreterare', 'Skattmästare', 'Klubbmästare', 'Arkivarie', 'Fanbärare', 'Kanslist', 'Phuxivator', 'Idrottsledare',
+    'Kulturchef', 'Chefredaktör', 'Webbmästare', 'Dansledare', 'Sångledare', 'Gasque-ansvarig', 'Husbonde', 'Utlandssekreterare', 'Studiesekreterare',
+]
+DECORATIONS = [
+    'Hedersmedlem', 'Förtjänsttecken i guld', 'Förtjänsttecken i silver', 'Förtjänsttecken i brons', 'Stormästarmärket', 'Phuxivatorsmärket', 'Jubileumsmedaljen',
+]
+PROGRAMMES = [programme for programmes in DEGREE_PROGRAMME_CHOICES.values() for programme in programmes]
+
+# The values of these fields do not need to be prepared for the database
+PLAIN_FIELDS = [models.CharField, models.TextField, models.IntegerField, models.PositiveIntegerField, models.BooleanField, models.ForeignKey]
+
+# Enough of a MemberType for Member.get_membership_status()
+MemberTypeRow = namedtuple('MemberTypeRow', ['type', 'begin_date', 'end_date'])
+
+
+def slugify_name(name):
+    # The usernames are plain ASCII, like the real ones
+    return unicodedata.normalize('NFKD', name.split()[-1]).encode('ascii', 'ignore').decode().lower()
+
+
+def get_adapter(field):
+    '''
+    Returns the function that prepares the values of the field for the database, or None if they can be used as they are.
+    '''
+    if type(field) in PLAIN_FIELDS:
+        return None
+    if type(field) is models.DateField:
+        return connection.ops.adapt_datefield_value
+    return partial(field.get_db_prep_save, connection=connection)
+
+
+def is_timestamp(field):
+    return getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+
+
+def get_default(field, now):
+    # The timestamps of SuperClass are the same for all rows
+    return now if is_timestamp(field) else field.get_default()
+
+
+def get_fields(model):
+    '''
+    Returns the names of the fields that are inserted from model objects, which is all of them except the id and the timestamps.
+    '''
+    return [field.attname for field in model._meta.concrete_fields if not field.primary_key and not is_timestamp(field)]
+
+
+def get_names(names, n):
+    '''
+    Returns n unique names from the list, with a running number added to the names after the first round.
+    '''
+    return [names[i % len(names)] + (f' {i // len(names) + 1}' if i >= len(names) else '') for i in range(n)]
+
+
+class Command(BaseCommand):
+    help = 'Fill an empty registry with fake, but realistic, data for development and for measuring performance: members with membership histories, groups, functionaries and decorations for every year, and applicants. The same seed always gives the same registry. The rows are inserted directly with a plain cursor, and the denormalized data is calculated afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=50000, help='Amount of members')
+        parser.add_argument('--years', type=int, default=150, help='Amount of years, ending with the current one')
+        parser.add_argument('--group-types', type=int, default=30, help='Amount of group types')
+        parser.add_argument('--functionary-types', type=int, default=40, help='Amount of functionary types')
+        parser.add_argument('--decorations', type=int, default=15, help='Amount of decorations')
+        parser.add_argument('--applicants', type=int, default=200, help='Amount of applicants')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+        parser.add_argument('--batch-size', type=int, default=20000, help='Amount of rows inserted per query')
+
+    def handle(self, *args, **options):
+        if any(model.objects.exists() for model in [Member, GroupType, FunctionaryType, Decoration, Applicant]):
+            raise CommandError('The registry is not empty')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.today = date.today()
+        self.years = list(range(self.today.year - options['years'] + 1, self.today.year + 1))
+        self.rows = {}
+
+        start = perf_counter()
+        with transaction.atomic():
+            # The ids and enrolment years of all members, sorted by the enrolment year
+            self.member_ids, self.member_years = [], []
+            with search.rebuild_afterwards(connection):
+                self.create_members(options['members'])
+            self.create_groups(options['group_types'])
+            self.create_functionaries(options['functionary_types'])
+            self.create_decorations(options['decorations'])
+            self.create_applicants(options['applicants'])
+
+            # The membership status and the sort keys are calculated while creating the members, the rest is done by the usual commands
+            call_command('update_counters', stdout=self.stdout)
+            call_command('update_year_statistics', stdout=self.stdout)
+            ModelVersion.objects.bump_tables(*VERSIONED_MODELS)
+            member_name_index.invalidate()
+            invalidate_active_roster()
+
+        for model, n in self.rows.items():
+            self.stdout.write(f'Created {n} {model._meta.verbose_name_plural}')
+        self.stdout.write(f'Created {sum(self.rows.values())} rows in {perf_counter() - start:.1f} s')
+
+    def insert(self, model, fields, rows):
+        '''
+        Inserts the rows, which are tuples with the values of the given fields, using a plain cursor. The rest of the fields get their default values.
+
+        This is several times faster than bulk_create(), which spends most of its time preparing every value of every object one at a time, and is limited to a few rows per query on SQLite. Like with bulk_create(), save() is not called and no signals are sent.
+        '''
+        meta = model._meta
+        fields = [meta.get_field(field) for field in fields]
+        defaults = [field for field in meta.concrete_fields if field not in fields and not field.primary_key]
+        now = timezone.now()
+        default_values = tuple(field.get_db_prep_save(get_default(field, now), connection) for field in defaults)
+        adapters = [(i, adapter) for i, adapter in enumerate(map(get_adapter, fields)) if adapter]
+
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(field.column) for field in fields + defaults)
+        sql = f'INSERT INTO {quote(meta.db_table)} ({columns})'
+        placeholders = ['%s'] * (len(fields) + len(defaults))
+        with connection.cursor() as cursor:
+            for offset in range(0, len(rows), self.batch_size):
+                batch = rows[offset:offset + self.batch_size]
+                if adapters:
+                    batch = [list(row) for row in batch]
+                    for row in batch:
+                        for i, adapter in adapters:
+                            row[i] = adapter(row[i])
+                batch = [(*row, *default_values) for row in batch]
+                if connection.vendor == 'sqlite':
+                    # The same statement is prepared once and run for every row
+                    cursor.executemany(f'{sql} VALUES ({", ".join(placeholders)})', batch)
+                else:
+                    # psycopg2 runs executemany() one statement at a time, so all rows are put in the same statement instead
+                    cursor.execute(f'{sql} {connection.ops.bulk_insert_sql(fields + defaults, [placeholders] * len(batch))}', list(chain.from_iterable(batch)))
+        self.rows[model] = self.rows.get(model, 0) + len(rows)
+
+    def create_with_ids(self, model, fields, rows):
+        '''
+        Inserts the rows (see insert()) and returns their ids in the same order. The ids are fetched afterwards, which works as long as nobody else is adding rows to the registry at the same time.
+        '''
+        last_id = model.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        self.insert(model, fields, rows)
+        return list(model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True))
+
+    def sample_members(self, year, first, last, k):
+        '''
+        Returns the ids of at most k random members that enrolled between first and last years before the given year.
+        '''
+        start = bisect_left(self.member_years, year - last)
+        end = bisect_right(self.member_years, year - first)
+        return [self.member_ids[i] for i in self.rng.sample(range(start, end), min(k, end - start))]
+
+    def create_members(self, n):
+        rng = self.rng
+        # The amount of new students has grown over the years
+        weights = [1 + 4 * i / len(self.years) for i in range(len(self.years))]
+        years = sorted(rng.choices(self.years, weights, k=n))
+        fields = get_fields(Member)
+
+        for offset in range(0, n, self.batch_size):
+            members, histories = [], []
+            for i in range(offset, min(offset + self.batch_size, n)):
+                member, member_types = self.get_member(i, years[i])
+                # Done by MemberQuerySet.bulk_create() otherwise
+                member.update_sort_keys()
+                member.update_address_key()
+                members.append(member)
+                histories.append(member_types)
+
+            ids = self.create_with_ids(Member, fields, [tuple(getattr(member, field) for field in fields) for member in members])
+            member_types = []
+            for id, member, history in zip(ids, members, histories):
+                self.member_ids.append(id)
+                self.member_years.append(member.enrolment_year)
+                member_types.extend((id, *member_type) for member_type in history)
+            self.insert(MemberType, ['member_id', *MemberTypeRow._fields], member_types)
+
+    def get_member(self, i, year):
+        '''
+        Returns an unsaved Member with the given enrolment year, and its MemberTypes as MemberTypeRows.
+        '''
+        rng = self.rng
+        given_names = ' '.join(rng.sample(GIVEN_NAMES, rng.choice([1, 2, 2, 3])))
+        surname = rng.choice(SURNAMES)
+        age = self.today.year - year
+        # A few addresses are shared by several members, like student apartments
+        street, postal_code, city = rng.choice(STREETS)
+        street_address = f'{street} {rng.randint(1, 40)}' + (f' {rng.choice("ABC")} {rng.randint(1, 30)}' if rng.random() < 0.7 else '')
+        graduated = age > 5 and rng.random() < 0.8
+        username = f'{slugify_name(given_names.split()[0])[:8]}{slugify_name(surname)[:8]}{i}' if age < 30 else None
+
+        member = Member(
+            given_names=given_names,
+            preferred_name=rng.choice(given_names.split()) if rng.random() < 0.3 else '',
+            surname=surname,
+            street_address=street_address,
+            postal_code=postal_code,
+            city=city,
+            country='FI' if rng.random() < 0.95 else rng.choice(['SE', 'DE', 'EE', 'NO']),
+            phone=f'040 {rng.randint(1000000, 9999999)}' if age < 60 else '',
+            email=f'{username or f"member{i}"}@example.com',
+            birth_date=date(year - rng.randint(18, 22), rng.randint(1, 12), rng.randint(1, 28)),
+            student_id=f'{100000 + i}' if age < 50 else None,
+            degree_programme=rng.choice(PROGRAMMES),
+            enrolment_year=year,
+            graduated=graduated,
+            graduated_year=min(year + rng.randint(4, 8), self.today.year) if graduated else None,
+            dead=age > 60 and rng.random() < (age - 60) / 40,
+            subscribed_to_modulen=rng.random() < 0.6,
+            allow_publish_info=rng.random() < 0.7,
+            allow_studentbladet=rng.random() < 0.5,
+            username=username,
+        )
+
+        # Phux the first year, then ordinary member until either leaving or becoming a StÄlM after graduating
+        begin = date(year, 9, 1)
+        member_types = [MemberTypeRow('PH', begin, date(year, 12, 31)), MemberTypeRow('OM', begin, None)]
+        if graduated and rng.random() < 0.6:
+            stalm_begin = date(member.graduated_year, 5, 1)
+            if rng.random() < 0.2 and year + 3 < member.graduated_year:
+                member_types.append(MemberTypeRow('JS', date(year + 3, 5, 1), stalm_begin))
+            member_types[1] = member_types[1]._replace(end_date=stalm_begin)
+            member_types.append(MemberTypeRow('ST', stalm_begin, date(year + 50, 5, 1) if member.dead else None))
+        elif age > 8 or member.dead:
+            member_types[1] = member_types[1]._replace(end_date=date(year + rng.randint(4, 8), 5, 1))
+        member_types = [member_type._replace(begin_date=min(member_type.begin_date, self.today)) for member_type in member_types]
+
+        for field, value in Member.get_membership_status(member_types).items():
+            setattr(member, field, value)
+        return member, member_types
+
+    def get_active_years(self):
+        '''
+        Returns the years when a group type or functionary type existed. Most of them still exist, the rest have been discontinued.
+        '''
+        first = self.rng.choice(self.years)
+        last = self.years[-1] if self.rng.random() < 0.7 else self.rng.randint(first, self.years[-1])
+        return range(first, last + 1)
+
+    def create_groups(self, n):
+        names = get_names(GROUP_TYPES, n)
+        grouptype_ids = self.create_with_ids(GroupType, ['name'], [(name,) for name in names])
+
+        groups, sizes = [], []
+        for grouptype_id in grouptype_ids:
+            size = self.rng.randint(3, 15)
+            for year in self.get_active_years():
+                groups.append((grouptype_id, date(year, 1, 1), date(year, 12, 31)))
+                sizes.append(size)
+        group_ids = self.create_with_ids(Group, ['grouptype_id', 'begin_date', 'end_date'], groups)
+
+        memberships = [
+            (group_id, member_id)
+            for group_id, (grouptype_id, begin_date, end_date), size in zip(group_ids, groups, sizes)
+            for member_id in self.sample_members(begin_date.year, 1, 6, size)
+        ]
+        self.insert(GroupMembership, ['group_id', 'member_id'], memberships)
+
+    def create_functionaries(self, n):
+        names = get_names(FUNCTIONARY_TYPES, n)
+        functionarytype_ids = self.create_with_ids(FunctionaryType, ['name'], [(name,) for name in names])
+
+        functionaries = []
+        for functionarytype_id in functionarytype_ids:
+            size = self.rng.randint(1, 3)
+            for year in self.get_active_years():
+                functionaries.extend(
+                    (functionarytype_id, member_id, date(year, 1, 1), date(year, 12, 31))
+                    for member_id in self.sample_members(year, 1, 8, size)
+                )
+        self.insert(Functionary, ['functionarytype_id', 'member_id', 'begin_date', 'end_date'], functionaries)
+
+    def create_decorations(self, n):
+        names = get_names(DECORATIONS, n)
+        decoration_ids = self.create_with_ids(Decoration, ['name'], [(name,) for name in names])
+
+        ownerships = []
+        for decoration_id in decoration_ids:
+            # Nobody gets the same decoration twice
+            owners = set()
+            for year in self.years:
+                for member_id in self.sample_members(year, 3, 40, self.rng.randint(0, 3)):
+                    if member_id not in owners:
+                        owners.add(member_id)
+                        ownerships.append((decoration_id, member_id, date(year, 11, 1)))
+        self.insert(DecorationOwnership, ['decoration_id', 'member_id', 'acquired'], ownerships)
+
+    def create_applicants(self, n):
+        rng = self.rng
+        applicants = []
+        for i in range(n):
+            given_names = ' '.join(rng.sample(GIVEN_NAMES, rng.choice([1, 2, 3])))
+            surname = rng.choice(SURNAMES)
+            street, postal_code, city = rng.choice(STREETS)
+            applicants.append(Applicant(
+                given_names=given_names,
+                surname=surname,
+                street_address=f'{street} {rng.randint(1, 40)}',
+                postal_code=postal_code,
+                city=city,
+                phone=f'040 {rng.randint(1000000, 9999999)}',
+                email=f'applicant{i}@example.com',
+                birth_date=date(self.today.year - rng.randint(18, 22), rng.randint(1, 12), rng.randint(1, 28)),
+                student_id=f'{900000 + i}',
+                degree_programme=rng.choice(PROGRAMMES),
+                enrolment_year=self.today.year,
+                username=f'{slugify_name(given_names.split()[0])[:4]}{slugify_name(surname)[:4]}{i}',
+                motivation='',
+                mother_tongue=rng.choice(['Svenska', 'Finska', 'Engelska']),
+                subscribed_to_modulen=rng.random() < 0.6,
+                allow_publish_info=rng.random() < 0.7,
+                allow_studentbladet=rng.random() < 0.5,
+            ))
+        fields = get_fields(Applicant)
+        self.insert(Applicant, fields, [tuple(getattr(applicant, field) for field in fields) for applicant in applicants])
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from getenv import env
+from ldap import LDAPError
+from api.ldap import LDAPAccountManager, LDAPError_to_string
+
+
+class Command(BaseCommand):
+    help = 'Create or reset the LDAP entry LDAP_UIDNUMBER_COUNTER_DN, which the uidNumbers of new LDAP accounts are reserved from, to the number after the largest uidNumber in use.'
+
+    def handle(self, *args, **options):
+        if not env('LDAP_UIDNUMBER_COUNTER_DN'):
+            raise CommandError('LDAP_UIDNUMBER_COUNTER_DN is not set')
+        try:
+            with LDAPAccountManager() as lm:
+                uidnumber = lm.reset_uidnumber_counter()
+        except LDAPError as e:
+            raise CommandError(LDAPError_to_string(e))
+        self.stdout.write(f'The next uidNumber is {uidnumber}')
@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand
+from members.models import OutgoingMail
+
+
+class Command(BaseCommand):
+    help = 'Send the queued e-mails (see OutgoingMail) in batches over one SMTP connection. Run it regularly, for example from cron, or keep it running with --loop.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Amount of e-mails sent over one connection')
+        parser.add_argument('--loop', action='store_true', help='Keep running and check for new e-mails every --interval seconds')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to wait between the checks when looping')
+        parser.add_argument('--requeue-dead', action='store_true', help='Try to send the e-mails that have failed too many times again')
+
+    def handle(self, *args, **options):
+        if options['requeue_dead']:
+            n = OutgoingMail.objects.requeue_dead()
+            self.stdout.write(f'Queued {n} dead e-mails again')
+
+        while True:
+            n = OutgoingMail.objects.purge_dead()
+            if n:
+                self.stdout.write(f'Deleted {n} e-mails that have been dead for too long')
+            sent, failed = OutgoingMail.objects.send_queued(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f'Sent {sent} e-mails, {failed} failed')
+            # Continue right away if the batch was full
+            if sent + failed == options['batch_size']:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from members.models import Member
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the denormalized address keys of all members, used for sending mail only once to each address. Needs to be run after the field has been added.'
+
+    def handle(self, *args, **options):
+        n = Member.objects.all().update_address_keys()
+        self.stdout.write(f'Updated the address keys of {n} members')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from members.models import Decoration, FunctionaryType, Group, GroupType
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the denormalized counters of all decorations, functionary types, groups and group types. Needs to be run after the fields have been added, and after the counted objects have been changed without saving them one by one.'
+
+    def handle(self, *args, **options):
+        # The group type counters depend on the group counters
+        for model in [Decoration, FunctionaryType, Group, GroupType]:
+            n = model.objects.all().update_counters()
+            self.stdout.write(f'Updated the counters of {n} {model._meta.verbose_name_plural}')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from members.models import Member
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the denormalized membership status (current member type, JuniorStÄlM and phux year) of all members from their member types. Needs to be run after the fields have been added, and after member types have been changed without saving them one by one.'
+
+    def handle(self, *args, **options):
+        n = Member.objects.all().update_membership_status()
+        self.stdout.write(f'Updated the membership status of {n} members')
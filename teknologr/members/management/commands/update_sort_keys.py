@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from members.models import Member
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the denormalized name sort keys of all members. Needs to be run after the field has been added, and whenever the system locale (collation) changes.'
+
+    def handle(self, *args, **options):
+        n = Member.objects.all().update_sort_keys()
+        self.stdout.write(f'Updated the sort keys of {n} members')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from members.models import YearStatistics
+from katalogen.utils import invalidate_year_pages
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the statistics of all years shown on the years page in katalogen. Needs to be run after the table has been added, and after the counted objects have been changed without saving them one by one. The cached year pages of all years are removed as well.'
+
+    def handle(self, *args, **options):
+        years = set(YearStatistics.objects.values_list('year', flat=True))
+        n = YearStatistics.objects.rebuild()
+        years.update(YearStatistics.objects.values_list('year', flat=True))
+        invalidate_year_pages(years)
+        self.stdout.write(f'Updated the statistics of {n} years')
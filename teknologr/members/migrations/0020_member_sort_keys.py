@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('members', '0019_auto_20230420_1427'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='member',
+            name='full_name_sort_key',
+            field=models.TextField(blank=True, db_index=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='member',
+            name='public_full_name_sort_key',
+            field=models.TextField(blank=True, db_index=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='member',
+            name='surname_without_prefixes',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=32),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+from members import search
+
+
+def install(apps, schema_editor):
+    search.install(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('members', '0020_member_sort_keys'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
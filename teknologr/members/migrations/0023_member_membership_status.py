@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('members', '0022_modelversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='member',
+            name='junior_stalm',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='member',
+            name='membership_type',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=2),
+        ),
+        migrations.AddField(
+            model_name='member',
+            name='phux_year',
+            field=models.IntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('members', '0023_member_membership_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='decoration',
+            name='n_ownerships',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='functionarytype',
+            name='n_functionaries_total',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='functionarytype',
+            name='n_functionaries_unique',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='n_members',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='grouptype',
+            name='n_groups',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='grouptype',
+            name='n_groups_non_empty',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='grouptype',
+            name='n_members_total',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='grouptype',
+            name='n_members_unique',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('members', '0024_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='YearStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField(unique=True)),
+                ('decoration_ownerships', models.IntegerField(default=0)),
+                ('functionaries_total', models.IntegerField(default=0)),
+                ('functionaries_unique', models.IntegerField(default=0)),
+                ('groups', models.IntegerField(default=0)),
+                ('group_memberships_total', models.IntegerField(default=0)),
+                ('group_memberships_unique', models.IntegerField(default=0)),
+                ('members_ordinary', models.IntegerField(default=0)),
+                ('members_stalm', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
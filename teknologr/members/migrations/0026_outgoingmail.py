@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:48
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('members', '0025_yearstatistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingMail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('subject', models.CharField(max_length=255)),
+                ('message', models.TextField()),
+                ('sender', models.CharField(max_length=254)),
+                ('receivers', models.TextField()),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('dead', models.BooleanField(default=False)),
+            ],
+        ),
+    ]
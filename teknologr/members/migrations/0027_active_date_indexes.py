@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('members', '0026_outgoingmail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='functionary',
+            name='begin_date',
+            field=models.DateField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='functionary',
+            name='end_date',
+            field=models.DateField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='group',
+            name='begin_date',
+            field=models.DateField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='group',
+            name='end_date',
+            field=models.DateField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('members', '0027_active_date_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='member',
+            name='address_key',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=200),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:03
+
+from django.db import migrations, models
+from members.utils import SORT_KEY_COLLATION
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('members', '0028_member_address_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='member',
+            name='full_name_sort_key',
+            field=models.TextField(blank=True, db_collation=SORT_KEY_COLLATION, db_index=True, default='', editable=False),
+        ),
+        migrations.AlterField(
+            model_name='member',
+            name='public_full_name_sort_key',
+            field=models.TextField(blank=True, db_collation=SORT_KEY_COLLATION, db_index=True, default='', editable=False),
+        ),
+    ]
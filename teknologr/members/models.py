@@ -1,16 +1,25 @@
 # -*- coding: utf-8 -*-
 
-from django.db import models
-from django.db.models import Q, Prefetch, Count
+from django.db import models, transaction
+from django.db.models import Q, F, Prefetch, Count, Min, Max
 from django_countries.fields import CountryField
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django.utils.html import format_html
 from locale import strxfrm
-from operator import attrgetter
-from datetime import date
+from operator import attrgetter, or_
+from functools import reduce
+from datetime import date, timedelta
+from getenv import env
+import logging
+import re
+import unicodedata
+import weakref
 from katalogen.utils import *
 from members.utils import *
+from members import search
 
+logger = logging.getLogger(__name__)
 
 class SuperClass(models.Model):
     # This class is the base of everything
@@ -21,8 +30,83 @@ class SuperClass(models.Model):
         abstract = True
 
 
-class MemberManager(models.Manager):
-    def all_with_related(self):
+class MemberQuerySet(models.QuerySet):
+    '''
+    Bulk operations do not call Member.save() or send any signals, so the denormalized sort keys and address keys, the in-process name index (see name_index.py), the table version (see ModelVersionManager.bump_tables()) and the cached year pages in katalogen need to be taken care of here as well. QuerySet.bulk_update() uses QuerySet.update() under the hood, so it is covered too.
+    '''
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from members.name_index import member_name_index
+        objs = list(objs)
+        for member in objs:
+            member.update_sort_keys()
+            member.update_address_key()
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            member_name_index.invalidate()
+            ModelVersion.objects.bump_tables(Member)
+        return objs
+
+    def update(self, **kwargs):
+        from members.name_index import member_name_index
+        fields = set(kwargs)
+        if not fields.intersection(Member.SORT_KEY_SOURCE_FIELDS + Member.ADDRESS_KEY_SOURCE_FIELDS + search.STAFF_SEARCH_FIELDS):
+            with transaction.atomic(using=self.db):
+                ModelVersion.objects.bump_tables(Member)
+                return super().update(**kwargs)
+
+        with transaction.atomic(using=self.db):
+            ModelVersion.objects.bump_tables(Member)
+            if fields.intersection(Member.SORT_KEY_SOURCE_FIELDS + Member.ADDRESS_KEY_SOURCE_FIELDS):
+                # The updated rows might not match the filters anymore after the update, so need to remember which they were
+                ids = list(self.values_list('id', flat=True))
+            rows = super().update(**kwargs)
+            if fields.intersection(Member.SORT_KEY_SOURCE_FIELDS):
+                self.model.objects.filter(id__in=ids).update_sort_keys()
+                # The names are shown on the year pages
+                from members.signals import get_member_years, invalidate_active_roster
+                invalidate_year_pages(get_member_years(ids))
+                invalidate_active_roster()
+            if fields.intersection(Member.ADDRESS_KEY_SOURCE_FIELDS):
+                self.model.objects.filter(id__in=ids).update_address_keys()
+            if fields.intersection(search.STAFF_SEARCH_FIELDS):
+                member_name_index.invalidate()
+        return rows
+
+    def update_sort_keys(self, batch_size=1000):
+        '''
+        Recalculate the denormalized sort keys for all Members in this queryset. Returns the amount of updated Members.
+        '''
+        members = list(self.order_by())
+        for member in members:
+            member.update_sort_keys()
+        self.model.objects.bulk_update(members, Member.SORT_KEY_FIELDS, batch_size=batch_size)
+        return len(members)
+
+    def update_address_keys(self, batch_size=1000):
+        '''
+        Recalculate the denormalized address keys for all Members in this queryset. Returns the amount of updated Members.
+        '''
+        members = list(self.order_by())
+        for member in members:
+            member.update_address_key()
+        self.model.objects.bulk_update(members, ['address_key'], batch_size=batch_size)
+        return len(members)
+
+    def update_membership_status(self, batch_size=1000):
+        '''
+        Recalculate the denormalized membership fields for all Members in this queryset. Returns the amount of updated Members.
+        '''
+        members = list(self.order_by().prefetch_related(Prefetch('member_types', queryset=MemberType.objects.order_by('id'))))
+        for member in members:
+            for field, value in member.get_membership_status(list(member.member_types.all())).items():
+                setattr(member, field, value)
+        self.model.objects.bulk_update(members, Member.MEMBERSHIP_FIELDS, batch_size=batch_size)
+        return len(members)
+
+
+class MemberManager(models.Manager.from_queryset(MemberQuerySet)):
+    def all_with_related(self, member_types=True):
         '''
         This is done in 5 queries:
         1. SELECT Member WHERE id=member_id
@@ -30,57 +114,65 @@ class MemberManager(models.Manager):
         3. SELECT Functionary WHERE member__id=member_id
         4. SELECT GroupMembership WHERE member__id=member_id
         5. SELECT MemberType WHERE member__id=member_id
+
+        The counts are calculated with subqueries (see get_count_subquery()), since joining all three relations at once would multiply the rows with each other.
+
+        The last prefetch can be skipped if only the current membership status is needed, since that is stored on the Member itself.
         '''
-        return Member.objects.prefetch_related(
+        prefetches = [
             Prefetch('decoration_ownerships', queryset=DecorationOwnership.objects.select_related('decoration')),
             Prefetch('functionaries', queryset=Functionary.objects.select_related('functionarytype')),
             Prefetch('group_memberships', queryset=GroupMembership.objects.select_related('group', 'group__grouptype')),
-            'member_types',
-        ).annotate(
-            count_decoration_ownerships=Count('decoration_ownerships'),
-            count_functionaries=Count('functionaries'),
-            count_group_memberships=Count('group_memberships'),
+        ]
+        if member_types:
+            prefetches.append('member_types')
+        return Member.objects.prefetch_related(*prefetches).annotate(
+            count_decoration_ownerships=get_count_subquery(DecorationOwnership.objects.all(), 'member'),
+            count_functionaries=get_count_subquery(Functionary.objects.all(), 'member'),
+            count_group_memberships=get_count_subquery(GroupMembership.objects.all(), 'member'),
         )
 
-    def get_prefetched_or_404(self, member_id):
-        return get_object_or_404(self.all_with_related(), id=member_id)
+    def get_prefetched_or_404(self, member_id, member_types=True):
+        return get_object_or_404(self.all_with_related(member_types), id=member_id)
+
+    def search_by_name(self, queries, staff_search=False, limit=None):
+        '''
+        Search for Members matching all the queries, ranked by how well they match (see search.get_rank()) and then by name.
 
-    def search_by_name(self, queries, staff_search=False):
+        The name fields are indexed for substring searches on PostgreSQL and SQLite, see the search module.
+        '''
         if not queries:
-            return []
+            return self.none()
 
         queries = [q.lower() for q in queries]
+        fields = search.STAFF_SEARCH_FIELDS if staff_search else search.PUBLIC_SEARCH_FIELDS
         if staff_search:
-            # Search within comments too since that can include old names or nicknames
-            filters = [(
-                Q(given_names__icontains=q) |
-                Q(preferred_name__icontains=q) |
-                Q(surname__icontains=q) |
-                Q(comment__icontains=q) |
-                Q(email__icontains=q) |
-                Q(username__icontains=q)
-            ) for q in queries]
+            filters = [reduce(or_, [Q(**{f'{field}__icontains': q}) for field in fields]) for q in queries]
         else:
+            # Hidden Members can not be matched on a non-preferred given name. If a Member has no preferred name the first given name is used as such.
             filters = [(
-                Q(given_names__icontains=q) |
+                Q(surname__icontains=q) |
                 Q(preferred_name__icontains=q) |
-                Q(surname__icontains=q)
+                Q(preferred_name='', given_names__iregex=r'^\S*' + re.escape(q)) |
+                Q(given_names__icontains=q, allow_publish_info=True)
             ) for q in queries]
-        members = self.filter(*filters)
-        members = list(members)
-
-        # Need to remove hidden Members that were matched on a non-preferred given name
-        if not staff_search:
-            members = [m for m in members if m.allow_publish_info or all([q in m.surname.lower() or q in m.get_preferred_name().lower() for q in queries])]
-
-        return members
 
+        members = search.filter_candidates(self.get_queryset(), queries, fields)
+        members = members.filter(*filters).annotate(search_rank=search.get_rank(queries)).order_by('search_rank', 'full_name_sort_key')
+        return members[:limit] if limit else members
 
 class Member(SuperClass):
     objects = MemberManager()
     STAFF_ONLY_FIELDS = ['birth_date', 'student_id', 'dead', 'subscribed_to_modulen', 'allow_publish_info', 'allow_studentbladet', 'comment', 'username', 'bill_code']
     HIDABLE_FIELDS = ['street_address', 'postal_code', 'city', 'country', 'phone', 'email', 'degree_programme', 'enrolment_year', 'graduated', 'graduated_year']
     # NOTE: given_names is semi-hidable
+    # Denormalized fields that are calculated from the SORT_KEY_SOURCE_FIELDS on save, see update_sort_keys()
+    SORT_KEY_FIELDS = ['surname_without_prefixes', 'full_name_sort_key', 'public_full_name_sort_key']
+    SORT_KEY_SOURCE_FIELDS = ['given_names', 'preferred_name', 'surname', 'allow_publish_info', 'dead']
+    # Denormalized field that is calculated from the ADDRESS_KEY_SOURCE_FIELDS on save, see update_address_key()
+    ADDRESS_KEY_SOURCE_FIELDS = ['street_address', 'city', 'country']
+    # Denormalized fields that are calculated from the MemberTypes of the Member, see update_membership_status()
+    MEMBERSHIP_FIELDS = ['membership_type', 'junior_stalm', 'phux_year']
 
     # NAMES
     given_names = models.CharField(max_length=64, blank=False, null=False, default="UNKNOWN")
@@ -113,6 +205,16 @@ class Member(SuperClass):
     # IT-username and BILL
     username = models.CharField(max_length=32, blank=False, null=True, editable=False, unique=True)
     bill_code = models.CharField(max_length=8, blank=False, null=True, editable=False)
+    # SORTING, the keys need to be compared character by character (see get_collation_key())
+    surname_without_prefixes = models.CharField(max_length=32, blank=True, null=False, default="", editable=False, db_index=True)
+    full_name_sort_key = models.TextField(blank=True, null=False, default="", editable=False, db_index=True, db_collation=SORT_KEY_COLLATION)
+    public_full_name_sort_key = models.TextField(blank=True, null=False, default="", editable=False, db_index=True, db_collation=SORT_KEY_COLLATION)
+    # ADDRESS KEY, for finding Members living at the same address
+    address_key = models.CharField(max_length=200, blank=True, null=False, default="", editable=False, db_index=True)
+    # MEMBERSHIP
+    membership_type = models.CharField(max_length=2, blank=True, null=False, default="", editable=False, db_index=True)
+    junior_stalm = models.BooleanField(default=False, editable=False)
+    phux_year = models.IntegerField(blank=True, null=True, editable=False, db_index=True)
 
     def __init__(self, *args, **kwargs):
         super(Member, self).__init__(*args, **kwargs)
@@ -177,7 +279,7 @@ class Member(SuperClass):
 
         # Let's assume the prefixes in question are always written with lowercase, and that everything written in all lowercase are prefixes...
         surname = self.surname
-        return surname.lstrip('abcdefghijklmnopqrstuvwxyzåäö ') or surname.split()[-1]
+        return surname.lstrip('abcdefghijklmnopqrstuvwxyzåäö ') or (surname.split() or [surname])[-1]
 
     def get_full_name_HTML(self):
         '''
@@ -219,14 +321,31 @@ class Member(SuperClass):
             return self.full_name_for_sorting
         return f'{self.get_surname_without_prefixes()}, {self.get_given_names_with_initials()}'
 
+    def update_sort_keys(self):
+        '''
+        Sorting Members by name in Python using strxfrm() requires all Members to be loaded first, so the sort keys are stored in the database instead. This way the database can do the sorting (and slicing) using ORDER BY, with the same result as sorting by strxfrm(full_name_for_sorting).
+
+        NOTE: The keys depend on the system locale, so they need to be recalculated if it changes. This is done with the 'update_sort_keys' management command.
+        '''
+        self.surname_without_prefixes = self.get_surname_without_prefixes()
+        self.full_name_sort_key = get_collation_key(self.full_name_for_sorting)
+        self.public_full_name_sort_key = get_collation_key(self.public_full_name_for_sorting)
+
+    def update_address_key(self):
+        '''
+        The address in a form where different ways of writing the same address (case, punctuation and whitespace) are the same, so that mail can be sent only once to each address (see dump_modulen). The key is empty if there is no street address.
+        '''
+        if not self.street_address.strip():
+            self.address_key = ''
+            return
+
+        def normalize(s):
+            return ' '.join(re.sub(r'[.,]', ' ', unicodedata.normalize('NFKC', s)).casefold().split())
+        self.address_key = '|'.join([normalize(self.street_address), normalize(self.city), str(self.country)])[:200]
+
     @property
     def current_member_type(self):
-        member_type = self.getMostRecentMemberType()
-
-        if member_type:
-            return member_type.get_type_display()
-        else:
-            return ""
+        return dict(MemberType.TYPES).get(self.membership_type, "")
 
     @property
     def full_address(self):
@@ -261,6 +380,17 @@ class Member(SuperClass):
         if not self.student_id:
             self.student_id = None
 
+        self.update_sort_keys()
+        self.update_address_key()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if update_fields.intersection(self.SORT_KEY_SOURCE_FIELDS):
+                update_fields.update(self.SORT_KEY_FIELDS)
+            if update_fields.intersection(self.ADDRESS_KEY_SOURCE_FIELDS):
+                update_fields.add('address_key')
+            kwargs['update_fields'] = update_fields
+
         # Sync email to LDAP if changed
         error = None
         if self.username and self.email != self._original_email:
@@ -281,36 +411,50 @@ class Member(SuperClass):
         if error:
             raise error
 
-    def getMostRecentMemberType(self):
-        types = self.member_types.all()
-
-        if (len(types)) == 0:
-            return None
-
-        ordinarie = next((x for x in types if x.type == "OM"), None)
+    @staticmethod
+    def get_membership_status(member_types):
+        '''
+        Calculate the values of the denormalized MEMBERSHIP_FIELDS from a list of MemberTypes:
+        - membership_type: 'OM' or 'ST' if the first such MemberType has not ended, otherwise ''
+        - junior_stalm: If the Member has ever been a JuniorStÄlM
+        - phux_year: The year of the (first) Phux MemberType
+        '''
+        membership_type = ""
+        ordinarie = next((x for x in member_types if x.type == "OM"), None)
+        stalm = next((x for x in member_types if x.type == "ST"), None)
         if ordinarie and not ordinarie.end_date:
-            return ordinarie
+            membership_type = ordinarie.type
+        elif stalm and not stalm.end_date:
+            membership_type = stalm.type
+
+        # XXX: Do we need to take into account multiple Phux MemberTypes?
+        phux = next((x for x in member_types if x.type == "PH"), None)
 
-        stalm = next((x for x in types if x.type == "ST"), None)
-        if stalm and not stalm.end_date:
-            return stalm
+        return {
+            'membership_type': membership_type,
+            'junior_stalm': any(x.type == "JS" for x in member_types),
+            'phux_year': phux.begin_date.year if phux and phux.begin_date else None,
+        }
 
-        return None
+    def update_membership_status(self):
+        '''
+        Recalculate and save the denormalized membership fields. Needs to be called whenever the MemberTypes of the Member change, which is done automatically when a MemberType is saved or deleted (see signals.py).
+        '''
+        status = self.get_membership_status(list(MemberType.objects.filter(member_id=self.id).order_by('id')))
+        for field, value in status.items():
+            setattr(self, field, value)
+        Member.objects.filter(id=self.id).update(**status)
 
     def shouldBeStalm(self):
         ''' Used to find Juniorstalmar members that should magically become stalmar somehow '''
-        return not self.isValidMember() and ("JS" in [x.type for x in MemberType.objects.filter(member=self)])
+        return not self.isValidMember() and self.junior_stalm
 
     def isValidMember(self):
-        memberType = self.getMostRecentMemberType()
-        return memberType is not None and (memberType.type == "OM" or memberType.type == "ST")
+        return self.membership_type in ["OM", "ST"]
 
-    @property
-    def phux_year(self):
-        types = self.member_types.all()
-        # XXX: Do we need to take into account multiple Phux MemberTypes?
-        member_type_phux = next((x for x in types if x.type == "PH"), None)
-        return member_type_phux.begin_date.year if member_type_phux else None
+    @classmethod
+    def get_valid_member_Q(cls):
+        return Q(membership_type__in=["OM", "ST"])
 
     def showContactInformation(self):
         return self.allow_publish_info and not self.dead
@@ -343,7 +487,7 @@ class Member(SuperClass):
     @classmethod
     def order_by(cls, members_list, by, reverse=False):
         if by == 'name':
-            key = lambda m: strxfrm(m.full_name_for_sorting)
+            key = attrgetter('full_name_sort_key')
         else:
             return
         members_list.sort(key=key, reverse=reverse)
@@ -378,15 +522,39 @@ class DecorationOwnership(SuperClass):
         elif by == 'name':
             key = lambda do: strxfrm(do.decoration.name)
         elif by == 'member':
-            key = lambda do: strxfrm(do.member.full_name_for_sorting)
+            key = attrgetter('member.full_name_sort_key')
         else:
             return
         ownerships_list.sort(key=key, reverse=reverse)
 
-class DecorationManager(models.Manager):
-    def get_queryset(self):
-        return super().get_queryset().annotate(count=Count('ownerships'))
+class CounterQuerySet(models.QuerySet):
+    '''
+    Base class for the querysets of the models with denormalized counters, which are defined by get_counters().
+    '''
+
+    def get_counters(self):
+        raise NotImplementedError()
+
+    def update_counters(self):
+        '''
+        Recalculate the denormalized counters of the objects in this queryset. Returns the amount of updated objects.
+
+        The counts are calculated by the database in the same UPDATE query, but that alone is not enough when several transactions change the counted objects at the same time. With the default isolation level (READ COMMITTED), both could count before the other one has committed, and the one writing last would leave out the object of the other. The rows are therefore locked first, so that a transaction recounting the same rows has to wait until the other one has committed, and then sees its objects too.
+        '''
+        with transaction.atomic(using=self.db):
+            list(self.select_for_update().order_by('id').values_list('id', flat=True))
+            ModelVersion.objects.bump_tables(self.model)
+            return self.update(**self.get_counters())
+
 
+class DecorationQuerySet(CounterQuerySet):
+    def get_counters(self):
+        '''
+        The counters of the Decorations, updated automatically when DecorationOwnerships are saved or deleted (see signals.py).
+        '''
+        return {'n_ownerships': get_count_subquery(DecorationOwnership.objects.all(), 'decoration')}
+
+class DecorationManager(models.Manager.from_queryset(DecorationQuerySet)):
     def all_by_name(self):
         l = list(self.get_queryset())
         Decoration.order_by(l, 'name')
@@ -407,15 +575,16 @@ class Decoration(SuperClass):
     objects = DecorationManager()
     name = models.CharField(max_length=64, blank=False, null=False, unique=True)
     comment = models.TextField(blank=True, default='')
+    # COUNTERS, see update_counters()
+    n_ownerships = models.IntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
 
     @property
-    def n_ownerships(self):
-        if hasattr(self, 'count'):
-            return self.count
-        return self.ownerships.count()
+    def count(self):
+        # Shown in the side bar
+        return self.n_ownerships
 
     @property
     def ownerships_by_date(self):
@@ -452,16 +621,20 @@ class GroupMembership(SuperClass):
         elif by == 'name':
             key = lambda gm: strxfrm(gm.group.grouptype.name)
         elif by == 'member':
-            key = lambda gm: strxfrm(gm.member.full_name_for_sorting)
+            key = attrgetter('member.full_name_sort_key')
         else:
             return
         memberships_list.sort(key=key, reverse=reverse)
 
 
-class GroupManager(models.Manager):
-    def get_queryset(self):
-        return super().get_queryset().annotate(num_members=Count('memberships', distinct=True))
+class GroupQuerySet(CounterQuerySet):
+    def get_counters(self):
+        '''
+        The counters of the Groups, updated automatically when GroupMemberships are saved or deleted (see signals.py).
+        '''
+        return {'n_members': get_count_subquery(GroupMembership.objects.all(), 'group')}
 
+class GroupManager(models.Manager.from_queryset(GroupQuerySet)):
     def year(self, year):
         return self.get_queryset().prefetch_related(
             Prefetch(
@@ -469,7 +642,7 @@ class GroupManager(models.Manager):
                 queryset=GroupMembership.objects.select_related('member')
             ),
             'grouptype'
-        ).filter(begin_date__lte=date(int(year), 12, 31), end_date__gte=date(int(year), 1, 1), num_members__gt=0)
+        ).filter(begin_date__lte=date(int(year), 12, 31), end_date__gte=date(int(year), 1, 1), n_members__gt=0)
 
     def year_ordered_and_counts(self, year):
         queryset = self.year(year)
@@ -481,18 +654,15 @@ class GroupManager(models.Manager):
 class Group(SuperClass):
     objects = GroupManager()
     grouptype = models.ForeignKey("GroupType", on_delete=models.CASCADE, related_name="groups")
-    begin_date = models.DateField()
-    end_date = models.DateField()
+    # Indexed for finding the current ones, see get_active_roster()
+    begin_date = models.DateField(db_index=True)
+    end_date = models.DateField(db_index=True)
+    # COUNTERS, see update_counters()
+    n_members = models.IntegerField(default=0, editable=False)
 
     def __str__(self):
         return f'{self.grouptype}: {self.begin_date} - {self.end_date}'
 
-    @property
-    def n_members(self):
-        if hasattr(self, 'num_members'):
-            return self.num_members
-        return self.memberships.count()
-
     @property
     def duration(self):
         return Duration(self.begin_date, self.end_date)
@@ -513,15 +683,19 @@ class Group(SuperClass):
             return
         groups_list.sort(key=key, reverse=reverse)
 
-class GroupTypeManager(models.Manager):
-    def get_queryset(self):
-        return super().get_queryset().annotate(
-            count=Count('groups', distinct=True),
-            count_non_empty=Count('groups', distinct=True, filter=Q(groups__memberships__gt=0)),
-            count_members_total=Count('groups__memberships'),
-            count_members_unique=Count('groups__memberships__member', distinct=True),
-        )
-
+class GroupTypeQuerySet(CounterQuerySet):
+    def get_counters(self):
+        '''
+        The counters of the GroupTypes, updated automatically when Groups or GroupMemberships are saved or deleted (see signals.py). The counters of the Groups need to be up to date first.
+        '''
+        return {
+            'n_groups': get_count_subquery(Group.objects.all(), 'grouptype'),
+            'n_groups_non_empty': get_count_subquery(Group.objects.filter(n_members__gt=0), 'grouptype'),
+            'n_members_total': get_count_subquery(GroupMembership.objects.all(), 'group__grouptype'),
+            'n_members_unique': get_count_subquery(GroupMembership.objects.all(), 'group__grouptype', distinct='member'),
+        }
+
+class GroupTypeManager(models.Manager.from_queryset(GroupTypeQuerySet)):
     def all_by_name(self):
         l = list(self.get_queryset())
         GroupType.order_by(l, 'name')
@@ -544,27 +718,19 @@ class GroupType(SuperClass):
     objects = GroupTypeManager()
     name = models.CharField(max_length=64, blank=False, null=False, unique=True)
     comment = models.TextField(blank=True, default='')
+    # COUNTERS, see update_counters()
+    n_groups = models.IntegerField(default=0, editable=False)
+    n_groups_non_empty = models.IntegerField(default=0, editable=False)
+    n_members_total = models.IntegerField(default=0, editable=False)
+    n_members_unique = models.IntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
 
     @property
-    def n_groups(self):
-        if hasattr(self, 'count'):
-            return self.count
-        return self.groups.count()
-
-    @property
-    def n_members_total(self):
-        if hasattr(self, 'count_members_total'):
-            return self.count_members_total
-        return self.groups.aggregate(count=Count('memberships'))['count']
-
-    @property
-    def n_members_unique(self):
-        if hasattr(self, 'count_members_unique'):
-            return self.count_members_unique
-        return self.groups.aggregate(count=Count('memberships__member', distinct=True))['count']
+    def count(self):
+        # Shown in the side bar
+        return self.n_groups
 
     @property
     def groups_by_date(self):
@@ -601,8 +767,9 @@ class Functionary(SuperClass):
     objects = FunctionaryManager()
     member = models.ForeignKey("Member", on_delete=models.CASCADE, related_name="functionaries")
     functionarytype = models.ForeignKey("FunctionaryType", on_delete=models.CASCADE, related_name="functionaries")
-    begin_date = models.DateField()
-    end_date = models.DateField()
+    # Indexed for finding the current ones, see get_active_roster()
+    begin_date = models.DateField(db_index=True)
+    end_date = models.DateField(db_index=True)
 
     class Meta:
         unique_together = (("member", "functionarytype", "begin_date", "end_date"),)
@@ -621,18 +788,22 @@ class Functionary(SuperClass):
         elif by == 'name':
             key = lambda f: strxfrm(f.functionarytype.name)
         elif by == 'member':
-            key = lambda f: strxfrm(f.member.full_name_for_sorting)
+            key = attrgetter('member.full_name_sort_key')
         else:
             return
         functionaries_list.sort(key=key, reverse=reverse)
 
-class FunctionaryTypeManager(models.Manager):
-    def get_queryset(self):
-        return super().get_queryset().annotate(
-            count=Count('functionaries'),
-            count_unique=Count('functionaries__member', distinct=True),
-        )
+class FunctionaryTypeQuerySet(CounterQuerySet):
+    def get_counters(self):
+        '''
+        The counters of the FunctionaryTypes, updated automatically when Functionaries are saved or deleted (see signals.py).
+        '''
+        return {
+            'n_functionaries_total': get_count_subquery(Functionary.objects.all(), 'functionarytype'),
+            'n_functionaries_unique': get_count_subquery(Functionary.objects.all(), 'functionarytype', distinct='member'),
+        }
 
+class FunctionaryTypeManager(models.Manager.from_queryset(FunctionaryTypeQuerySet)):
     def all_by_name(self):
         l = list(self.get_queryset())
         FunctionaryType.order_by(l, 'name')
@@ -653,21 +824,17 @@ class FunctionaryType(SuperClass):
     objects = FunctionaryTypeManager()
     name = models.CharField(max_length=64, blank=False, null=False, unique=True)
     comment = models.TextField(blank=True, default='')
+    # COUNTERS, see update_counters()
+    n_functionaries_total = models.IntegerField(default=0, editable=False)
+    n_functionaries_unique = models.IntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
 
     @property
-    def n_functionaries_total(self):
-        if hasattr(self, 'count'):
-            return self.count
-        return self.functionaries.count()
-
-    @property
-    def n_functionaries_unique(self):
-        if hasattr(self, 'count_unique'):
-            return self.count_unique
-        return self.functionaries.aggregate(count=Count('member', distinct=True))['count']
+    def count(self):
+        # Shown in the side bar
+        return self.n_functionaries_total
 
     @property
     def functionaries_by_date(self):
@@ -696,17 +863,13 @@ class MemberTypeManager(models.Manager):
         return self.begin_year(year).filter(type='OM')
 
     def ordinary_members_begin_year_ordered(self, year):
-        l = list(self.ordinary_members_begin_year(year))
-        MemberType.order_by(l, 'member')
-        return l
+        return self.ordinary_members_begin_year(year).order_by('member__full_name_sort_key')
 
     def stalms_begin_year(self, year):
         return self.begin_year(year).filter(type='ST')
 
     def stalms_begin_year_ordered(self, year):
-        l = list(self.stalms_begin_year(year))
-        MemberType.order_by(l, 'member')
-        return l
+        return self.stalms_begin_year(year).order_by('member__full_name_sort_key')
 
 class MemberType(SuperClass):
     objects = MemberTypeManager()
@@ -740,7 +903,302 @@ class MemberType(SuperClass):
         elif by == 'end_date':
             key = lambda mt: mt.end_date or date(9999, 12, 31)
         elif by == 'member':
-            key = lambda mt: strxfrm(mt.member.full_name_for_sorting)
+            key = attrgetter('member.full_name_sort_key')
         else:
             return
         membertypes_list.sort(key=key, reverse=reverse)
+
+
+class ModelVersionManager(models.Manager):
+    def get_version(self, name):
+        return self.filter(name=name).values_list('version', flat=True).first() or 0
+
+    def bump(self, name):
+        '''
+        Increment the version with the given name and return the new version. The row stays locked until the end of the current transaction, so the returned version is exactly the one set here.
+        '''
+        with transaction.atomic(using=self.db):
+            if not self.filter(name=name).update(version=F('version') + 1, modified=timezone.now()):
+                self.get_or_create(name=name)
+                self.filter(name=name).update(version=F('version') + 1, modified=timezone.now())
+            return self.get_version(name)
+
+    @staticmethod
+    def get_table_version_name(model):
+        return f'table:{model._meta.db_table}'
+
+    def bump_tables(self, *models):
+        '''
+        Bump the versions of the database tables of the given models, to mark that something in them has changed. See api.utils.conditional().
+        '''
+        for model in models:
+            self.bump(self.get_table_version_name(model))
+
+    def get_table_versions(self, models):
+        '''
+        Returns a dict of table version names to (version, modified) pairs, for the tables of the given models that have been changed at least once.
+        '''
+        names = [self.get_table_version_name(model) for model in models]
+        return {name: (version, modified) for name, version, modified in self.filter(name__in=names).values_list('name', 'version', 'modified')}
+
+
+class ModelVersion(models.Model):
+    '''
+    A generation counter that is bumped every time some data changes, so that caches in other processes can tell when they are out of date.
+    '''
+    objects = ModelVersionManager()
+    name = models.CharField(max_length=64, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.version}'
+
+
+class YearStatisticsManager(models.Manager):
+    # The amount of years counted per query, so that the queries do not get too large
+    YEARS_PER_QUERY = 25
+
+    def update_years(self, years):
+        '''
+        Recalculate the statistics of the given years. This is done automatically when the counted objects are saved or deleted (see signals.py and update_years_on_commit()).
+
+        Functionaries and Groups are counted in every year their interval covers, the same way as on the page of each year. The counts of all the years are calculated by the database with one filtered aggregate per year and count.
+
+        The rows of the years are locked while they are recalculated, so that concurrent updates of the same years are done one after the other, and the later one sees everything the earlier one committed. Rows are first created for the years that do not have one, ignoring the ones that another transaction just created, since there is nothing to lock otherwise. Years with nothing to show are removed again afterwards.
+        '''
+        years = sorted(set(years))
+        if not years:
+            return
+
+        with transaction.atomic(using=self.db):
+            self.bulk_create([YearStatistics(year=year) for year in years], ignore_conflicts=True)
+            rows = list(self.select_for_update().filter(year__in=years).order_by('year'))
+            counts = {}
+            for i in range(0, len(years), self.YEARS_PER_QUERY):
+                counts.update(self.count_years(years[i:i + self.YEARS_PER_QUERY]))
+
+            for row in rows:
+                for field, value in counts[row.year].items():
+                    setattr(row, field, value)
+            self.bulk_update([row for row in rows if any(counts[row.year].values())], YearStatistics.COUNT_FIELDS)
+            self.filter(id__in=[row.id for row in rows if not any(counts[row.year].values())]).delete()
+
+    def count_years(self, years):
+        '''
+        Returns a dict with the values of the YearStatistics.COUNT_FIELDS for each of the given years, calculated in 4 queries.
+        '''
+        begin, end = date(min(years), 1, 1), date(max(years), 12, 31)
+
+        def overlaps(year, prefix=''):
+            return Q(**{f'{prefix}begin_date__lte': date(year, 12, 31), f'{prefix}end_date__gte': date(year, 1, 1)})
+
+        functionaries = Functionary.objects.filter(begin_date__lte=end, end_date__gte=begin).aggregate(**{
+            f'{field}_{year}': aggregate
+            for year in years
+            for field, aggregate in [
+                ('total', Count('id', filter=overlaps(year))),
+                ('unique', Count('member', distinct=True, filter=overlaps(year))),
+            ]
+        })
+        memberships = GroupMembership.objects.filter(group__begin_date__lte=end, group__end_date__gte=begin).aggregate(**{
+            f'{field}_{year}': aggregate
+            for year in years
+            for field, aggregate in [
+                ('groups', Count('group', distinct=True, filter=overlaps(year, 'group__'))),
+                ('total', Count('id', filter=overlaps(year, 'group__'))),
+                ('unique', Count('member', distinct=True, filter=overlaps(year, 'group__'))),
+            ]
+        })
+        # Filtering by a single year compares the dates to the first and last day of the year, so the year does not need to be extracted from every row
+        decorations = DecorationOwnership.objects.filter(acquired__range=(begin, end)).aggregate(**{
+            f'total_{year}': Count('id', filter=Q(acquired__year=year))
+            for year in years
+        })
+        members = MemberType.objects.filter(begin_date__range=(begin, end), type__in=['OM', 'ST']).aggregate(**{
+            f'{type}_{year}': Count('id', filter=Q(type=type, begin_date__year=year))
+            for year in years
+            for type in ['OM', 'ST']
+        })
+
+        return {year: {
+            'decoration_ownerships': decorations[f'total_{year}'],
+            'functionaries_total': functionaries[f'total_{year}'],
+            'functionaries_unique': functionaries[f'unique_{year}'],
+            'groups': memberships[f'groups_{year}'],
+            'group_memberships_total': memberships[f'total_{year}'],
+            'group_memberships_unique': memberships[f'unique_{year}'],
+            'members_ordinary': members[f'OM_{year}'],
+            'members_stalm': members[f'ST_{year}'],
+        } for year in years}
+
+    def update_years_on_commit(self, years):
+        '''
+        Recalculate the statistics of the given years once the current transaction has been committed, or right away outside of transactions. The years of all changes in the same transaction are collected and recalculated together, so that for example deleting a Member, which deletes all its related objects one by one, only recalculates the statistics once.
+        '''
+        years = set(years)
+        if not years:
+            return
+        connection = transaction.get_connection(self.db)
+        if not connection.in_atomic_block:
+            self.update_years(years)
+            return
+
+        # Django drops the callbacks of rolled back savepoints, so every change gets a callback of its own. They share the pending years, and the first one to run after the commit recalculates all of them. The connection only keeps a weak reference to the pending years, so that they go away with the callbacks if the whole transaction is rolled back, instead of ending up in the next transaction. The years of a rolled back savepoint might get recalculated too, which is harmless.
+        ref = getattr(connection, 'year_statistics_pending', None)
+        pending = ref() if ref else None
+        if pending is None:
+            pending = set()
+            ref = connection.year_statistics_pending = weakref.ref(pending)
+        pending.update(years)
+
+        def callback():
+            if connection.year_statistics_pending is ref:
+                connection.year_statistics_pending = None
+                self.update_years(pending)
+        transaction.on_commit(callback, using=self.db)
+
+    def rebuild(self):
+        '''
+        Recalculate the statistics of all years. Returns the amount of years with statistics.
+        '''
+        dates = [
+            Functionary.objects.aggregate(min=Min('begin_date'), max=Max('end_date')),
+            Group.objects.filter(memberships__isnull=False).aggregate(min=Min('begin_date'), max=Max('end_date')),
+            DecorationOwnership.objects.aggregate(min=Min('acquired'), max=Max('acquired')),
+            MemberType.objects.filter(type__in=['OM', 'ST']).aggregate(min=Min('begin_date'), max=Max('begin_date')),
+        ]
+        years = {d.year for minmax in dates for d in minmax.values() if d}
+
+        with transaction.atomic(using=self.db):
+            self.all().delete()
+            if years:
+                self.update_years(range(min(years), max(years) + 1))
+        return self.count()
+
+
+class YearStatistics(models.Model):
+    '''
+    Precalculated statistics for each year, shown on the years page in katalogen.
+    '''
+    objects = YearStatisticsManager()
+    year = models.IntegerField(unique=True)
+    decoration_ownerships = models.IntegerField(default=0)
+    functionaries_total = models.IntegerField(default=0)
+    functionaries_unique = models.IntegerField(default=0)
+    groups = models.IntegerField(default=0)
+    group_memberships_total = models.IntegerField(default=0)
+    group_memberships_unique = models.IntegerField(default=0)
+    members_ordinary = models.IntegerField(default=0)
+    members_stalm = models.IntegerField(default=0)
+
+    COUNT_FIELDS = [
+        'decoration_ownerships',
+        'functionaries_total',
+        'functionaries_unique',
+        'groups',
+        'group_memberships_total',
+        'group_memberships_unique',
+        'members_ordinary',
+        'members_stalm',
+    ]
+
+    def __str__(self):
+        return str(self.year)
+
+
+class OutgoingMailManager(models.Manager):
+    def queue(self, subject, message, sender, receivers):
+        '''
+        Queue an e-mail to be sent by the send_queued_mail command, so that the request does not need to wait for the SMTP server.
+        '''
+        return self.create(subject=subject, message=message, sender=sender, receivers='\n'.join(receivers))
+
+    def due(self):
+        return self.filter(dead=False, next_attempt__lte=timezone.now()).order_by('next_attempt', 'id')
+
+    def send_queued(self, batch_size=100, connection=None):
+        '''
+        Send the next batch of queued e-mails over one SMTP connection. Returns the amount of sent and failed e-mails.
+
+        The batch is locked until it has been handled, so that several workers can run at the same time without sending anything twice. Sent e-mails are deleted, since some of them contain passwords. Failed ones are tried again later, waiting twice as long every time, until they have failed OutgoingMail.MAX_ATTEMPTS times and are marked as dead.
+        '''
+        from django.core.mail import EmailMessage, get_connection
+
+        with transaction.atomic(using=self.db):
+            mails = list(self.due().select_for_update(skip_locked=True)[:batch_size])
+            if not mails:
+                return 0, 0
+
+            connection = connection or get_connection()
+            sent, failed = [], []
+            try:
+                connection.open()
+            except Exception as e:
+                failed = [(mail, e) for mail in mails]
+            else:
+                try:
+                    for mail in mails:
+                        try:
+                            EmailMessage(mail.subject, mail.message, mail.sender, mail.receivers.split('\n'), connection=connection).send()
+                            sent.append(mail.id)
+                        except Exception as e:
+                            failed.append((mail, e))
+                finally:
+                    connection.close()
+
+            self.filter(id__in=sent).delete()
+            for mail, error in failed:
+                mail.failed(error)
+        return len(sent), len(failed)
+
+    def requeue_dead(self):
+        return self.filter(dead=True).update(dead=False, attempts=0, next_attempt=timezone.now())
+
+    def dead_to(self, address):
+        '''
+        The dead e-mails to the given address, so that the staff can see that they were never delivered.
+        '''
+        return self.filter(dead=True, receivers=address).order_by('-next_attempt') if address else self.none()
+
+    def purge_dead(self):
+        '''
+        Delete the e-mails that have been dead for longer than OutgoingMail.DEAD_RETENTION. They are kept for a while so that they can be queued again, but since some of them contain passwords they should not be kept forever. Returns the amount of deleted e-mails.
+        '''
+        return self.filter(dead=True, next_attempt__lte=timezone.now() - OutgoingMail.DEAD_RETENTION).delete()[0]
+
+
+class OutgoingMail(models.Model):
+    '''
+    An e-mail waiting to be sent, see OutgoingMailManager.
+    '''
+    objects = OutgoingMailManager()
+    created = models.DateTimeField(auto_now_add=True)
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    sender = models.CharField(max_length=254)
+    # One address per line
+    receivers = models.TextField()
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True)
+    dead = models.BooleanField(default=False)
+
+    MAX_ATTEMPTS = env('MAIL_MAX_ATTEMPTS', 6)
+    RETRY_DELAY = timedelta(minutes=1)
+    DEAD_RETENTION = timedelta(days=env('MAIL_DEAD_RETENTION', 7))
+
+    def failed(self, error):
+        self.attempts += 1
+        self.last_error = str(error)
+        self.dead = self.attempts >= self.MAX_ATTEMPTS
+        if self.dead:
+            # For dead e-mails this is when they died, see purge_dead()
+            self.next_attempt = timezone.now()
+            logger.error('Gave up sending the e-mail %s after %d attempts: %s', self, self.attempts, error)
+        else:
+            self.next_attempt = timezone.now() + self.RETRY_DELAY * 2 ** (self.attempts - 1)
+        self.save(update_fields=['attempts', 'last_error', 'dead', 'next_attempt'])
+
+    def __str__(self):
+        return f'{self.subject} ({", ".join(self.receivers.split())})'
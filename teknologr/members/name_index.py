@@ -0,0 +1,160 @@
+'''
+An in-process index of the searchable Member fields, used by the staff autocomplete (see lookups.py) so that it does not need to touch the database on every keypress.
+
+The index is built lazily on first use, and updated incrementally when a Member is saved or deleted in this process (see signals.py). Every change also bumps a generation counter in the database (see ModelVersion), which the index checks at most once every CHECK_INTERVAL seconds, so changes made by other processes (or bulk operations) are noticed too, in which case the index is rebuilt.
+
+Matching and ranking works the same way as MemberManager.search_by_name() with staff_search=True.
+'''
+
+from collections import namedtuple
+from django.db import transaction
+from heapq import nsmallest
+from threading import RLock
+from time import monotonic
+from members.models import Member, ModelVersion
+from members.search import STAFF_SEARCH_FIELDS
+
+VERSION_NAME = 'member_names'
+CHECK_INTERVAL = 1.0
+NGRAM_LENGTH = 3
+
+Entry = namedtuple('Entry', ['member', 'text', 'surname', 'surname_without_prefixes', 'names', 'sort_key'])
+
+
+def get_ngrams(s):
+    return {s[i:i + NGRAM_LENGTH] for i in range(len(s) - NGRAM_LENGTH + 1)}
+
+
+class MemberNameIndex:
+    def __init__(self, check_interval=CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.lock = RLock()
+        self.reset()
+
+    def reset(self):
+        '''
+        Forget everything, the index will be rebuilt on next use.
+        '''
+        with self.lock:
+            self.entries = None
+            self.ngrams = None
+            self.version = None
+            self.checked = None
+
+    def search(self, queries, limit=None):
+        '''
+        Returns (unsaved copies of) the Members matching all the queries.
+        '''
+        queries = [q.lower() for q in queries if q]
+        if not queries:
+            return []
+
+        with self.lock:
+            self.check()
+
+            # Use the n-grams of the longer queries to narrow down the candidates, the rest need to be checked one by one anyway
+            candidates = None
+            for q in queries:
+                postings = sorted((self.ngrams.get(ngram, set()) for ngram in get_ngrams(q)), key=len)
+                for ids in postings:
+                    candidates = set(ids) if candidates is None else candidates & ids
+            if candidates is None:
+                candidates = self.entries.keys()
+
+            entries = [self.entries[i] for i in candidates]
+
+        matches = [e for e in entries if all(q in e.text for q in queries)]
+        key = lambda e: (self.get_rank(e, queries), e.sort_key)
+        matches = nsmallest(limit, matches, key=key) if limit else sorted(matches, key=key)
+        return [e.member for e in matches]
+
+    @staticmethod
+    def get_rank(entry, queries):
+        # Same as search.get_rank()
+        if any(q == entry.surname or q == entry.surname_without_prefixes for q in queries):
+            return 0
+        if any(name.startswith(q) for name in entry.names for q in queries):
+            return 1
+        return 2
+
+    def check(self):
+        '''
+        Make sure the index is built and up to date with the database, but only check the database once every check_interval seconds.
+        '''
+        now = monotonic()
+        if self.entries is not None and now - self.checked < self.check_interval:
+            return
+
+        version = ModelVersion.objects.get_version(VERSION_NAME)
+        if self.entries is None or version != self.version:
+            self.build(version)
+        self.checked = now
+
+    def build(self, version):
+        # The version is read before the Members, so if they change in between the index will just be rebuilt again
+        self.entries = {}
+        self.ngrams = {}
+        self.version = version
+        for member in Member.objects.only('id', 'surname_without_prefixes', 'full_name_sort_key', *STAFF_SEARCH_FIELDS):
+            self.add(member)
+
+    def add(self, member):
+        '''
+        Add or replace the entry of a Member.
+        '''
+        values = {field: getattr(member, field) or '' for field in STAFF_SEARCH_FIELDS}
+        entry = Entry(
+            # A separate copy, to not keep any prefetched or cached data of the original alive
+            member=Member(id=member.id, given_names=values['given_names'], preferred_name=values['preferred_name'], surname=values['surname']),
+            # Queries never contain whitespace, so they can not match across fields
+            text='\n'.join(values.values()).lower(),
+            surname=values['surname'].lower(),
+            surname_without_prefixes=member.surname_without_prefixes.lower(),
+            names=[values['surname'].lower(), member.surname_without_prefixes.lower(), values['preferred_name'].lower(), values['given_names'].lower()],
+            sort_key=member.full_name_sort_key,
+        )
+        self.remove(member.id)
+        self.entries[member.id] = entry
+        for ngram in get_ngrams(entry.text):
+            self.ngrams.setdefault(ngram, set()).add(member.id)
+
+    def remove(self, member_id):
+        entry = self.entries.pop(member_id, None)
+        if entry:
+            for ngram in get_ngrams(entry.text):
+                ids = self.ngrams[ngram]
+                ids.discard(member_id)
+                if not ids:
+                    del self.ngrams[ngram]
+
+    def member_saved(self, member):
+        version = ModelVersion.objects.bump(VERSION_NAME)
+        transaction.on_commit(lambda: self.apply(version, lambda: self.add(member)))
+
+    def member_deleted(self, member):
+        version = ModelVersion.objects.bump(VERSION_NAME)
+        member_id = member.id
+        transaction.on_commit(lambda: self.apply(version, lambda: self.remove(member_id)))
+
+    def invalidate(self):
+        '''
+        Mark the index as out of date in all processes, for changes that can not be applied incrementally.
+        '''
+        ModelVersion.objects.bump(VERSION_NAME)
+        transaction.on_commit(self.reset)
+
+    def apply(self, version, change):
+        '''
+        Apply a change that bumped the version to the given version, if the index was up to date before it. Otherwise some other change has been missed, so the index is rebuilt on next use instead.
+        '''
+        with self.lock:
+            if self.entries is None:
+                return
+            if self.version == version - 1:
+                change()
+                self.version = version
+            else:
+                self.reset()
+
+
+member_name_index = MemberNameIndex()
@@ -0,0 +1,147 @@
+'''
+Database specific indexes for searching Members by name (see MemberManager.search_by_name()).
+
+Name searches are substring searches (icontains), which can not use normal B-tree indexes, so each supported database gets its own kind of index:
+ - PostgreSQL: pg_trgm GIN indexes on UPPER(<field>), which is exactly what the icontains lookup compares against, so the database uses them automatically.
+ - SQLite: An FTS5 table with the trigram tokenizer, kept up to date with triggers. It is used to pre-filter the candidate Members, after which the normal icontains filters are applied on the few remaining rows.
+
+Any other database falls back to sequential scans.
+'''
+
+from contextlib import contextmanager
+from django.db import connections
+from django.db.models import Q, Case, When, IntegerField
+from django.db.models.expressions import RawSQL
+from functools import reduce
+from operator import or_
+
+# Only these fields can be searched by normal users, and given_names only partly (see MemberManager.search_by_name())
+PUBLIC_SEARCH_FIELDS = ['given_names', 'preferred_name', 'surname']
+# Comments can include old names or nicknames, so staff get to search in them too
+STAFF_SEARCH_FIELDS = PUBLIC_SEARCH_FIELDS + ['comment', 'email', 'username']
+
+TABLE = 'members_member'
+FTS_TABLE = 'members_member_fts'
+FTS_TRIGGERS = {
+    f'{FTS_TABLE}_insert': f'''
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON {TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, {{fields}}) VALUES (new.id, {{new_fields}});
+        END
+    ''',
+    f'{FTS_TABLE}_delete': f'''
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON {TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {{fields}}) VALUES ('delete', old.id, {{old_fields}});
+        END
+    ''',
+    f'{FTS_TABLE}_update': f'''
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE ON {TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {{fields}}) VALUES ('delete', old.id, {{old_fields}});
+            INSERT INTO {FTS_TABLE}(rowid, {{fields}}) VALUES (new.id, {{new_fields}});
+        END
+    ''',
+}
+# The trigram tokenizer can not match anything shorter than this
+FTS_MIN_LENGTH = 3
+
+
+def install(connection):
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for field in STAFF_SEARCH_FIELDS:
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS {TABLE}_{field}_trgm ON {TABLE} USING gin (UPPER({field}) gin_trgm_ops)')
+    elif connection.vendor == 'sqlite':
+        fields = ', '.join(STAFF_SEARCH_FIELDS)
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5({fields}, content='{TABLE}', content_rowid='id', tokenize='trigram')")
+        install_sqlite_triggers(connection)
+
+
+def uninstall(connection):
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            for field in STAFF_SEARCH_FIELDS:
+                cursor.execute(f'DROP INDEX IF EXISTS {TABLE}_{field}_trgm')
+    elif connection.vendor == 'sqlite':
+        drop_sqlite_triggers(connection)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def drop_sqlite_triggers(connection):
+    with connection.cursor() as cursor:
+        for name in FTS_TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+def install_sqlite_triggers(connection):
+    '''
+    Create the triggers that keep the FTS table up to date, and rebuild the FTS table if any of them were missing.
+
+    Django remakes the whole table when altering it on SQLite, which drops all triggers on it, so this is run after every migration too.
+    '''
+    if not has_fts_table(connection):
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [TABLE])
+        existing = {row[0] for row in cursor.fetchall()}
+        if existing.issuperset(FTS_TRIGGERS):
+            return
+
+        fields = ', '.join(STAFF_SEARCH_FIELDS)
+        new_fields = ', '.join(f'new.{f}' for f in STAFF_SEARCH_FIELDS)
+        old_fields = ', '.join(f'old.{f}' for f in STAFF_SEARCH_FIELDS)
+        for sql in FTS_TRIGGERS.values():
+            cursor.execute(sql.format(fields=fields, new_fields=new_fields, old_fields=old_fields))
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+@contextmanager
+def rebuild_afterwards(connection):
+    '''
+    For inserting a lot of Members at once: the FTS table is not updated for every row, but rebuilt once afterwards, which is several times faster. Only needed on SQLite, PostgreSQL keeps its indexes up to date by itself.
+
+    The triggers are put back even if the block fails, so that the FTS table is never left without them. If the failure broke the transaction, rolling it back brings the triggers back instead.
+    '''
+    if has_fts_table(connection):
+        drop_sqlite_triggers(connection)
+        try:
+            yield
+        finally:
+            if not connection.needs_rollback:
+                install_sqlite_triggers(connection)
+    else:
+        yield
+
+
+def has_fts_table(connection):
+    return connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+
+
+def filter_candidates(queryset, queries, fields):
+    '''
+    Narrow down the queryset to the Members that might match all the queries in any of the given fields, using the FTS table if there is one. The result still needs to be filtered properly by the caller.
+    '''
+    queries = [q for q in queries if len(q) >= FTS_MIN_LENGTH]
+    if not queries or not has_fts_table(connections[queryset.db]):
+        return queryset
+
+    columns = ' '.join(fields)
+    match = ' AND '.join('{%s} : "%s"' % (columns, q.replace('"', '""')) for q in queries)
+    return queryset.filter(id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match]))
+
+
+def get_rank(queries):
+    '''
+    An expression for ranking the search results: exact surname matches first, then matches at the beginning of a name, and substring matches last.
+    '''
+    exact = reduce(or_, [Q(surname__iexact=q) | Q(surname_without_prefixes__iexact=q) for q in queries])
+    prefix = reduce(or_, [
+        Q(surname__istartswith=q) |
+        Q(surname_without_prefixes__istartswith=q) |
+        Q(preferred_name__istartswith=q) |
+        Q(given_names__istartswith=q)
+        for q in queries
+    ])
+    return Case(When(exact, then=0), When(prefix, then=1), default=2, output_field=IntegerField())
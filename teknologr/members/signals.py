@@ -0,0 +1,214 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from members.models import *
+from katalogen.utils import invalidate_year_pages
+from api.utils import invalidate_active_roster, VERSIONED_MODELS
+from members.name_index import member_name_index
+from members.search import STAFF_SEARCH_FIELDS
+
+
+@receiver(pre_save, sender=Member)
+def remember_original_names(sender, instance, raw=False, update_fields=None, **kwargs):
+    # The names of the Member are shown on the year pages and in the active roster, which only need to be updated if the names change
+    instance._original_names = None
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not set(update_fields).intersection(Member.SORT_KEY_SOURCE_FIELDS):
+        return
+    instance._original_names = Member.objects.filter(pk=instance.pk).values(*Member.SORT_KEY_SOURCE_FIELDS).first()
+
+
+@receiver(post_save, sender=Member)
+def member_saved(sender, instance, created=False, update_fields=None, **kwargs):
+    if update_fields is None or set(update_fields).intersection(STAFF_SEARCH_FIELDS):
+        member_name_index.member_saved(instance)
+    original_names = getattr(instance, '_original_names', None)
+    if not created and original_names and original_names != {field: getattr(instance, field) for field in Member.SORT_KEY_SOURCE_FIELDS}:
+        invalidate_year_pages(get_member_years([instance.id]))
+        invalidate_active_roster()
+
+
+@receiver(post_delete, sender=Member)
+def member_deleted(sender, instance, **kwargs):
+    member_name_index.member_deleted(instance)
+
+
+# The fields of every model that other denormalized data (counters and yearly statistics) depend on
+TRACKED_FIELDS = {
+    GroupMembership: ['group_id'],
+    Group: ['grouptype_id', 'begin_date', 'end_date'],
+    Functionary: ['functionarytype_id', 'begin_date', 'end_date'],
+    DecorationOwnership: ['decoration_id', 'acquired'],
+    MemberType: ['type', 'begin_date'],
+}
+
+
+def get_values(sender, instance):
+    # The values might not have been cleaned, for example dates can still be strings
+    return {field: sender._meta.get_field(field).to_python(getattr(instance, field)) for field in TRACKED_FIELDS[sender]}
+
+
+def get_years(sender, values):
+    '''
+    Get the years of the yearly statistics that an object with the given tracked values is counted in.
+    '''
+    if not values:
+        return set()
+    if sender is GroupMembership:
+        return get_years(Group, Group.objects.filter(id=values['group_id']).values('begin_date', 'end_date').first())
+    if sender in [Group, Functionary]:
+        begin, end = values['begin_date'], values['end_date']
+    elif sender is DecorationOwnership:
+        begin = end = values['acquired']
+    elif sender is MemberType and values['type'] in ['OM', 'ST']:
+        begin = end = values['begin_date']
+    else:
+        return set()
+    return set(range(begin.year, end.year + 1)) if begin and end else set()
+
+
+def get_all_years(sender, queryset):
+    return set().union(*[get_years(sender, values) for values in queryset.values(*TRACKED_FIELDS[sender])])
+
+
+def get_member_years(ids):
+    '''
+    Get the years of all year pages that the given Members are shown on.
+    '''
+    return (
+        get_all_years(DecorationOwnership, DecorationOwnership.objects.filter(member_id__in=ids)) |
+        get_all_years(Functionary, Functionary.objects.filter(member_id__in=ids)) |
+        get_all_years(Group, Group.objects.filter(memberships__member_id__in=ids)) |
+        get_all_years(MemberType, MemberType.objects.filter(member_id__in=ids))
+    )
+
+
+@receiver(pre_save, sender=GroupMembership)
+@receiver(pre_save, sender=Group)
+@receiver(pre_save, sender=Functionary)
+@receiver(pre_save, sender=DecorationOwnership)
+@receiver(pre_save, sender=MemberType)
+def remember_original_values(sender, instance, raw=False, update_fields=None, **kwargs):
+    # The tracked fields might be changed, in which case the data depending on the old values need to be updated too
+    instance._original_values = None
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not is_tracked(sender, update_fields):
+        # None of the tracked fields are saved, so they can not change either
+        instance._original_values = get_values(sender, instance)
+        return
+    instance._original_values = sender.objects.filter(pk=instance.pk).values(*TRACKED_FIELDS[sender]).first()
+
+
+def is_tracked(sender, fields):
+    # The fields can be given both by name ('group') and by attname ('group_id')
+    meta = sender._meta
+    return any({meta.get_field(f).name, f} & set(fields) for f in TRACKED_FIELDS[sender])
+
+
+@receiver(post_save, sender=GroupMembership)
+@receiver(post_save, sender=Group)
+@receiver(post_save, sender=Functionary)
+@receiver(post_save, sender=DecorationOwnership)
+@receiver(post_save, sender=MemberType)
+@receiver(post_delete, sender=GroupMembership)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Functionary)
+@receiver(post_delete, sender=DecorationOwnership)
+@receiver(post_delete, sender=MemberType)
+def tracked_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    values = get_values(sender, instance)
+    original_values = getattr(instance, '_original_values', None)
+
+    if sender is MemberType:
+        # Update the Member instance of the MemberType too if it has been loaded, so that it does not get out of date
+        if MemberType.member.is_cached(instance):
+            instance.member.update_membership_status()
+        else:
+            Member.objects.filter(id=instance.member_id).update_membership_status()
+
+    years = get_years(sender, values) | get_years(sender, original_values)
+    # Other fields than the tracked ones are shown on the year pages too
+    invalidate_year_pages(years)
+    if sender in ACTIVE_ROSTER_MODELS:
+        invalidate_active_roster()
+
+    if values == original_values and 'created' in kwargs:
+        # Saved without changing anything the counters and statistics depend on
+        return
+
+    if sender is not MemberType:
+        # The first tracked field is the parent that has counters
+        field = TRACKED_FIELDS[sender][0]
+        update_counters(sender, {values[field], (original_values or {}).get(field)} - {None})
+
+    YearStatistics.objects.update_years_on_commit(years)
+
+
+# The models that the active roster (see get_active_roster()) is made of
+ACTIVE_ROSTER_MODELS = [Functionary, Group, GroupMembership, FunctionaryType, GroupType]
+
+
+# The models whose names are shown on the year pages, and the models that link them to the years
+NAMED_PARENTS = {
+    Decoration: (DecorationOwnership, 'decoration'),
+    FunctionaryType: (Functionary, 'functionarytype'),
+    GroupType: (Group, 'grouptype'),
+}
+
+
+@receiver(post_save, sender=Decoration)
+@receiver(post_save, sender=FunctionaryType)
+@receiver(post_save, sender=GroupType)
+def named_parent_saved(sender, instance, created=False, raw=False, **kwargs):
+    if created or raw:
+        return
+    if sender in ACTIVE_ROSTER_MODELS:
+        invalidate_active_roster()
+    child, field = NAMED_PARENTS[sender]
+    invalidate_year_pages(get_all_years(child, child.objects.filter(**{field: instance})))
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def versioned_changed(sender, **kwargs):
+    if sender in VERSIONED_MODELS:
+        ModelVersion.objects.bump_tables(sender)
+
+
+def tracked_bulk_created(sender, objs):
+    '''
+    QuerySet.bulk_create() does not send any signals, so this needs to be called after bulk creating objects of the tracked models. Does the same as tracked_changed(), but once for all the objects.
+    '''
+    if not objs:
+        return
+    ModelVersion.objects.bump_tables(sender)
+    values = [get_values(sender, obj) for obj in objs]
+
+    if sender is MemberType:
+        Member.objects.filter(id__in={obj.member_id for obj in objs}).update_membership_status()
+    else:
+        field = TRACKED_FIELDS[sender][0]
+        update_counters(sender, {v[field] for v in values})
+
+    # Many objects usually share the same tracked values
+    unique_values = {tuple(v.items()) for v in values}
+    years = set().union(*[get_years(sender, dict(v)) for v in unique_values])
+    invalidate_year_pages(years)
+    if sender in ACTIVE_ROSTER_MODELS:
+        invalidate_active_roster()
+    YearStatistics.objects.update_years_on_commit(years)
+
+
+def update_counters(sender, ids):
+    if sender is GroupMembership:
+        Group.objects.filter(id__in=ids).update_counters()
+        GroupType.objects.filter(id__in=Group.objects.filter(id__in=ids).values('grouptype')).update_counters()
+    elif sender is Group:
+        GroupType.objects.filter(id__in=ids).update_counters()
+    elif sender is Functionary:
+        FunctionaryType.objects.filter(id__in=ids).update_counters()
+    elif sender is DecorationOwnership:
+        Decoration.objects.filter(id__in=ids).update_counters()
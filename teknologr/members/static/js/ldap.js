@@ -12,7 +12,8 @@ function validatePassword(){
   }
 }
 
-$(document).ready(function() {
+// All of the account elements are in #member-accounts, which is reloaded if the accounts could not be looked up in time
+function add_account_listeners() {
   $('#confirm_password').keyup(validatePassword);
   $('#ldap_password').change(validatePassword)
 
@@ -50,4 +51,13 @@ $(document).ready(function() {
     url: element => `/api/accounts/bill/${element.data('id')}/`,
     confirmMessage: "Vill du ta bort detta BILL-konto?",
   });
+}
+
+$(document).ready(function() {
+  add_account_listeners();
+
+  const accounts = $('#member-accounts');
+  if (accounts.data('url')) {
+    accounts.load(accounts.data('url'), add_account_listeners);
+  }
 });
@@ -1,8 +1,18 @@
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from collections import Counter
+from io import StringIO
+from members import search
 from members.models import *
+from registration.models import Applicant
 from ldap import LDAPError
 from datetime import date, timedelta
 import random
+from unittest.mock import patch
 
 def shuffle(l):
     return random.sample(l, len(l))
@@ -167,6 +177,41 @@ class MemberTest(TestCase):
         self.assertEqual(1, len(Member.objects.search_by_name(["foo", "von"], False)))
         self.assertEqual(2, len(Member.objects.search_by_name(["foo", "von"], True)))
 
+    def test_search_by_name_hidden(self):
+        # Hidden Members can only be found by their surname or preferred name, which defaults to the first given name
+        Member.objects.create(given_names='Sverker Svakar', surname='Hidden', allow_publish_info=False)
+        self.assertEqual(1, len(Member.objects.search_by_name(["sverk"], False)))
+        self.assertEqual(0, len(Member.objects.search_by_name(["svakar"], False)))
+        self.assertEqual(1, len(Member.objects.search_by_name(["svakar"], True)))
+        self.assertEqual(0, len(Member.objects.search_by_name([], True)))
+
+    def test_search_by_name_rank(self):
+        exact = Member.objects.create(given_names='Abc', surname='Foo', allow_publish_info=True)
+        prefix = Member.objects.create(given_names='Abc', surname='von Food', allow_publish_info=True)
+        self.assertEqual([exact, prefix, self.member1, self.member2, self.member3], list(Member.objects.search_by_name(["foo"], False)))
+        self.assertEqual([exact, prefix], list(Member.objects.search_by_name(["foo"], False, limit=2)))
+
+    def test_search_by_name_after_update(self):
+        # Makes sure the search index is kept up to date
+        Member.objects.filter(id=self.member1.id).update(surname='Changed')
+        self.member2.surname = 'Renamed'
+        self.member2.save()
+        self.member3.delete()
+        self.assertEqual([self.member1], list(Member.objects.search_by_name(["changed"], True)))
+        self.assertEqual([self.member2], list(Member.objects.search_by_name(["renamed"], True)))
+        self.assertEqual(0, len(Member.objects.search_by_name(["tester"], True)))
+
+    def test_search_by_name_rebuild_afterwards_fails(self):
+        # The triggers are put back even if inserting the Members fails
+        with self.assertRaises(ValueError):
+            with search.rebuild_afterwards(connection):
+                Member.objects.create(given_names='Inserted', surname='Before')
+                raise ValueError()
+        self.member1.surname = 'Changed'
+        self.member1.save()
+        self.assertEqual(1, len(Member.objects.search_by_name(["inserted"], True)))
+        self.assertEqual([self.member1], list(Member.objects.search_by_name(["changed"], True)))
+
     def test_member_type(self):
         member = Member(given_names='Svatta', surname='Teknolog')
         member.save()
@@ -218,6 +263,44 @@ class MemberTest(TestCase):
         self.assertEquals('StÄlM', member.current_member_type)
         self.assertFalse(member.shouldBeStalm())
 
+    def test_related_counts(self):
+        d = date(2020, 1, 1)
+        for i in range(2):
+            DecorationOwnership.objects.create(member=self.member1, decoration=Decoration.objects.create(name=f'D{i}'), acquired=d)
+        for i in range(3):
+            Functionary.objects.create(member=self.member1, functionarytype=FunctionaryType.objects.create(name=f'F{i}'), begin_date=d, end_date=d)
+        GroupMembership.objects.create(member=self.member1, group=Group.objects.create(grouptype=GroupType.objects.create(name='G'), begin_date=d, end_date=d))
+
+        # The counts of different relations must not be multiplied with each other
+        member = Member.objects.get_prefetched_or_404(self.member1.id)
+        self.assertEqual((2, 3, 1), (member.n_decorations, member.n_functionaries, member.n_groups))
+        member = Member.objects.get_prefetched_or_404(self.member2.id)
+        self.assertEqual((0, 0, 0), (member.n_decorations, member.n_functionaries, member.n_groups))
+
+    def test_membership_status(self):
+        member = Member.objects.create(given_names='Svatta', surname='Teknolog')
+        MemberType.objects.create(member=member, type='PH', begin_date=date(2012, 9, 1))
+        om = MemberType.objects.create(member=member, type='OM', begin_date=date(2012, 9, 27))
+        MemberType.objects.create(member=member, type='JS', begin_date=date(2017, 10, 15))
+
+        # The status is stored in the database, even if the Member instance was not used
+        member = Member.objects.get(id=member.id)
+        self.assertEqual(('OM', True, 2012), (member.membership_type, member.junior_stalm, member.phux_year))
+        self.assertTrue(Member.objects.filter(Member.get_valid_member_Q(), id=member.id).exists())
+
+        om.delete()
+        member.refresh_from_db()
+        self.assertEqual('', member.membership_type)
+        self.assertFalse(Member.objects.filter(Member.get_valid_member_Q(), id=member.id).exists())
+
+        # Changes that do not send any signals need to be fixed manually
+        MemberType.objects.filter(member=member, type='JS').update(type='ST', end_date=None)
+        member.refresh_from_db()
+        self.assertEqual('', member.membership_type)
+        self.assertEqual(4, Member.objects.all().update_membership_status())
+        member.refresh_from_db()
+        self.assertEqual(('ST', False, 2012), (member.membership_type, member.junior_stalm, member.phux_year))
+
 
 class MemberOrderTest(BaseTest):
     def test_order_by(self):
@@ -239,6 +322,99 @@ class MemberOrderTest(BaseTest):
                 self.assertEqual(given_names, member.given_names)
 
 
+class MemberSortKeyTest(BaseTest):
+    surnames = ['Aqz', 'af Xyz', 'Åäö', 'von af Ööö', 'von der Tester']
+
+    def setUp(self):
+        for surname in shuffle(self.surnames):
+            for given_names in shuffle(self.test_names):
+                Member.objects.create(given_names=given_names, surname=surname)
+
+    def test_keys_on_save(self):
+        member = Member.objects.create(given_names='Foo Bar', surname='von der Tester')
+        self.assertEqual('Tester', member.surname_without_prefixes)
+        self.assertEqual(get_collation_key('Tester, Foo Bar'), member.full_name_sort_key)
+        self.assertEqual(get_collation_key('Tester, Foo B'), member.public_full_name_sort_key)
+
+        member.allow_publish_info = True
+        member.save(update_fields=['allow_publish_info'])
+        member.refresh_from_db()
+        self.assertEqual(get_collation_key('Tester, Foo Bar'), member.public_full_name_sort_key)
+
+    def test_keys_on_update(self):
+        Member.objects.filter(surname='Aqz').update(surname='af Åäö')
+        for member in Member.objects.filter(surname='af Åäö'):
+            self.assertEqual('Åäö', member.surname_without_prefixes)
+            self.assertEqual(get_collation_key(member.full_name_for_sorting), member.full_name_sort_key)
+
+    def test_keys_on_bulk_create(self):
+        members = Member.objects.bulk_create([Member(given_names='Foo', surname='af Bar')])
+        self.assertEqual('Bar', members[0].surname_without_prefixes)
+        self.assertEqual(1, Member.objects.filter(surname_without_prefixes='Bar', full_name_sort_key=get_collation_key('Bar, Foo')).count())
+
+    def test_update_sort_keys(self):
+        Member.objects.update(full_name_sort_key='', public_full_name_sort_key='')
+        self.assertEqual(len(self.surnames)*len(self.test_names), Member.objects.all().update_sort_keys())
+        self.assertFalse(Member.objects.filter(full_name_sort_key='').exists())
+
+    def test_order_by_database(self):
+        members = list(Member.objects.all())
+        members.sort(key=lambda m: strxfrm(m.full_name_for_sorting))
+        self.assertEqual(members, list(Member.objects.order_by('full_name_sort_key')))
+
+    def test_order_v_w(self):
+        # The Swedish collation treats v and w as the same letter, so the keys must not be compared with it
+        for field in Member.SORT_KEY_FIELDS[1:]:
+            self.assertEqual(SORT_KEY_COLLATION, Member._meta.get_field(field).db_collation)
+        if connection.vendor == 'sqlite':
+            # The default collation of SQLite already works, and a custom one would only exist for Django's connections
+            self.assertIsNone(SORT_KEY_COLLATION)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT group_concat(sql) FROM sqlite_master WHERE tbl_name = 'members_member'")
+                self.assertNotIn('COLLATE', cursor.fetchone()[0])
+        Member.objects.all().delete()
+        surnames = ['Wik', 'Vikström', 'Vik', 'Wiklund', 'Vilén', 'Wikström', 'Wahl 2', 'Vahl 10']
+        for surname in surnames:
+            Member.objects.create(given_names='Anna', surname=surname)
+        expected = sorted(surnames, key=lambda s: strxfrm(f'{s}, Anna'))
+        self.assertEqual(expected, list(Member.objects.order_by('full_name_sort_key').values_list('surname', flat=True)))
+        self.assertEqual(expected, list(Member.objects.order_by('public_full_name_sort_key').values_list('surname', flat=True)))
+
+    def test_collation_key(self):
+        strings = ['', 'a', 'A', 'ab', 'Åäö', 'Tester, Foo', 'Tester, Foo Bar', 'von Tester'] + self.test_names
+        self.assertEqual(sorted(strings, key=strxfrm), sorted(strings, key=get_collation_key))
+
+
+class MemberAddressKeyTest(TestCase):
+    def test_key_on_save(self):
+        member = Member.objects.create(street_address='Otsvängen  22 A.', city='ESBO', country='FI')
+        self.assertEqual('otsvängen 22 a|esbo|FI', member.address_key)
+
+        member.street_address = 'Otsvängen 22 B'
+        member.save(update_fields=['street_address'])
+        member.refresh_from_db()
+        self.assertEqual('otsvängen 22 b|esbo|FI', member.address_key)
+
+    def test_no_street_address(self):
+        self.assertEqual('', Member.objects.create(city='Esbo').address_key)
+
+    def test_key_on_update(self):
+        Member.objects.create(street_address='OK22', city='Esbo', surname='Tester')
+        Member.objects.filter(city='Esbo').update(city='Helsingfors', surname='Testare')
+        self.assertEqual('ok22|helsingfors|', Member.objects.get(surname='Testare').address_key)
+
+    def test_key_on_bulk_create(self):
+        members = Member.objects.bulk_create([Member(street_address='OK22', city='Esbo')])
+        self.assertEqual('ok22|esbo|', members[0].address_key)
+
+    def test_update_address_keys(self):
+        Member.objects.create(street_address='OK22', city='Esbo')
+        Member.objects.all().update(address_key='')
+        self.assertEqual(1, Member.objects.all().update_address_keys())
+        self.assertEqual('ok22|esbo|', Member.objects.get().address_key)
+        self.assertTrue(all(c in '0123456789abcdefghijklmnopqrstuvwxyz' for c in get_collation_key('Åäö, Foo-Bar')))
+
+
 class DecorationOwnerShipTest(TestCase):
     def setUp(self):
         member = Member.objects.create(given_names='Foo Bar', preferred_name='Foo', surname='Tester')
@@ -310,6 +486,17 @@ class DecorationTest(BaseTest):
         for i, name in enumerate(self.test_names):
             self.assertEqual(name, decorations[i].name)
 
+    def test_counters(self):
+        decoration = Decoration.objects.create(name='My decoration')
+        ownership = DecorationOwnership.objects.create(decoration=decoration, member=Member.objects.create(), acquired=date(2020, 1, 1))
+        DecorationOwnership.objects.create(decoration=decoration, member=Member.objects.create(), acquired=date(2020, 1, 1))
+        decoration.refresh_from_db()
+        self.assertEqual(2, decoration.n_ownerships)
+
+        ownership.delete()
+        decoration.refresh_from_db()
+        self.assertEqual(1, decoration.n_ownerships)
+
 
 class GroupTest(TestCase):
     def setUp(self):
@@ -347,6 +534,36 @@ class GroupTest(TestCase):
         self.assertEqual('2023', str(self.group3.duration))
         self.assertEqual('2022-2024', str(self.group4.duration))
 
+    def test_counters(self):
+        m1 = Member.objects.create(given_names='Foo', surname='Tester')
+        m2 = Member.objects.create(given_names='Bar', surname='Tester')
+        GroupMembership.objects.create(group=self.group1, member=m1)
+        GroupMembership.objects.create(group=self.group2, member=m1)
+        gm = GroupMembership.objects.create(group=self.group2, member=m2)
+
+        gt = GroupType.objects.get()
+        self.assertEqual((4, 2, 3, 2), (gt.n_groups, gt.n_groups_non_empty, gt.n_members_total, gt.n_members_unique))
+        self.assertEqual([1, 2, 0, 0], [g.n_members for g in Group.objects.order_by('id')])
+
+        # Moving a membership updates both the old and the new group
+        gm.group = self.group3
+        gm.save()
+        self.assertEqual([1, 1, 1, 0], [g.n_members for g in Group.objects.order_by('id')])
+        gt.refresh_from_db()
+        self.assertEqual((4, 3, 3, 2), (gt.n_groups, gt.n_groups_non_empty, gt.n_members_total, gt.n_members_unique))
+
+        m1.delete()
+        self.group4.delete()
+        gt.refresh_from_db()
+        self.assertEqual((3, 1, 1, 1), (gt.n_groups, gt.n_groups_non_empty, gt.n_members_total, gt.n_members_unique))
+
+        # Changes that do not send any signals need to be fixed manually
+        GroupMembership.objects.bulk_create([GroupMembership(group=self.group1, member=m2)])
+        self.assertEqual(3, Group.objects.update_counters())
+        self.assertEqual(1, GroupType.objects.update_counters())
+        gt.refresh_from_db()
+        self.assertEqual((3, 2, 2, 1), (gt.n_groups, gt.n_groups_non_empty, gt.n_members_total, gt.n_members_unique))
+
 class GroupOrderTest(BaseTest):
     def setUp(self):
         for name in shuffle(self.test_names):
@@ -524,6 +741,31 @@ class FunctionaryTypeTest(BaseTest):
         for i, name in enumerate(self.test_names):
             self.assertEqual(name, functionary_types[i].name)
 
+    def test_counters(self):
+        ft1 = FunctionaryType.objects.create(name='Post 1')
+        ft2 = FunctionaryType.objects.create(name='Post 2')
+        m = Member.objects.create(given_names='Foo', surname='Tester')
+        for year in [2020, 2021]:
+            Functionary.objects.create(functionarytype=ft1, member=m, begin_date=date(year, 1, 1), end_date=date(year, 12, 31))
+        f = Functionary.objects.create(functionarytype=ft1, member=Member.objects.create(), begin_date=date(2022, 1, 1), end_date=date(2022, 12, 31))
+        ft1.refresh_from_db()
+        self.assertEqual((3, 2), (ft1.n_functionaries_total, ft1.n_functionaries_unique))
+
+        f.functionarytype = ft2
+        f.save()
+        ft1.refresh_from_db()
+        ft2.refresh_from_db()
+        self.assertEqual((2, 1), (ft1.n_functionaries_total, ft1.n_functionaries_unique))
+        self.assertEqual((1, 1), (ft2.n_functionaries_total, ft2.n_functionaries_unique))
+
+        # The original values are only needed if a tracked field is saved
+        with CaptureQueriesContext(connection) as queries:
+            f.save(update_fields=['modified'])
+        self.assertFalse([q for q in queries if 'FROM "members_functionary"' in q['sql']])
+        with CaptureQueriesContext(connection) as queries:
+            f.save(update_fields=['functionarytype'])
+        self.assertTrue([q for q in queries if 'FROM "members_functionary"' in q['sql']])
+
 
 class MemberTypeTest(BaseTest):
     def setUp(self):
@@ -582,3 +824,274 @@ class MemberTypeOrderTest(BaseTest):
             for _ in self.test_names:
                 self.assertEqual(date, self.member_types[i].begin_date)
                 i += 1
+
+
+class YearStatisticsTest(TestCase):
+    def setUp(self):
+        # The statistics are updated when the transaction is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            self.m1 = Member.objects.create(given_names='Foo', surname='Tester')
+            self.m2 = Member.objects.create(given_names='Bar', surname='Tester')
+            ft = FunctionaryType.objects.create(name='Post')
+            self.f = Functionary.objects.create(functionarytype=ft, member=self.m1, begin_date=date(2020, 7, 1), end_date=date(2022, 6, 30))
+            Functionary.objects.create(functionarytype=ft, member=self.m2, begin_date=date(2021, 1, 1), end_date=date(2021, 12, 31))
+            self.g = Group.objects.create(grouptype=GroupType.objects.create(name='Group'), begin_date=date(2021, 1, 1), end_date=date(2021, 12, 31))
+            GroupMembership.objects.create(group=self.g, member=self.m1)
+            GroupMembership.objects.create(group=self.g, member=self.m2)
+            DecorationOwnership.objects.create(decoration=Decoration.objects.create(name='D'), member=self.m1, acquired=date(2019, 5, 1))
+            MemberType.objects.create(member=self.m1, type='OM', begin_date=date(2019, 9, 1))
+            MemberType.objects.create(member=self.m2, type='PH', begin_date=date(2019, 9, 1))
+
+    def get_statistics(self):
+        fields = ['decoration_ownerships', 'functionaries_total', 'functionaries_unique', 'groups', 'group_memberships_total', 'group_memberships_unique', 'members_ordinary', 'members_stalm']
+        return {s.year: [getattr(s, f) for f in fields] for s in YearStatistics.objects.all()}
+
+    def test_incremental(self):
+        expected = {
+            2019: [1, 0, 0, 0, 0, 0, 1, 0],
+            2020: [0, 1, 1, 0, 0, 0, 0, 0],
+            2021: [0, 2, 2, 1, 2, 2, 0, 0],
+            2022: [0, 1, 1, 0, 0, 0, 0, 0],
+        }
+        self.assertEqual(expected, self.get_statistics())
+
+        # Moving an interval updates both the old and the new years
+        with self.captureOnCommitCallbacks(execute=True):
+            self.f.begin_date = date(2021, 1, 1)
+            self.f.end_date = date(2021, 12, 31)
+            self.f.save()
+            self.g.begin_date = date(2023, 1, 1)
+            self.g.end_date = date(2023, 12, 31)
+            self.g.save()
+            self.m2.delete()
+        expected = {
+            2019: [1, 0, 0, 0, 0, 0, 1, 0],
+            2021: [0, 1, 1, 0, 0, 0, 0, 0],
+            2023: [0, 0, 0, 1, 1, 1, 0, 0],
+        }
+        self.assertEqual(expected, self.get_statistics())
+
+    def test_once_per_transaction(self):
+        with patch.object(YearStatisticsManager, 'update_years') as update_years, self.captureOnCommitCallbacks(execute=True):
+            # Deletes the Functionary, the GroupMembership, the DecorationOwnership and the MemberType one by one
+            self.m1.delete()
+            self.assertFalse(update_years.called)
+        update_years.assert_called_once_with({2019, 2020, 2021, 2022})
+
+    def test_rolled_back(self):
+        def delete_group():
+            try:
+                with transaction.atomic():
+                    Group.objects.get(id=self.g.id).delete()
+                    raise ValueError()
+            except ValueError:
+                pass
+
+        with patch.object(YearStatisticsManager, 'update_years') as update_years, self.captureOnCommitCallbacks(execute=True):
+            delete_group()
+        self.assertFalse(update_years.called)
+
+        # Only the changes that were not rolled back are counted
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_group()
+            self.f.delete()
+        expected = {
+            2019: [1, 0, 0, 0, 0, 0, 1, 0],
+            2021: [0, 1, 1, 1, 2, 2, 0, 0],
+        }
+        self.assertEqual(expected, self.get_statistics())
+
+    def test_rolled_back_years_not_left_over(self):
+        # The years of a rolled back transaction are not recalculated by the next one
+        try:
+            with transaction.atomic():
+                self.f.delete()
+                raise ValueError()
+        except ValueError:
+            pass
+
+        with patch.object(YearStatisticsManager, 'update_years') as update_years, self.captureOnCommitCallbacks(execute=True):
+            Group.objects.get(id=self.g.id).delete()
+        update_years.assert_called_once_with({2021})
+
+    def test_existing_rows(self):
+        # The rows are updated in place, and the ones without anything to show are removed
+        ids = dict(YearStatistics.objects.values_list('year', 'id'))
+        Functionary.objects.all().update(end_date=date(2021, 12, 31))
+        YearStatistics.objects.update_years([2020, 2021, 2022, 2023])
+        self.assertEqual({2019: ids[2019], 2020: ids[2020], 2021: ids[2021]}, dict(YearStatistics.objects.values_list('year', 'id')))
+        self.assertEqual([0, 2, 2, 1, 2, 2, 0, 0], self.get_statistics()[2021])
+
+    def test_rebuild(self):
+        expected = self.get_statistics()
+        YearStatistics.objects.all().delete()
+        YearStatistics.objects.create(year=1900, groups=1)
+        self.assertEqual(4, YearStatistics.objects.rebuild())
+        self.assertEqual(expected, self.get_statistics())
+
+
+class FailingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        if any('fail@' in to for m in messages for to in m.to):
+            raise ConnectionError('Refused')
+        return super().send_messages(messages)
+
+
+class OutgoingMailTest(TestCase):
+    def queue(self, receiver):
+        return OutgoingMail.objects.queue('Hej', 'Hej hej', 'noreply@example.com', [receiver])
+
+    def test_queue_and_send(self):
+        self.queue('a@example.com')
+        self.queue('b@example.com')
+        self.assertEqual(0, len(mail.outbox))
+
+        out = StringIO()
+        call_command('send_queued_mail', stdout=out)
+        self.assertEqual('Sent 2 e-mails, 0 failed', out.getvalue().strip())
+        self.assertEqual([['a@example.com'], ['b@example.com']], [m.to for m in mail.outbox])
+        # Sent e-mails are not kept
+        self.assertFalse(OutgoingMail.objects.exists())
+
+    def test_batches(self):
+        for i in range(5):
+            self.queue(f'{i}@example.com')
+        self.assertEqual((2, 0), OutgoingMail.objects.send_queued(batch_size=2))
+        call_command('send_queued_mail', batch_size=2, stdout=StringIO())
+        self.assertEqual(5, len(mail.outbox))
+
+    def test_retry_and_dead(self):
+        self.queue('a@example.com')
+        failing = self.queue('fail@example.com')
+        self.assertEqual((1, 1), OutgoingMail.objects.send_queued(connection=FailingEmailBackend()))
+
+        failing.refresh_from_db()
+        self.assertEqual(1, failing.attempts)
+        self.assertEqual('Refused', failing.last_error)
+        self.assertGreater(failing.next_attempt, timezone.now())
+        # Not tried again before it is time
+        self.assertEqual((0, 0), OutgoingMail.objects.send_queued(connection=FailingEmailBackend()))
+
+        with self.assertLogs('members.models', 'ERROR') as logs:
+            for attempt in range(2, OutgoingMail.MAX_ATTEMPTS + 1):
+                OutgoingMail.objects.update(next_attempt=timezone.now())
+                OutgoingMail.objects.send_queued(connection=FailingEmailBackend())
+        self.assertEqual(1, len(logs.output))
+        self.assertIn('Hej (fail@example.com)', logs.output[0])
+        failing.refresh_from_db()
+        self.assertTrue(failing.dead)
+        self.assertEqual([failing], list(OutgoingMail.objects.dead_to('fail@example.com')))
+        OutgoingMail.objects.update(next_attempt=timezone.now())
+        self.assertEqual((0, 0), OutgoingMail.objects.send_queued(connection=FailingEmailBackend()))
+
+        self.assertEqual(1, OutgoingMail.objects.requeue_dead())
+        self.assertEqual(1, OutgoingMail.objects.due().count())
+
+    def test_purge_dead(self):
+        old = self.queue('old@example.com')
+        recent = self.queue('recent@example.com')
+        self.queue('queued@example.com')
+        OutgoingMail.objects.filter(id=old.id).update(dead=True, next_attempt=timezone.now() - OutgoingMail.DEAD_RETENTION - timedelta(minutes=1))
+        OutgoingMail.objects.filter(id=recent.id).update(dead=True, next_attempt=timezone.now() - timedelta(days=1))
+
+        out = StringIO()
+        call_command('send_queued_mail', stdout=out)
+        self.assertIn('Deleted 1 e-mails that have been dead for too long', out.getvalue())
+        self.assertEqual([['queued@example.com']], [m.to for m in mail.outbox])
+        self.assertEqual([recent], list(OutgoingMail.objects.all()))
+
+
+class FakeRegistryTest(TestCase):
+    def generate(self, seed=1):
+        call_command('generate_fake_registry', members=300, years=20, group_types=20, functionary_types=5, decorations=3, applicants=10, seed=seed, batch_size=50, stdout=StringIO())
+
+    def get_registry(self):
+        return (
+            list(Member.objects.order_by('id').values_list('given_names', 'surname', 'username', 'student_id', 'enrolment_year', 'membership_type', 'phux_year')),
+            list(MemberType.objects.order_by('id').values_list('member__student_id', 'type', 'begin_date', 'end_date')),
+            list(GroupMembership.objects.order_by('id').values_list('group__grouptype__name', 'group__begin_date', 'member__student_id')),
+            list(Functionary.objects.order_by('id').values_list('functionarytype__name', 'begin_date', 'member__student_id')),
+            list(DecorationOwnership.objects.order_by('id').values_list('decoration__name', 'acquired', 'member__student_id')),
+        )
+
+    def test_generate(self):
+        self.generate()
+        self.assertEqual(300, Member.objects.count())
+        self.assertEqual(20, GroupType.objects.count())
+        self.assertTrue(GroupMembership.objects.exists())
+        self.assertTrue(Functionary.objects.exists())
+        self.assertTrue(DecorationOwnership.objects.exists())
+        self.assertEqual(10, Applicant.objects.count())
+        # Group types get numbered when there are more than there are names
+        self.assertTrue(GroupType.objects.filter(name='Styrelsen 2').exists())
+        self.assertTrue(Member.objects.filter(surname__startswith='von ').exists())
+        self.assertFalse(Member.objects.filter(full_name_sort_key='').exists())
+
+        # The FTS table is rebuilt after inserting the members
+        self.assertEqual(Member.objects.filter(surname__icontains='wright').count(), Member.objects.search_by_name(['wright'], staff_search=True).count())
+
+        # The membership status is calculated by the command itself, so compare it with the usual calculation
+        def get_membership_status():
+            return list(Member.objects.order_by('id').values_list(*Member.MEMBERSHIP_FIELDS))
+        membership_status = get_membership_status()
+        self.assertTrue(Member.objects.filter(membership_type='OM').exists())
+        self.assertTrue(Member.objects.filter(membership_type='ST').exists())
+        Member.objects.all().update_membership_status()
+        self.assertEqual(membership_status, get_membership_status())
+
+        # The counters and statistics are calculated with the usual commands, so count them here from the rows instead
+        grouptypes = dict(Group.objects.values_list('id', 'grouptype_id'))
+        memberships = list(GroupMembership.objects.values_list('group_id', 'member_id'))
+        n_members = Counter(group for group, member in memberships)
+        self.assertEqual(n_members, Counter(dict(Group.objects.values_list('id', 'n_members'))))
+        self.assertEqual(
+            {
+                id: (
+                    Counter(grouptypes.values())[id],
+                    len({group for group in n_members if grouptypes[group] == id}),
+                    Counter(grouptypes[group] for group, member in memberships)[id],
+                    len({member for group, member in memberships if grouptypes[group] == id}),
+                )
+                for id in GroupType.objects.values_list('id', flat=True)
+            },
+            {id: tuple(counters) for id, *counters in GroupType.objects.values_list('id', 'n_groups', 'n_groups_non_empty', 'n_members_total', 'n_members_unique')},
+        )
+
+        statistics, groups = {}, {}
+        for group, begin_date, end_date in GroupMembership.objects.values_list('group_id', 'group__begin_date', 'group__end_date'):
+            for year in range(begin_date.year, end_date.year + 1):
+                statistics.setdefault(year, Counter())['group_memberships_total'] += 1
+                groups.setdefault(year, set()).add(group)
+        for year, year_groups in groups.items():
+            statistics[year]['groups'] = len(year_groups)
+        for begin_date, end_date in Functionary.objects.values_list('begin_date', 'end_date'):
+            for year in range(begin_date.year, end_date.year + 1):
+                statistics.setdefault(year, Counter())['functionaries_total'] += 1
+        for type, begin_date in MemberType.objects.filter(type__in=['OM', 'ST']).values_list('type', 'begin_date'):
+            statistics.setdefault(begin_date.year, Counter())['members_ordinary' if type == 'OM' else 'members_stalm'] += 1
+        for acquired in DecorationOwnership.objects.values_list('acquired', flat=True):
+            statistics.setdefault(acquired.year, Counter())['decoration_ownerships'] += 1
+        fields = ['groups', 'group_memberships_total', 'functionaries_total', 'members_ordinary', 'members_stalm', 'decoration_ownerships']
+        self.assertEqual(
+            {year: tuple(counts[field] for field in fields) for year, counts in statistics.items()},
+            {year: tuple(counts) for year, *counts in YearStatistics.objects.values_list('year', *fields)},
+        )
+
+    def generate_and_roll_back(self, seed):
+        # Deleting everything again would be slow, since it is done one object at a time
+        with transaction.atomic():
+            self.generate(seed)
+            registry = self.get_registry()
+            transaction.set_rollback(True)
+        return registry
+
+    def test_seed(self):
+        registry = self.generate_and_roll_back(1)
+        self.assertFalse(Member.objects.exists())
+        self.assertEqual(registry, self.generate_and_roll_back(1))
+        self.assertNotEqual(registry, self.generate_and_roll_back(2))
+
+    def test_not_empty(self):
+        Member.objects.create(given_names='Sverker', surname='von Teknolog')
+        with self.assertRaises(CommandError):
+            self.generate()
@@ -0,0 +1,67 @@
+from django.test import TestCase
+from members.models import Member, ModelVersion
+from members.lookups import MemberLookup
+from members.name_index import member_name_index, VERSION_NAME
+
+
+class MemberNameIndexTest(TestCase):
+    def setUp(self):
+        self.member1 = Member.objects.create(given_names='Foo Bar', preferred_name='Bar', surname='Tester', allow_publish_info=True)
+        self.member2 = Member.objects.create(given_names='Foo Bar', surname='von Foo', comment='Foobar')
+        self.member3 = Member.objects.create(given_names='Abc', surname='Test', username='abcxyz', email='abc@example.com')
+        # The index lives on between tests, but the database does not
+        member_name_index.reset()
+
+    def search(self, q, **kwargs):
+        return [m.id for m in member_name_index.search(q.split(), **kwargs)]
+
+    def test_same_as_search_by_name(self):
+        for q in ['foo', 'Foo bar', 'test', 'est', 'fo', 'a', 'abc@', 'von foo', 'xyz', 'oo tes', 'bar tester']:
+            expected = [m.id for m in Member.objects.search_by_name(q.split(), True)]
+            self.assertEqual(expected, self.search(q), q)
+
+    def test_limit(self):
+        self.assertEqual(2, len(self.search('foo', limit=2)))
+        self.assertEqual([self.member2.id], self.search('foo', limit=1))
+
+    def test_no_queries_when_built(self):
+        self.search('foo')
+        with self.assertNumQueries(0):
+            self.search('test')
+            self.search('abc')
+
+    def test_incremental_save(self):
+        self.search('foo')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.member3.surname = 'Renamed'
+            self.member3.save()
+            member = Member.objects.create(given_names='New', surname='Renamer')
+        with self.assertNumQueries(0):
+            self.assertEqual([self.member3.id, member.id], self.search('rename'))
+            self.assertEqual([], self.search('test abc'))
+
+    def test_incremental_delete(self):
+        self.search('foo')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.member2.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual([self.member1.id], self.search('foo'))
+
+    def test_missed_change(self):
+        self.search('foo')
+        # Simulate a change in another process
+        ModelVersion.objects.bump(VERSION_NAME)
+        Member.objects.filter(id=self.member1.id).delete()
+        with self.assertNumQueries(0):
+            self.assertEqual([self.member2.id, self.member1.id], self.search('foo'))
+        member_name_index.checked -= member_name_index.check_interval
+        self.assertEqual([self.member2.id], self.search('foo'))
+
+    def test_bulk_update(self):
+        self.search('foo')
+        with self.captureOnCommitCallbacks(execute=True):
+            Member.objects.filter(id=self.member1.id).update(surname='Updated')
+        self.assertEqual([self.member1.id], self.search('updated'))
+
+    def test_lookup(self):
+        self.assertEqual(self.search('foo', limit=50), [m.id for m in MemberLookup().get_query('foo', None)])
@@ -0,0 +1,109 @@
+import os
+from io import StringIO
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase
+from katalogen import views as katalogen_views
+from members.models import *
+from registration.models import Applicant
+from teknologr.querycount import QueryBudgetTestMixin, QueryRecorder
+
+
+class QueryBudgetTestCase(QueryBudgetTestMixin, TestCase):
+    '''
+    Base class for the query budget tests of all apps, with a shared registry.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        # Small enough for the tests, but large enough for queries made per object to stand out
+        call_command('generate_fake_registry', members=200, years=10, group_types=5, functionary_types=8, decorations=4, applicants=20, seed=0, stdout=StringIO())
+        cls.members = list(Member.objects.order_by('id'))
+        cls.member = cls.members[0]
+        cls.group = Group.objects.filter(n_members__gt=0).order_by('id').first()
+        cls.functionary = Functionary.objects.order_by('id').first()
+        cls.decoration_ownership = DecorationOwnership.objects.order_by('id').first()
+        cls.member_type = MemberType.objects.order_by('id').first()
+        cls.applicant = Applicant.objects.order_by('id').first()
+        cls.year = cls.group.begin_date.year
+        # A user that is a member too
+        cls.user = User.objects.create_user(username=cls.members[1].username, password='teknolog')
+        User.objects.create_superuser(username='superuser', password='teknolog')
+
+    def setUp(self):
+        cache.clear()
+
+    def login_user(self):
+        self.client.login(username=self.user.username, password='teknolog')
+
+    def login_superuser(self):
+        self.client.login(username='superuser', password='teknolog')
+
+
+@patch('members.views.get_ldap_details', lambda username, refresh=False: {})
+@patch('members.views.get_bill_details', lambda member: {})
+class AdminQueryBudgetTest(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login_superuser()
+
+    def test_empty(self):
+        for category in ['members', 'grouptypes', 'functionarytypes', 'decorations', 'applicants']:
+            self.assertQueryBudget(f'/admin/{category}/')
+
+    def test_member(self):
+        self.assertQueryBudget(f'/admin/members/{self.member.id}/')
+
+    def test_member_accounts(self):
+        self.assertQueryBudget(f'/admin/members/{self.member.id}/accounts/')
+
+    def test_membertype_form(self):
+        self.assertQueryBudget(f'/admin/membertypes/{self.member_type.id}/form/')
+
+    def test_group_type(self):
+        self.assertQueryBudget(f'/admin/grouptypes/{self.group.grouptype_id}/')
+        self.assertQueryBudget(f'/admin/grouptypes/{self.group.grouptype_id}/{self.group.id}/')
+
+    def test_functionary_type(self):
+        self.assertQueryBudget(f'/admin/functionarytypes/{self.functionary.functionarytype_id}/')
+
+    def test_functionary_form(self):
+        self.assertQueryBudget(f'/admin/functionaries/{self.functionary.id}/form/')
+
+    def test_decoration(self):
+        self.assertQueryBudget(f'/admin/decorations/{self.decoration_ownership.decoration_id}/')
+
+    def test_decoration_ownership_form(self):
+        self.assertQueryBudget(f'/admin/decorationownerships/{self.decoration_ownership.id}/form/')
+
+    def test_applicant(self):
+        self.assertQueryBudget(f'/admin/applicants/{self.applicant.id}/')
+
+
+class QueryRecorderTest(QueryBudgetTestCase):
+    def test_repeated(self):
+        with QueryRecorder() as recorder:
+            for member in self.members[:20]:
+                list(member.functionaries.all())
+            list(Member.objects.filter(id__in=[1, 2]))
+            list(Member.objects.filter(id__in=[1, 2, 3]))
+        self.assertEqual(22, recorder.count)
+        repeated = recorder.get_repeated(10)
+        self.assertEqual(1, len(repeated))
+        self.assertIn('members_functionary', repeated[0][0])
+        self.assertEqual(20, repeated[0][1])
+        # The length of the IN list does not matter
+        self.assertEqual(2, len(recorder.get_repeated(1)))
+
+    @patch.dict(os.environ, {'QUERY_COUNT_MIDDLEWARE': 'True'})
+    def test_middleware(self):
+        client = Client()
+        client.login(username=self.user.username, password='teknolog')
+        response = client.get('/')
+        self.assertEqual('2', response['X-Query-Count'])
+
+        with patch.object(katalogen_views.home, 'query_budget', 1), self.assertLogs('teknologr.querycount', 'WARNING') as logs:
+            client.get('/')
+        self.assertIn('GET / made 2 queries, the budget is 1', logs.output[0])
@@ -1,6 +1,10 @@
 
+import os
+import time
+from unittest.mock import patch
 from rest_framework import status
 from api.tests import BaseAPITest
+from members.models import OutgoingMail
 
 class GetPageTests():
     def test_get_for_anonymous_users(self):
@@ -31,6 +35,66 @@ class MemberViewTest(BaseAPITest, GetPageTests):
         self.api_path = f'/admin/members/{self.m1.id}/'
 
 
+class MemberDeadMailTest(BaseAPITest):
+    def test_shown(self):
+        OutgoingMail.objects.queue('Ditt nya TF-lösenord', 'hemligt', 'noreply@example.com', [self.m1.email])
+        OutgoingMail.objects.queue('Ditt nya TF-lösenord', 'hemligt', 'noreply@example.com', [self.m2.email])
+        self.login_superuser()
+        response = self.client.get(f'/admin/members/{self.m1.id}/')
+        self.assertNotContains(response, 'kunde inte skickas')
+
+        OutgoingMail.objects.update(dead=True, last_error='Recipient address rejected')
+        for path in [f'/admin/members/{self.m1.id}/', f'/admin/members/{self.m1.id}/accounts/']:
+            response = self.client.get(path)
+            self.assertContains(response, f'till {self.m1.email} kunde inte skickas: Recipient address rejected', count=1)
+
+
+class MemberAccountsViewTest(BaseAPITest, GetPageTests):
+    def setUp(self):
+        super().setUp()
+        self.api_path = f'/admin/members/{self.m1.id}/accounts/'
+
+
+def slow_ldap_details(username, refresh=False):
+    time.sleep(0.5)
+    return {'username': username, 'groups': ['medlemmar']}
+
+
+def slow_bill_details(member):
+    time.sleep(0.5)
+    return {'acc': member.bill_code, 'id': member.username, 'balance': 12}
+
+
+@patch('members.views.get_ldap_details', slow_ldap_details)
+@patch('members.views.get_bill_details', slow_bill_details)
+class MemberAccountLookupsTest(BaseAPITest):
+    def setUp(self):
+        super().setUp()
+        self.m1.username = 'svakar'
+        self.m1.bill_code = '1001'
+        self.m1.save()
+        self.login_superuser()
+
+    def test_concurrent(self):
+        start = time.perf_counter()
+        response = self.client.get(f'/admin/members/{self.m1.id}/')
+        self.assertLess(time.perf_counter() - start, 0.9)
+        self.assertEqual(response.context['LDAP']['groups'], ['medlemmar'])
+        self.assertEqual(response.context['BILL']['balance'], 12)
+        self.assertFalse(response.context['accounts_pending'])
+
+    @patch.dict(os.environ, {'ACCOUNTS_TIMEOUT': '0.1'})
+    def test_pending(self):
+        response = self.client.get(f'/admin/members/{self.m1.id}/?refresh')
+        self.assertTrue(response.context['LDAP']['pending'])
+        self.assertTrue(response.context['BILL']['pending'])
+        self.assertContains(response, f'data-url="/admin/members/{self.m1.id}/accounts/?refresh"')
+
+        response = self.client.get(f'/admin/members/{self.m1.id}/accounts/')
+        self.assertContains(response, 'medlemmar')
+        self.assertContains(response, '12€')
+
+
 class DecorationOwnershipsViewTest(BaseAPITest, GetPageTests):
     def setUp(self):
         super().setUp()
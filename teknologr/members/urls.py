@@ -7,6 +7,7 @@ urlpatterns = [
     url(r'^$', RedirectView.as_view(url='/admin/members/'), name='home'),
     url(r'^(members|grouptypes|functionarytypes|decorations|applicants)/$', views.empty, name='empty'),
     url(r'^members/(\d+)/$', views.member, name='member'),
+    url(r'^members/(\d+)/accounts/$', views.member_accounts, name='member_accounts'),
     url(r'^membertypes/(\d+)/form/$', views.membertype_form),
     url(r'^grouptypes/(\d+)/$', views.group_type, name='group_type'),
     url(r'^grouptypes/(\d+)/(\d+)/$', views.group_type, name='group'),
@@ -1,4 +1,9 @@
 from datetime import date, datetime
+from functools import lru_cache
+from django.db import connection
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from locale import strxfrm
 from .models import *
 
 def getCurrentDate():
@@ -15,3 +20,39 @@ def getFirstDayOfCurrentYear():
 
 def getLastDayOfCurrentYear():
     return date(getCurrentYear(), 12, 31)
+
+
+def get_collation_key(s):
+    '''
+    Turn a string into a key that sorts exactly like locale.strxfrm(s), i.e. according to the collation of the current locale (sv_FI), but that can be stored in the database and sorted there.
+
+    The output of strxfrm() is a sequence of collation weights that only sorts correctly if compared code point by code point. Each weight is written in base 36, prefixed with the amount of digits, so that the key only consists of the characters 0-9 and a-z and shorter (smaller) weights always come before longer ones:
+        0 -> '10', 35 -> '1z', 36 -> '210', 1295 -> '2zz'
+
+    The database needs to compare the keys code point by code point as well, which the usual language specific collations do not do (the Swedish one for example treats v and w as the same letter on the first level). The key columns therefore use a binary collation, see SORT_KEY_COLLATION.
+    '''
+    return ''.join(_encode_collation_weight(ord(c)) for c in strxfrm(s))
+
+
+# The default BINARY collation of SQLite already compares code point by code point (the keys are plain ASCII anyway), while PostgreSQL uses the collation of the database unless told otherwise
+SORT_KEY_COLLATION = 'C' if connection.vendor == 'postgresql' else None
+
+
+# There are only so many different weights, and every name has many of them
+@lru_cache(maxsize=None)
+def _encode_collation_weight(weight):
+    digits = ''
+    while True:
+        weight, digit = divmod(weight, 36)
+        digits = '0123456789abcdefghijklmnopqrstuvwxyz'[digit] + digits
+        if not weight:
+            return f'{len(digits)}{digits}'
+
+
+def get_count_subquery(queryset, field, distinct=None):
+    '''
+    Count the objects in the queryset that refer to the outer object through the given field, using a correlated subquery. Unlike Count() annotations this does not join anything to the outer query, so several counts can be combined without multiplying the rows (and the counts) with each other. If distinct is given, the distinct values of that field are counted instead.
+    '''
+    count = Count(distinct, distinct=True) if distinct else Count('*')
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(count=count).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
@@ -6,10 +6,14 @@ from members.forms import *
 from members.programmes import DEGREE_PROGRAMME_CHOICES
 from registration.models import Applicant
 from registration.forms import RegistrationForm
-from api.ldap import LDAPAccountManager
+from api.ldap import LDAPAccountManager, LDAPError_to_string
 from api.bill import BILLAccountManager
+from api.utils import run_external
+from concurrent.futures import wait
 from getenv import env
+from ldap import LDAPError
 from locale import strxfrm
+from teknologr.querycount import query_budget
 
 
 def set_side_context(context, category, active_obj=None):
@@ -52,6 +56,7 @@ def set_side_context(context, category, active_obj=None):
     context['info_url'] = env('INFO_URL')
 
 
+@query_budget(3)
 @user_passes_test(lambda u: u.is_staff, login_url='/login/')
 def empty(request, category):
     context = {}
@@ -59,15 +64,59 @@ def empty(request, category):
     return render(request, 'base.html', context)
 
 
+def get_ldap_details(username, refresh=False):
+    try:
+        with LDAPAccountManager() as lm:
+            return lm.get_user_details(username, refresh=refresh)
+    except LDAPError as e:
+        return {'error': LDAPError_to_string(e)}
+
+
+def get_bill_details(member):
+    try:
+        details = BILLAccountManager().get_account_by_code(member.bill_code) or {}
+        username = details.get('id')
+        if username and member.username != username:
+            details['error'] = f'LDAP användarnamnen här ({member.username}) och i BILL ({username}) matchar inte'
+        return details
+    except Exception as e:
+        return {'error': str(e)}
+
+
+def start_account_lookups(member, refresh=False):
+    '''
+    Start looking up the LDAP and BILL accounts of the member concurrently. Returns a dict of context keys to futures.
+    '''
+    lookups = {}
+    if member.username:
+        lookups['LDAP'] = run_external(get_ldap_details, member.username, refresh)
+    if member.bill_code:
+        lookups['BILL'] = run_external(get_bill_details, member)
+    return lookups
+
+
+def get_account_lookup_results(lookups, timeout=None):
+    '''
+    Wait for the lookups started by start_account_lookups() for at most the given amount of seconds. The lookups that are not done by then are marked as pending.
+    '''
+    wait(lookups.values(), timeout=timeout)
+    return {key: future.result() if future.done() else {'pending': True} for key, future in lookups.items()}
+
+
+@query_budget(14)
 @user_passes_test(lambda u: u.is_staff, login_url='/login/')
 def member(request, member_id):
     '''
-    This is done in 10 queries:
-      1-5. Fetch Member with prefetched and ordered fields
-      6. SELECT Decoration (for form drop-down list)
-      7. SELECT FunctionaryType (for form drop-down list)
-      8-9. SELECT Group WHERE not_already_member (for form drop-down list)
-      10. SELECT Member (for side bar)
+    This is done in 14 queries:
+      1-2. SELECT Session and User (for checking that the user is staff)
+      3-7. Fetch Member with prefetched and ordered fields
+      8. SELECT Group WHERE not_already_member (for form drop-down list)
+      9. SELECT Member (for side bar)
+      10. SELECT OutgoingMail WHERE dead (the e-mails to the member that could not be sent)
+      11-12. SELECT Decoration (for form drop-down list)
+      13-14. SELECT FunctionaryType (for form drop-down list)
+
+    The choices of the drop-down lists are callables, which Django calls every time the choices are iterated. Rendering a select does that twice, once for the options and once for checking if the required attribute is needed.
     '''
     context = {}
     member = Member.objects.get_prefetched_or_404(member_id)
@@ -88,6 +137,9 @@ def member(request, member_id):
     else:
         form = MemberForm(instance=member)
 
+    # Look up the accounts in the background while the rest of the page is prepared
+    lookups = start_account_lookups(member, 'refresh' in request.GET)
+
     context['programmes'] = [
         programme
         for school, programmes in DEGREE_PROGRAMME_CHOICES.items()
@@ -114,30 +166,39 @@ def member(request, member_id):
     context['membertypes'] = member.member_types.all()
     context['add_mt_form'] = MemberTypeForm(initial={'member': member_id})
 
-    # Get user account info
-    if member.username:
-        try:
-            with LDAPAccountManager() as lm:
-                context['LDAP'] = lm.get_user_details(member.username)
-        except LDAPError as e:
-            context['LDAP'] = {'error': LDAPError_to_string(e)}
-
+    # Wait for the accounts, but not for too long. The ones that are still pending are loaded separately by the page.
+    accounts = get_account_lookup_results(lookups, timeout=env('ACCOUNTS_TIMEOUT', 1.5))
+    context.update(accounts)
+    context['dead_mails'] = OutgoingMail.objects.dead_to(member.email)
+    context['accounts_pending'] = any(details.get('pending') for details in accounts.values())
+    context['refresh'] = 'refresh' in request.GET
     if member.bill_code:
-        bm = BILLAccountManager()
-        context['bill_admin_url'] = bm.admin_url(member.bill_code)
-        try:
-            context['BILL'] = bm.get_account_by_code(member.bill_code) or {}
-            username = context['BILL'].get('id')
-            if username and member.username != username:
-                context['BILL']['error'] = f'LDAP användarnamnen här ({member.username}) och i BILL ({username}) matchar inte'
-        except Exception as e:
-            context['BILL'] = {'error': str(e)}
+        context['bill_admin_url'] = BILLAccountManager().admin_url(member.bill_code)
 
     # load side list items
     set_side_context(context, 'members', member)
     return render(request, 'member.html', context)
 
 
+@query_budget(4)
+@user_passes_test(lambda u: u.is_staff, login_url='/login/')
+def member_accounts(request, member_id):
+    '''
+    The account part of the member page, for when looking up the accounts took too long while loading the page.
+
+    This is done in 4 queries:
+      1-2. SELECT Session and User (for checking that the user is staff)
+      3. SELECT Member
+      4. SELECT OutgoingMail WHERE dead
+    '''
+    member = get_object_or_404(Member, id=member_id)
+    context = get_account_lookup_results(start_account_lookups(member, 'refresh' in request.GET))
+    context['member'] = member
+    context['dead_mails'] = OutgoingMail.objects.dead_to(member.email)
+    return render(request, 'member_accounts.html', context)
+
+
+@query_budget(3)
 @user_passes_test(lambda u: u.is_staff, login_url='/login/')
 def membertype_form(request, membertype_id):
     membertype = get_object_or_404(MemberType, id=membertype_id)
@@ -147,6 +208,7 @@ def membertype_form(request, membertype_id):
     })
 
 
+@query_budget(9)
 @user_passes_test(lambda u: u.is_staff, login_url='/login/')
 def group_type(request, grouptype_id, group_id=None):
     '''
@@ -182,6 +244,7 @@ def group_type(request, grouptype_id, group_id=None):
     return render(request, 'group.html', context)
 
 
+@query_budget(5)
 @user_passes_test(lambda u: u.is_staff, login_url='/login/')
 def functionary_type(request, functionarytype_id):
     '''
@@ -202,6 +265,7 @@ def functionary_type(request, functionarytype_id):
     return render(request, 'functionary.html', context)
 
 
+@query_budget(3)
 @user_passes_test(lambda u: u.is_staff, login_url='/login/')
 def functionary_form(request, functionary_id):
     functionary = get_object_or_404(Functionary, id=functionary_id)
@@ -211,6 +275,7 @@ def functionary_form(request, functionary_id):
     })
 
 
+@query_budget(5)
 @user_passes_test(lambda u: u.is_staff, login_url='/login/')
 def decoration(request, decoration_id):
     '''
@@ -231,6 +296,7 @@ def decoration(request, decoration_id):
     return render(request, 'decoration.html', context)
 
 
+@query_budget(3)
 @user_passes_test(lambda u: u.is_staff, login_url='/login/')
 def decoration_ownership_form(request, decration_ownership_id):
     decoration_ownership = get_object_or_404(DecorationOwnership, id=decration_ownership_id)
@@ -240,6 +306,7 @@ def decoration_ownership_form(request, decration_ownership_id):
     })
 
 
+@query_budget(4)
 @user_passes_test(lambda u: u.is_staff, login_url='/login/')
 def applicant(request, applicant_id):
     context = {}
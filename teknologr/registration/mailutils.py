@@ -1,5 +1,5 @@
-from django.core.mail import send_mail
 from getenv import env
+from members.models import OutgoingMail
 
 
 def mailApplicantSubmission(context, sender=env('EMAIL_APPLICANT_SENDER')):
@@ -19,9 +19,5 @@ def mailApplicantSubmission(context, sender=env('EMAIL_APPLICANT_SENDER')):
     Detta är ett automatiskt meddelande, du behöver inte svara på det.
     '''
 
-    return send_mail(
-        subject,
-        message,
-        sender,
-        [receiver],
-        fail_silently=False)
+    # Sent by the send_queued_mail command
+    return OutgoingMail.objects.queue(subject, message, sender, [receiver])
@@ -0,0 +1,139 @@
+import logging
+import re
+from collections import Counter
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from getenv import env
+
+'''
+Tools for keeping track of the amount of database queries made by the views. Every view declares a budget for the amount of queries it is allowed to make, which is checked by the tests (see QueryBudgetTestMixin) and optionally logged in production (see QueryCountMiddleware).
+'''
+
+logger = logging.getLogger(__name__)
+
+# A query that is repeated more times than this during one request is most likely run once per object in a loop (N+1)
+QUERY_REPEAT_LIMIT = env('QUERY_REPEAT_LIMIT', 10)
+
+
+def query_budget(budget):
+    '''
+    Decorator for declaring the max amount of queries a view is allowed to make per request, including the ones for loading the session and the user and for the cache. Needs to be the outermost decorator. The budgets of views that stream their content are for one chunk of objects.
+
+    The viewsets declare the budgets of their actions in a query_budgets dict instead.
+    '''
+    def decorator(view):
+        view.query_budget = budget
+        return view
+    return decorator
+
+
+def get_query_budget(view, method):
+    '''
+    Returns the query budget of the resolved view function for the given HTTP method, or None if it has none.
+    '''
+    if hasattr(view, 'actions'):
+        # A viewset
+        return getattr(view.cls, 'query_budgets', {}).get(view.actions.get(method.lower()))
+    return getattr(view, 'query_budget', None)
+
+
+class QueryRecorder:
+    '''
+    Records the SQL of all queries made on a database connection of the current thread, between start() and stop(), or inside a with block.
+    '''
+
+    def __init__(self, using='default'):
+        self.connection = connections[using]
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def start(self):
+        self.connection.execute_wrappers.append(self)
+        return self
+
+    def stop(self):
+        if self in self.connection.execute_wrappers:
+            self.connection.execute_wrappers.remove(self)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @staticmethod
+    def get_shape(sql):
+        '''
+        Returns the SQL without the details that change between otherwise identical queries, i.e. the length of IN lists and the names of savepoints. The values themselves are always parameters.
+        '''
+        sql = re.sub(r'%s(, %s)+', '%s, ...', sql)
+        return re.sub(r'"s\d+_x\d+"', '"s"', sql)
+
+    def get_repeated(self, limit=QUERY_REPEAT_LIMIT):
+        '''
+        Returns a list of (query, count) pairs for the queries that were repeated more than limit times.
+        '''
+        counts = Counter(self.get_shape(sql) for sql in self.queries)
+        return [(sql, count) for sql, count in counts.most_common() if count > limit]
+
+
+class QueryCountMiddleware:
+    '''
+    Logs a warning for every request that makes more queries than its view's budget (see query_budget()), or that repeats a query more than QUERY_REPEAT_LIMIT times. The amount of queries is also added to the X-Query-Count header.
+
+    Streaming responses (the dumps) make their queries while the content is sent, one set of queries per chunk of objects (see api.utils.iterate_in_chunks()), so they can not be checked here. They are only checked by the tests, where everything fits in one chunk.
+
+    Only used if QUERY_COUNT_MIDDLEWARE is set, since recording the queries has a small cost.
+    '''
+
+    def __init__(self, get_response):
+        if not env('QUERY_COUNT_MIDDLEWARE', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        if response.streaming:
+            return response
+
+        match = request.resolver_match
+        budget = get_query_budget(match.func, request.method) if match else None
+        if budget is not None and recorder.count > budget:
+            logger.warning('%s %s made %d queries, the budget is %d', request.method, request.path, recorder.count, budget)
+        for sql, count in recorder.get_repeated():
+            logger.warning('%s %s repeated a query %d times: %s', request.method, request.path, count, sql)
+        response['X-Query-Count'] = str(recorder.count)
+        return response
+
+
+class QueryBudgetTestMixin:
+    '''
+    Mixin for TestCases for checking that the views stay within their query budgets and do not repeat queries.
+    '''
+
+    repeat_limit = QUERY_REPEAT_LIMIT
+
+    def assertQueryBudget(self, path, method='get', data=None, **extra):
+        '''
+        Requests the path and checks the amount of queries. The content of streaming responses is consumed first. TestCase never commits, so the on-commit callbacks are run and counted too, as they would be at the end of a real request. Returns the response.
+        '''
+        with QueryRecorder() as recorder, self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(path, data, **extra)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, path)
+
+        budget = get_query_budget(response.resolver_match.func, method)
+        self.assertIsNotNone(budget, f'{path} has no query budget')
+        queries = '\n'.join(recorder.queries)
+        self.assertLessEqual(recorder.count, budget, f'{path} made {recorder.count} queries, the budget is {budget}:\n{queries}')
+        self.assertEqual([], recorder.get_repeated(self.repeat_limit), f'{path} repeated queries')
+        return response
@@ -92,6 +92,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Only used if QUERY_COUNT_MIDDLEWARE is set
+    'teknologr.querycount.QueryCountMiddleware',
 ]
 
 ROOT_URLCONF = 'teknologr.urls'
@@ -132,6 +134,12 @@ if not DEBUG:
                 'level': 'INFO',
                 'propagate': True,
             },
+            # For example the e-mails that could not be sent
+            'members': {
+                'handlers': ['file'],
+                'level': 'INFO',
+                'propagate': True,
+            },
         },
     }
 '''
@@ -163,6 +171,19 @@ DATABASES = {
 
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# The cache is shared between all processes, since cached data is invalidated when it changes. The table is created with `python manage.py createcachetable`.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'teknologr_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 